@@ -6,6 +6,8 @@ using regular expressions.
 
 Main components:
 - replace_block: Main function for replacing text blocks
+- transform_text/transform_bytes: The same transformation on text or bytes in memory
+- atransform_files/make_args: asyncio API for transforming files with bounded concurrency
 - patterns: Pre-defined regex patterns
 - FileLineRange: Class representing a range of lines in a file
 """
@@ -14,6 +16,8 @@ from file_transform_tools.replace_block import replace_or_insert_block
 from file_transform_tools.re_pattern_library import patterns
 from file_transform_tools.util.find_block import FileLineRange
 from file_transform_tools.util.cli import ActionIfBlockNotFound
+from file_transform_tools.util.transform import TransformResult, transform_text, transform_bytes
+from file_transform_tools.util.async_transform import atransform_files, make_args
 
 __version__ = "0.1.0"
 
@@ -22,4 +26,9 @@ __all__ = [
     'patterns',
     'FileLineRange',
     'ActionIfBlockNotFound',
+    'TransformResult',
+    'transform_text',
+    'transform_bytes',
+    'atransform_files',
+    'make_args',
 ]
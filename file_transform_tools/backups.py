@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import argparse
+import datetime
+import os
+import sys
+from file_transform_tools.util.backup_store import BackupStore
+from file_transform_tools.util.cli import default_store_path
+
+def parse_args()->argparse.Namespace:
+    parser = argparse.ArgumentParser(description="List, inspect, restore and prune the backups replace-block made with --backup-store")
+    parser.add_argument("--store", type=str, default=default_store_path(), metavar='DIR', help=f"The backup store (default {default_store_path()})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help="List the snapshots, oldest first")
+    list_parser.add_argument("filename", type=str, nargs='?', help="Only list the snapshots of this file")
+
+    show_parser = subparsers.add_parser('show', help="Write a snapshot's contents to stdout")
+    show_parser.add_argument("id", type=int)
+
+    diff_parser = subparsers.add_parser('diff', help="Show the changes made to a file since a snapshot of it")
+    diff_parser.add_argument("id", type=int)
+
+    restore_parser = subparsers.add_parser('restore', help="Put a snapshot back in place of the file it was taken of")
+    restore_parser.add_argument("id", type=int)
+    restore_parser.add_argument("--to", type=str, metavar='FILE', help="Restore to FILE instead")
+
+    prune_parser = subparsers.add_parser('prune', help="Delete old snapshots (the newest snapshot of each file is always kept)")
+    prune_parser.add_argument("--max-mb", type=int, metavar='N', help="Delete the oldest snapshots until the store holds at most N MiB")
+    prune_parser.add_argument("--max-age-days", type=float, metavar='DAYS', help="Delete snapshots older than DAYS")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.store):
+        print(f"error: backup store '{args.store}' not found")
+        return 1
+
+    with BackupStore(args.store) as backup_store:
+        try:
+            if args.command == 'list':
+                for snapshot in backup_store.snapshots(args.filename):
+                    created = datetime.datetime.fromtimestamp(snapshot.created_ns/1e9).strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"{snapshot.id:>8}  {created}  {snapshot.size:>10}  {snapshot.content_hash[:12]}  {snapshot.path}")
+            elif args.command == 'show':
+                sys.stdout.buffer.write(backup_store.read(args.id))
+            elif args.command == 'diff':
+                import difflib
+                snapshot = backup_store.get(args.id)
+                old_lines = backup_store.read(args.id).decode('utf-8', errors='replace').splitlines(keepends=True)
+                try:
+                    with open(snapshot.path, 'r', errors='replace') as f:
+                        new_lines = f.readlines()
+                except FileNotFoundError:
+                    new_lines = []
+                sys.stdout.writelines(difflib.unified_diff(old_lines, new_lines, fromfile=f"{snapshot.path} (snapshot {snapshot.id})", tofile=snapshot.path))
+            elif args.command == 'restore':
+                print(f"restored {backup_store.restore(args.id, dest=args.to)}")
+            elif args.command == 'prune':
+                if args.max_mb is None and args.max_age_days is None:
+                    print("error: give --max-mb and/or --max-age-days")
+                    return 1
+                before = backup_store.stored_bytes()
+                deleted = backup_store.evict(max_bytes=args.max_mb*1024*1024 if args.max_mb is not None else None, max_age_ns=int(args.max_age_days*86400e9) if args.max_age_days is not None else None)
+                print(f"deleted {deleted} snapshot(s), {before - backup_store.stored_bytes()} bytes freed")
+        except KeyError as e:
+            print(f"error: {e.args[0]}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
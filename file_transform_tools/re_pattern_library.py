@@ -1,45 +1,213 @@
+from __future__ import annotations
 from enum import Enum
+from functools import lru_cache
 import re
-import sys
+try:
+    from re import _constants, _parser
+except ImportError:
+    # before Python 3.11 the regex parser lived in top-level modules
+    import sre_constants as _constants
+    import sre_parse as _parser
 from typing import Generator, List
-import unittest
-from file_transform_tools.util.cli import COLOR_BLUE_BKG, COLOR_RESET, COLOR_RED_BKG, COLOR_GREEN_BKG, COLOR_YELLOW_BKG
+from file_transform_tools.util.block_matcher import BlockPattern
+from file_transform_tools.util.pattern_registry import PatternRegistry, compile_pattern, compile_block_pattern
 
-bash_rc_export_path_pattern = re.compile(
-    r"""
+#
+# Built-in patterns
+#
+# Pattern sources are kept as strings and only compiled on first use (see util/pattern_registry.py);
+# the module-level *_pattern names below are compiled when they are first accessed.
+#
+
+BASH_RC_EXPORT_PATH_REGEX = r"""
     ^\#.*\n                                  # First comment line
     ^\#.*github\.com.mikegoelzer/ecp5-first-steps.*\n  # Second line must contain the URL
     ^\#.*\n                                  # Third comment line (could be any comment)
     (^export\s+PATH=.*$\n)*                      # export PATH=...
     (^\s*\n)?                                    # optional empty line
     (?:^export\s+RISC[^=]+=.*$\n)*            # zero or more export RISC*=... lines
-    """, 
-    re.MULTILINE | re.VERBOSE
-)
+    """
 
-ifdef_slang_pattern = re.compile(
-    r"""
+IFDEF_SLANG_REGEX = r"""
     ^\s*\`ifdef\s+SLANG.*\n                  # `ifdef SLANG
     ^(.*\n)*                                 # zero or more lines
     ^\s*\`endif.*$                           # `endif
-    """, 
-    re.MULTILINE | re.VERBOSE
-)
+    """
+
+# the same blocks as IFDEF_SLANG_REGEX, but matched in linear time by a BlockPattern and ending at the
+# `endif that closes the `ifdef SLANG rather than the last `endif in the file
+IFDEF_SLANG_BLOCK = {
+    'begin': r"\`ifdef\s+SLANG",
+    'open_marker': r"\`(?:ifdef|ifndef)\b",
+    'close_marker': r"\`endif\b",
+}
 
-patterns = {
+patterns = PatternRegistry({
     "bash_rc_export_path": {
-        'pat': bash_rc_export_path_pattern, 
+        'regex': BASH_RC_EXPORT_PATH_REGEX,
+        'flags': re.MULTILINE | re.VERBOSE,
+        'literals': ['github.com', 'mikegoelzer/ecp5-first-steps'],
         'desc': 'for deleting or replacing lines in ~/.bashrc added by ~/ecp5-first-steps/my-designs/util/update_bashrc.sh'
     },
     "ifdef_slang": {
-        'pat': ifdef_slang_pattern, 
+        **IFDEF_SLANG_BLOCK,
+        'literals': ['`ifdef', 'SLANG', '`endif'],
         'desc': 'for modifying a block of lines that is wrapped in `ifdef SLANG ... `endif'
     },
-}
+})
+
+def __getattr__(name:str):
+    # compile the module-level patterns on first access rather than at import
+    if name == 'bash_rc_export_path_pattern':
+        return compile_pattern(BASH_RC_EXPORT_PATH_REGEX, re.MULTILINE | re.VERBOSE)
+    elif name == 'ifdef_slang_pattern':
+        return compile_pattern(IFDEF_SLANG_REGEX, re.MULTILINE | re.VERBOSE)
+    elif name == 'ifdef_slang_block_pattern':
+        return compile_block_pattern(**IFDEF_SLANG_BLOCK)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#
+# Required literals
+#
+# Each entry in patterns may list 'literals': strings that every match must contain.  A file that
+# doesn't contain all of them cannot match, so it can be skipped with a substring search on its raw
+# bytes before it is decoded or the regex is run.  Entries without 'literals' get them derived from
+# the pattern by derive_required_literals().
+#
+# Literals never span a line break: the raw bytes still have the file's own line endings (e.g. \r\n),
+# while the pattern is matched against the text after universal-newline translation.
+#
+
+# derived literals shorter than this are too common to be worth searching for
+MIN_DERIVED_LITERAL_LEN = 3
+
+def _collect_required_literals(parsed, literals:list[str]):
+    """
+    Appends to literals every run of consecutive literal characters that any match of the parsed
+    (sub)pattern must contain.  Only parts that every match goes through are looked at: groups and
+    repeats of at least one; alternations, optional parts and case-insensitive groups are skipped.
+    """
+    run = []
+    def end_run():
+        if len(run) > 0:
+            literals.append(''.join(run))
+            run.clear()
+
+    for op, av in parsed:
+        if op == _constants.LITERAL and chr(av) in '\r\n':
+            # a line break in the text may be \r\n or \r in the raw bytes
+            end_run()
+        elif op == _constants.LITERAL:
+            run.append(chr(av))
+        elif op == _constants.AT:
+            # anchors are zero-width, so the characters either side are still adjacent
+            continue
+        elif op == _constants.SUBPATTERN:
+            end_run()
+            add_flags = av[1]
+            if not add_flags & re.IGNORECASE:
+                _collect_required_literals(av[-1], literals)
+        elif op in (_constants.MAX_REPEAT, _constants.MIN_REPEAT) and av[0] >= 1:
+            end_run()
+            _collect_required_literals(av[2], literals)
+        else:
+            end_run()
+    end_run()
+
+@lru_cache(maxsize=None)
+def derive_required_literals(pattern:re.Pattern)->tuple[str|bytes, ...]:
+    """
+    Returns the literal strings that every match of pattern must contain, longest first, found by
+    walking the parsed regex.  Returns an empty tuple if nothing useful can be derived (for example
+    when the whole pattern is case-insensitive).
+    """
+    if isinstance(pattern, BlockPattern):
+        return pattern.required_literals
+    if pattern.flags & re.IGNORECASE:
+        return ()
+    source = pattern.pattern
+    if isinstance(source, bytes):
+        source = source.decode('latin-1')
+    literals = []
+    _collect_required_literals(_parser.parse(source, pattern.flags & ~re.UNICODE), literals)
+    literals = set(literal for literal in literals if len(literal) >= MIN_DERIVED_LITERAL_LEN)
+    if isinstance(pattern.pattern, bytes):
+        literals = set(literal.encode('latin-1') for literal in literals)
+    return tuple(sorted(literals, key=lambda literal: (-len(literal), literal)))
+
+def _is_whitespace_repeat(op, av)->bool:
+    """
+    True for an optional repeat of whitespace, such as \\s* or [ \\t]*.
+    """
+    if op not in (_constants.MAX_REPEAT, _constants.MIN_REPEAT) or av[0] != 0 or len(av[2]) != 1:
+        return False
+    item_op, item_av = av[2][0]
+    if item_op == _constants.LITERAL:
+        return chr(item_av).isspace()
+    if item_op != _constants.IN:
+        return False
+    return all((set_op == _constants.LITERAL and chr(set_av).isspace()) or (set_op == _constants.CATEGORY and set_av == _constants.CATEGORY_SPACE) for set_op, set_av in item_av)
+
+@lru_cache(maxsize=None)
+def derive_leading_literal(pattern:re.Pattern)->tuple[str, bool]|None:
+    """
+    Returns (literal, at_line_start) if every match of pattern begins with literal, or with ^ (in
+    MULTILINE mode) and optional whitespace and then literal, which at_line_start says.  A match can then
+    only begin at the literal, or for at_line_start, at the start of its line or of the whitespace-only
+    lines before it.  Returns None if there is no such literal, for case-insensitive and bytes patterns,
+    and for BlockPatterns (whose blocks begin at their begin lines).
+    """
+    if isinstance(pattern, BlockPattern) or isinstance(pattern.pattern, bytes) or pattern.flags & re.IGNORECASE:
+        return None
+    items = list(_parser.parse(pattern.pattern, pattern.flags & ~re.UNICODE))
+    at_line_start = False
+    if len(items) > 0 and items[0] == (_constants.AT, _constants.AT_BEGINNING):
+        if not pattern.flags & re.MULTILINE:
+            return None
+        at_line_start = True
+        items.pop(0)
+        while len(items) > 0 and _is_whitespace_repeat(*items[0]):
+            items.pop(0)
+    literal = []
+    for op, av in items:
+        if op != _constants.LITERAL or chr(av) in '\r\n':
+            break
+        literal.append(chr(av))
+    if len(literal) == 0:
+        return None
+    return ''.join(literal), at_line_start
+
+def required_literals(pattern_entry:dict)->list[str|bytes]:
+    """
+    Returns the literals that every match of a patterns entry must contain: the entry's 'literals' if
+    it declares them, or else the ones derived from its pattern.  Declared literals are split at line
+    breaks, like derived ones.  They are left as str so FileBuffer.contains_all() can encode them the
+    way the buffer is decoded.
+    """
+    literals = pattern_entry.get('literals')
+    if literals is None:
+        return list(derive_required_literals(pattern_entry['pat']))
+    split_literals = []
+    for literal in literals:
+        newline, carriage_return = ('\n', '\r') if isinstance(literal, str) else (b'\n', b'\r')
+        split_literals.extend(part for part in literal.replace(carriage_return, newline).split(newline) if part)
+    return split_literals
 
 class PatternMatcherModifiers(Enum):
     NO_TRAILING_NEWLINES = 1
 
+@lru_cache(maxsize=None)
+def as_bytes_pattern(pattern:re.Pattern)->re.Pattern:
+    """
+    Returns a bytes version of a str pattern so it can be run directly on bytes, bytearrays or an mmap
+    without decoding.  The pattern source is encoded as UTF-8; re.UNICODE is dropped because it is not
+    allowed for bytes patterns.  Bytes patterns and BlockPatterns (which handle bytes themselves) are
+    returned unchanged.
+    """
+    if isinstance(pattern, BlockPattern) or isinstance(pattern.pattern, bytes):
+        return pattern
+    return re.compile(pattern.pattern.encode('utf-8'), pattern.flags & ~re.UNICODE)
+
 class ModifiedPatternMatcher:
     """
     A wrapper around a re.Pattern that allows for modifiers to be applied to each match
@@ -50,9 +218,17 @@ class ModifiedPatternMatcher:
     position of the match and the first character position after the match.
 
     An empty list means no matches were found.
+
+    s can be a str, or a bytes-like buffer such as an mmap.  In the latter case a str pattern
+    is converted to the equivalent bytes pattern with as_bytes_pattern().
     """
-    def __init__(self, s:str, pattern:re.Pattern, modifier:PatternMatcherModifiers=None):
+    def __init__(self, s:str|bytes, pattern:re.Pattern, modifier:PatternMatcherModifiers=None):
         self.s = s
+        if not isinstance(s, str):
+            pattern = as_bytes_pattern(pattern)
+            self.newline = b'\n'
+        else:
+            self.newline = '\n'
         self.pattern = pattern
         self.modifier = modifier
 
@@ -73,7 +249,8 @@ class ModifiedPatternMatcher:
         """
         start_pos, end_pos = start_end_pos
         if self.modifier == PatternMatcherModifiers.NO_TRAILING_NEWLINES:
-            while end_pos > start_pos and self.s[end_pos-1] == '\n':
+            # slice rather than index so this works for str, bytes and mmap alike
+            while end_pos > start_pos and self.s[end_pos-1:end_pos] == self.newline:
                 end_pos -= 1
         return (start_pos, end_pos)
 
@@ -83,218 +260,3 @@ class ModifiedPatternMatcher:
         """
         for (start_pos, end_pos) in self._make_modified_matches_list():
             yield (start_pos,end_pos)
-
-#
-# This unit test class is located here for easier visual inspection,
-# but it is run from the main test module in tests/test_replaceblock.py
-#
-class TestPatterns(unittest.TestCase):
-    disable_color=True
-    
-    def test_bash_rc_export_path(self):
-        did_match = False
-        s = """
-#
-# Lattice Diamond license
-#
-LATTICE_LICENSE_FILE=/usr/local/diamond/3.13/license/license.dat
-
-#
-# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
-# 
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/template_tool:/home/mwg/ecp5-first-steps/my-designs/util/continuous_make:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper:/home/mwg/ecp5-first-steps/my-designs/util/clog2
-"""
-        # for match in bash_rc_export_path_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-
-        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-
-        self.assertTrue(did_match)
-
-    def test_bash_rc_export_path_with_new_lines(self):
-        did_match = False
-        s = """
-#
-# Added by brew
-#
-eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
-
-#
-# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
-#
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
-
-export RISC_REPO_ROOT=/home/mwg/ecp5-first-steps
-export RISC_COMMON_DIR=/home/mwg/ecp5-first-steps/my-designs/common
-export RISCV_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc/riscv
-export RISCV_SOC_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc
-"""
-        # for match in bash_rc_export_path_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-        self.assertTrue(did_match)
-
-    def test_bash_rc_export_path_with_no_riscv_lines(self):
-        did_match = False
-        s = """
-#
-# Added by brew
-#
-eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
-
-#
-# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
-#
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
-
-
-
-
-"""
-        # for match in bash_rc_export_path_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_YELLOW_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-        self.assertTrue(did_match)
-
-    def test_bash_rc_export_path_with_new_lines_and_two_blocks(self):
-        did_match = False
-        s = """
-#
-# Added by brew
-#
-eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
-
-#
-# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
-#
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
-
-export RISC_REPO_ROOT=/home/mwg/ecp5-first-steps
-export RISC_COMMON_DIR=/home/mwg/ecp5-first-steps/my-designs/common
-export RISCV_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc/riscv
-export RISCV_SOC_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc
-
-#
-# Added by brew
-#
-eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
-"""
-        # for match in bash_rc_export_path_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-        self.assertTrue(did_match)
-
-    def test_ifdef_slang(self):
-        did_match = False
-        s = """
-// This is the beginning of the file.
-
-`ifdef SLANG  // maybe some comment
-    `include "my_slang_file.sv"  // some comment
-    `include "my_slang_file2.sv" // some other comment
-`endif // maybe some comment
-
-// This is the rest of the file...
-"""
-        # for match in ifdef_slang_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-        modified_pattern_matcher = ModifiedPatternMatcher(s, ifdef_slang_pattern, modifier=PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-        self.assertTrue(did_match)
-
-    def test_bash_rc_export_path_with_env_vars_run_twice(self):
-        did_match = False
-        s = """
-#
-# Lattice Diamond license
-#
-LATTICE_LICENSE_FILE=/usr/local/diamond/3.13/license/license.dat
-
-#
-# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
-# 
-export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/template_tool:/home/mwg/ecp5-first-steps/my-designs/util/continuous_make:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper:/home/mwg/ecp5-first-steps/my-designs/util/clog2
-export FOO=bar
-export BAR="baz"
-export BAZ='qux'
-"""
-        # for match in bash_rc_export_path_pattern.finditer(s):
-        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
-        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
-        #     did_match = True
-        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
-        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
-            if not self.disable_color:
-                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
-            else:
-                print(f"{s[start_pos:end_pos]}")
-            did_match = True
-        self.assertTrue(did_match)
-
-if __name__ == "__main__":
-    test_runner = unittest.TextTestRunner(verbosity=2)
-    test_suite = unittest.TestLoader().loadTestsFromModule(sys.modules[__name__])
-    result = test_runner.run(test_suite)
-    if result.wasSuccessful():
-        print("✅ all tests passed!")
-        sys.exit(0)
-    else:
-        print("❌ some tests failed")
-        sys.exit(1)
@@ -1,77 +1,123 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+import contextlib
 import sys
-from file_transform_tools.util.cli import parse_args, ActionIfBlockNotFound
+from file_transform_tools.util.cli import STDIN_FILENAME, parse_args, ActionIfBlockNotFound
 from file_transform_tools.re_pattern_library import patterns
-from file_transform_tools.util.find_block import find_lines_to_replace, FileLineRange
-from file_transform_tools.util.replace_or_insert import replace_or_insert_block, do_dry_run_with_diff
-from file_transform_tools.util.backup import CreateBackupInstructions
+from file_transform_tools.util.find_block import FileLineRange
+from file_transform_tools.util.replace_or_insert import replace_or_insert_block
+from file_transform_tools.util.process_file import finish_run, process_file
+
+def run_filter(args)->int:
+    """
+    Filters stdin to stdout, for '-' as the filename.  Anything else that would be printed (errors, -v
+    output) goes to stderr, so stdout carries nothing but the transformed text.
+    """
+    from file_transform_tools.util.stream_filter import filter_stream
+    from file_transform_tools.util.process_file import default_affix, get_rules
+    from file_transform_tools.util.replace_or_insert import RuleConflictError
+    affix = default_affix(args)
+    rules = get_rules(args, args.replacement)
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            unmatched = filter_stream(sys.stdin.buffer, out, rules, args.action, affix=affix, blank_line_control=args.blank_line_control, max_span=args.max_span_kb*1024)
+        except RuleConflictError as e:
+            print(f"error: {e}")
+            return 1
+        if args.action == ActionIfBlockNotFound.REPLACE_ONLY and unmatched:
+            for pattern_name in unmatched:
+                which_block = f"block for pattern '{pattern_name}'" if len(rules) > 1 else "block"
+                print(f"error: {which_block} not found but nothing to do without --append/-A or --prepend/-P")
+            return 1
+    return 0
 
 def main():
     args = parse_args(patterns)
+    if args.filename == [STDIN_FILENAME]:
+        return run_filter(args)
 
-    # read replacement text
+    # read replacement text, from stdin for the one given as '-'
+    stdin_text = None
+    if args.replacement == '-' or any(rule.replacement_text == '-' for rule in args.rules):
+        stdin_text = sys.stdin.read()
+    args.rules = [rule._replace(replacement_text=stdin_text) if rule.replacement_text == '-' else rule for rule in args.rules]
     if args.replacement == '-':
-        replacement_text = sys.stdin.read()
+        replacement_text = stdin_text
     else:
         replacement_text = args.replacement
 
+    # --manifest gives each file its own rules; they are passed alongside args rather than in them so
+    # the workers only get the rules for the file they are working on
+    rules_by_file = getattr(args, 'manifest_rules', None)
+    args.manifest_rules = None
+
+    # --delta: every file's diff goes through one delta process rather than one per file
+    if args.delta:
+        from file_transform_tools.util.which import stdout_through_delta, which_delta
+        if not which_delta(print_message=True):
+            return 1
+        output_context = stdout_through_delta()
+    else:
+        output_context = contextlib.nullcontext()
+
+    with output_context:
+        error_count = run(args, replacement_text, rules_by_file)
+
+    if error_count > 0:
+        return 1
+    else:
+        return 0
+
+def run(args, replacement_text:str|None, rules_by_file:dict|None)->int:
+    """
+    Processes every input file and returns the total error count.
+    """
     error_count = 0
+    create_backup_instructions = None
+    # --emit-patch: each file's part of the patch is written in input order as its result comes in
+    patch_file = open(args.emit_patch, 'w') if args.emit_patch else None
+    patched_count = 0
+    # for the --fsync batch sync at the end
+    changed_filenames = []
     try:
         # track the backup instructions so we can print them at the end
         if args.backup:
+            from file_transform_tools.util.backup import CreateBackupInstructions
             create_backup_instructions = CreateBackupInstructions()
         else:
             create_backup_instructions = None
 
-        for filename in args.filename:
-            # find lines matching the pattern
-            if args.pattern_name:
-                pattern = patterns[args.pattern_name]['pat']
-                line_ranges = find_lines_to_replace(filename, pattern=pattern, verbose=args.verbose)
-                if len(line_ranges) == 0:
-                    # we were asked to replace only, but there's nothing to replace
-                    if args.action == ActionIfBlockNotFound.REPLACE_ONLY:
-                        print("error: block not found but nothing to do without --append/-A or --prepend/-P")
-                        error_count += 1
-                    # we were asked to replace or append, there's nothing to replace, so we are appending.  modify the
-                    # replacement str with -A's argument if any
-                    elif args.action == ActionIfBlockNotFound.REPLACE_OR_APPEND:
-                        replacement_text = args.append + replacement_text
-                    # ditto for prepend
-                    elif args.action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
-                        replacement_text = replacement_text + args.prepend
-            else:
-                line_ranges = []
-
-            # blank line control from -w option
-            blank_line_control = args.blank_line_control
-            if blank_line_control is not None:
-                desired_preceding_newlines = blank_line_control[0]
-                desired_trailing_newlines = blank_line_control[1]
-            else:
-                desired_preceding_newlines = None
-                desired_trailing_newlines = None
+        from file_transform_tools.util.walk import iter_input_files
+        filenames = iter_input_files(args.filename, args)
+        if args.jobs > 1 and (len(args.filename) > 1 or args.recursive):
+            # the pool hands results back in input order, with each file's output captured
+            from file_transform_tools.util.parallel import run_parallel
+            results = run_parallel(filenames, args, replacement_text, jobs=args.jobs, max_in_flight_bytes=args.max_in_flight_mb*1024*1024, rules_by_file=rules_by_file)
+        else:
+            results = ((process_file(filename, args, replacement_text, rules=rules_by_file[filename] if rules_by_file is not None else None), None) for filename in filenames)
 
-            # do the replacement(s)
-            try:
-                if args.dry_run:
-                    ret = do_dry_run_with_diff(filename, line_ranges=line_ranges, action=args.action, replacement_text=replacement_text, verbose=args.verbose, keep_temp_file=args.preserve_temp_file_dry_run, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
-                    error_count += ret
-                else:
-                    replace_or_insert_block(filename, line_ranges, action=args.action, replacement_text=replacement_text, outfile=args.outfile, verbose=args.verbose, create_backup=args.backup, create_backup_instructions=create_backup_instructions, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
-            except Exception as e:
-                import traceback
-                print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
-                error_count += 1
+        for file_result, output in results:
+            if output:
+                print(output, end='')
+            error_count += file_result.error_count
+            if file_result.changed:
+                changed_filenames.append(file_result.filename)
+            if patch_file is not None and file_result.patch:
+                patch_file.write(file_result.patch)
+                patched_count += 1
+            for filename, backup_filename in file_result.backups:
+                create_backup_instructions.append(filename, backup_filename)
+        finish_run(args, changed_filenames)
+        if patch_file is not None:
+            print(f"wrote the changes to {patched_count} file(s) to {args.emit_patch}")
     finally:
+        if patch_file is not None:
+            patch_file.close()
         if create_backup_instructions is not None and not create_backup_instructions.is_empty():
             print(create_backup_instructions.get_instructions_str())
-
-    if error_count > 0:
-        return 1
-    else:
-        return 0
+    return error_count
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import argparse
+from typing import AsyncGenerator, Iterable
+from file_transform_tools.re_pattern_library import patterns
+from file_transform_tools.util.cli import STDIN_FILENAME, parse_args
+from file_transform_tools.util.process_file import FileResult, finish_run
+
+# asyncio and the process pool are imported when atransform_files() runs, so importing the package stays cheap
+
+# what next() returns once the filenames run out
+_NO_MORE_FILENAMES = object()
+
+def make_args(*cli_options:str)->argparse.Namespace:
+    """
+    Parses replace-block command line options (everything but the filenames, e.g. '-pat', 'name', '-r',
+    'text', '-b', '-w', '1', '0') into the args atransform_files() takes.  There is no overwrite prompt.
+    Bad options are reported the way replace-block reports them: printed, then SystemExit.
+
+    Raises ValueError for options that read stdin ('-r -', or '-' as a filename), which only
+    replace-block itself does (pass the replacement text itself instead), and for the ones that
+    atransform_files() has its own way of doing or that only make sense on a terminal: -j (use
+    concurrency), --emit-patch (make_patch() returns each file's patch) and --delta.
+    """
+    args = parse_args(patterns, argv=[*cli_options, '-y'], filenames_required=False)
+    if STDIN_FILENAME in args.filename:
+        raise ValueError(f"'{STDIN_FILENAME}' (filter stdin to stdout) is only for replace-block; pass the files to atransform_files()")
+    if args.replacement == STDIN_FILENAME or any(rule.replacement_text == STDIN_FILENAME for rule in args.rules):
+        raise ValueError(f"-r {STDIN_FILENAME} (read the replacement from stdin) is only for replace-block; pass the replacement text itself")
+    if args.jobs != 1:
+        raise ValueError("-j/--jobs isn't used by atransform_files(); pass concurrency instead")
+    if args.emit_patch:
+        raise ValueError("--emit-patch is only for replace-block; use make_patch() for each file")
+    if args.delta:
+        raise ValueError("--delta is only for replace-block")
+    return args
+
+async def atransform_files(filenames:Iterable[str]|None, args:argparse.Namespace, concurrency:int=4)->AsyncGenerator[tuple[FileResult, str], None]:
+    """
+    Transforms each of filenames according to args (see make_args()), on up to concurrency worker
+    processes, without blocking the event loop, and yields (FileResult, printed output) for each file as
+    soon as it is finished, so in completion order rather than input order.
+
+    Files are read, matched and written (or dry-run, backed up etc.) in the workers exactly as for
+    replace-block -j, and only concurrency files are in flight at once, so filenames can be a long or
+    lazy iterable; it is advanced on a worker thread, so it may block (e.g. walk a directory tree).
+    The end-of-run work (see finish_run()) is done once the last file is finished.
+
+    The files under each -R directory in args are transformed after filenames (pass filenames=[] for
+    just those).  As with replace-block, -o can only be used for a single file: ValueError is raised
+    before anything is transformed if there is more than one.
+
+    For a --manifest, pass filenames=None: the manifest's files are transformed, each with its own rules.
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    from file_transform_tools.util.parallel import _init_worker, _process_file_captured
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    rules_by_file = getattr(args, 'manifest_rules', None)
+    if filenames is None:
+        filenames = args.filename
+    elif rules_by_file is not None:
+        raise ValueError("with a --manifest, the files come from the manifest; pass filenames=None")
+
+    # the workers get a copy of args without the manifest's rules; each file is sent its own
+    args = argparse.Namespace(**vars(args))
+    args.manifest_rules = None
+
+    filenames = iter(filenames)
+    if args.recursive:
+        from file_transform_tools.util.walk import iter_input_files
+        filenames = iter_input_files(filenames, args)
+    if args.outfile:
+        # every worker would write the same outfile, so check there is only one file before starting
+        first_filenames = []
+        for _ in range(2):
+            filename = await asyncio.to_thread(next, filenames, _NO_MORE_FILENAMES)
+            if filename is not _NO_MORE_FILENAMES:
+                first_filenames.append(filename)
+        if len(first_filenames) > 1:
+            raise ValueError("-o/--outfile can only be used with a single file")
+        filenames = iter(first_filenames)
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(max_workers=concurrency, initializer=_init_worker, initargs=(getattr(args, 'pattern_file', None) or [], bool(getattr(args, 'cache_file', None))))
+    filenames_done = False
+    in_flight = set()
+    changed_filenames = []
+    try:
+        while True:
+            while not filenames_done and len(in_flight) < concurrency:
+                # filenames may be lazy and slow to advance (e.g. a directory walk), so it is advanced
+                # on a thread rather than on the event loop
+                filename = await asyncio.to_thread(next, filenames, _NO_MORE_FILENAMES)
+                if filename is _NO_MORE_FILENAMES:
+                    filenames_done = True
+                    break
+                rules = rules_by_file[filename] if rules_by_file is not None else None
+                in_flight.add(loop.run_in_executor(executor, _process_file_captured, filename, args, args.replacement, rules))
+            if len(in_flight) == 0:
+                break
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                file_result, output = future.result()
+                if file_result.changed:
+                    changed_filenames.append(file_result.filename)
+                yield file_result, output
+        await loop.run_in_executor(None, finish_run, args, changed_filenames)
+    finally:
+        # if the caller stops early, don't hold up the event loop waiting for the files still in flight
+        executor.shutdown(wait=len(in_flight) == 0, cancel_futures=True)
@@ -1,13 +1,77 @@
+from __future__ import annotations
 import os
-import datetime
-import shutil
 
-def backup_file(filename):
+# ways of making a backup, cheapest first.  a strategy falls back to the ones after it when it isn't
+# possible (e.g. a hard link or reflink across filesystems, or a filesystem without reflinks); "auto"
+# starts at the top
+BACKUP_HARDLINK = "hardlink"
+BACKUP_REFLINK = "reflink"
+BACKUP_COPY_FILE_RANGE = "copy_file_range"
+BACKUP_COPY = "copy"
+BACKUP_AUTO = "auto"
+# not a way of copying: backups go into a BackupStore (see backup_store.py) instead of /tmp
+BACKUP_STORE = "store"
+BACKUP_STRATEGIES = [BACKUP_HARDLINK, BACKUP_REFLINK, BACKUP_COPY_FILE_RANGE, BACKUP_COPY]
+
+# the FICLONE ioctl from <linux/fs.h>: make dst share src's extents (copy on write)
+FICLONE = 0x40049409
+
+def _hardlink(filename:str, backup_path:str):
+    # the backup shares the original's inode, which is safe because files are only ever overwritten by
+    # replacing them with a new inode (see overwrite_with_chunks()), never in place
+    os.link(filename, backup_path)
+
+def _reflink(filename:str, backup_path:str):
+    import fcntl
+    _copy_fd_to_fd(filename, backup_path, lambda src_fd, dst_fd, size: fcntl.ioctl(dst_fd, FICLONE, src_fd))
+
+def _copy_file_range(filename:str, backup_path:str):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError("os.copy_file_range is not available")
+    def copy(src_fd:int, dst_fd:int, size:int):
+        copied = 0
+        while copied < size:
+            n = os.copy_file_range(src_fd, dst_fd, size-copied)
+            if n == 0:
+                break
+            copied += n
+    _copy_fd_to_fd(filename, backup_path, copy)
+
+def _copy_fd_to_fd(filename:str, backup_path:str, copy):
+    """
+    Creates backup_path, fills it from filename with copy(src_fd, dst_fd, size) and gives it filename's
+    metadata, like shutil.copy2().  backup_path is removed again if copy fails.
+    """
+    import shutil
+    with open(filename, 'rb') as src:
+        with open(backup_path, 'xb') as dst:
+            try:
+                copy(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+            except BaseException:
+                dst.close()
+                os.unlink(backup_path)
+                raise
+    shutil.copystat(filename, backup_path)
+
+def _copy(filename:str, backup_path:str):
+    import shutil
+    shutil.copy2(filename, backup_path)
+
+BACKUP_FUNCTIONS = {
+    BACKUP_HARDLINK: _hardlink,
+    BACKUP_REFLINK: _reflink,
+    BACKUP_COPY_FILE_RANGE: _copy_file_range,
+    BACKUP_COPY: _copy,
+}
+
+def backup_file(filename, strategy:str=BACKUP_COPY)->str:
     """
     Creates a backup copy of the given file in /tmp with a timestamp and full path encoded in name.
     
     Args:
         filename: Path to the file to backup
+        strategy: One of BACKUP_STRATEGIES or BACKUP_AUTO; strategies that aren't possible for this file
+            fall back to the next one, down to a plain copy
         
     Returns:
         str: Full path to the created backup file
@@ -15,6 +79,7 @@ def backup_file(filename):
     Example:
         '/home/user/.bashrc' -> '/tmp/home-user-.bashrc-20250621_120100.000000.bak'
     """
+    import datetime
 
     filename = os.path.abspath(os.path.expanduser(filename))
 
@@ -31,8 +96,15 @@ def backup_file(filename):
     # Create backup filename with directory path included
     backup_path = f"/tmp/{dir_path}-{base_filename}-{timestamp}.bak"
     
-    # Copy the file
-    shutil.copy2(filename, backup_path)
+    # Copy (or link) the file, falling back to cheaper-to-support strategies
+    start = 0 if strategy == BACKUP_AUTO else BACKUP_STRATEGIES.index(strategy)
+    for fallback in BACKUP_STRATEGIES[start:-1]:
+        try:
+            BACKUP_FUNCTIONS[fallback](filename, backup_path)
+            return backup_path
+        except (OSError, ImportError):
+            pass
+    _copy(filename, backup_path)
     
     return backup_path
 
@@ -45,8 +117,13 @@ class CreateBackupInstructions():
         return len(self.backup_files_map) == 0
     
     def append(self, filename:str, backup_filename:str):
+        """
+        backup_filename is either a backup file or a snapshot reference from a BackupStore.
+        """
+        from file_transform_tools.util.backup_store import parse_snapshot_ref
         filename = os.path.abspath(filename)
-        backup_filename = os.path.abspath(backup_filename)
+        if parse_snapshot_ref(backup_filename) is None:
+            backup_filename = os.path.abspath(backup_filename)
         self.backup_files_map[filename] = backup_filename
     
     def get_instructions_str(self)->str:
@@ -58,10 +135,19 @@ class CreateBackupInstructions():
             COLOR_YELLOW = ''
             COLOR_RESET = ''
             COLOR_BOLD = ''
+        from file_transform_tools.util.backup_store import parse_snapshot_ref
         s = "To view the changes:\n" 
         for filename, backup_filename in self.backup_files_map.items():
-            s += f"  {COLOR_YELLOW}delta {backup_filename} {filename}{COLOR_RESET}\n\n"
+            snapshot = parse_snapshot_ref(backup_filename)
+            if snapshot is not None:
+                s += f"  {COLOR_YELLOW}replace-block-backups --store {snapshot[0]} diff {snapshot[1]}{COLOR_RESET}\n\n"
+            else:
+                s += f"  {COLOR_YELLOW}delta {backup_filename} {filename}{COLOR_RESET}\n\n"
         s += "To revert the overwritten file(s):\n" 
         for filename, backup_filename in self.backup_files_map.items():
-            s += f"  {COLOR_YELLOW}mv {backup_filename} {filename}{COLOR_RESET}  # restores {COLOR_BOLD}{os.path.basename(filename)}{COLOR_RESET}\n"
+            snapshot = parse_snapshot_ref(backup_filename)
+            if snapshot is not None:
+                s += f"  {COLOR_YELLOW}replace-block-backups --store {snapshot[0]} restore {snapshot[1]}{COLOR_RESET}  # restores {COLOR_BOLD}{os.path.basename(filename)}{COLOR_RESET}\n"
+            else:
+                s += f"  {COLOR_YELLOW}mv {backup_filename} {filename}{COLOR_RESET}  # restores {COLOR_BOLD}{os.path.basename(filename)}{COLOR_RESET}\n"
         return s
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import os
+import time
+from typing import NamedTuple
+# defined with the command line options, so parsing them doesn't import this module
+from file_transform_tools.util.cli import COMPRESSION_LZMA, COMPRESSION_ZLIB, COMPRESSIONS
+
+# backups made into a store are referred to as "snapshot:<id>@<store dir>" wherever a backup filename
+# would go, e.g. in CreateBackupInstructions
+SNAPSHOT_REF_PREFIX = "snapshot:"
+
+# bump when the layout of the store changes
+STORE_FORMAT_VERSION = 1
+
+def format_snapshot_ref(store_path:str, snapshot_id:int)->str:
+    return f"{SNAPSHOT_REF_PREFIX}{snapshot_id}@{store_path}"
+
+def parse_snapshot_ref(ref:str)->tuple[str, int]|None:
+    """
+    Returns (store path, snapshot id) for a snapshot reference, or None if ref is a plain backup filename.
+    """
+    if not ref.startswith(SNAPSHOT_REF_PREFIX):
+        return None
+    snapshot_id, _, store_path = ref[len(SNAPSHOT_REF_PREFIX):].partition('@')
+    return store_path, int(snapshot_id)
+
+class Snapshot(NamedTuple):
+    """
+    One backup of a file: the content hash of its pre-image, its size and mode, and when it was taken.
+    """
+    id:int
+    path:str
+    content_hash:str
+    size:int
+    mode:int
+    created_ns:int
+    store_path:str
+
+    @property
+    def ref(self)->str:
+        return format_snapshot_ref(self.store_path, self.id)
+
+def _compress(data:bytes, compression:str)->bytes:
+    if compression == COMPRESSION_LZMA:
+        import lzma
+        return lzma.compress(data)
+    import zlib
+    return zlib.compress(data)
+
+def _decompress(data:bytes, compression:str)->bytes:
+    if compression == COMPRESSION_LZMA:
+        import lzma
+        return lzma.decompress(data)
+    import zlib
+    return zlib.decompress(data)
+
+class BackupStore:
+    """
+    A content-addressed store of file backups.
+
+    Each backup (snapshot) records the file's path, mode and time and the sha256 of its contents; the
+    contents are stored once per distinct hash, compressed, under objects/<2 hex digits>/<hash>, however
+    many snapshots share them.  An sqlite index (index.sqlite) maps paths to snapshots and hashes to
+    stored objects, so listing, finding and restoring backups never scans the store.
+
+    Several processes can use a store at once: the index is in WAL mode, and objects are written and
+    deleted only while holding the index's write lock.
+    """
+    def __init__(self, path:str, compression:str=COMPRESSION_ZLIB):
+        import sqlite3
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression '{compression}'")
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.compression = compression
+        os.makedirs(os.path.join(self.path, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, STORE_FORMAT_VERSION):
+            raise ValueError(f"{self.path} is a backup store of an unsupported version ({version})")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS objects (
+            content_hash TEXT PRIMARY KEY, size INTEGER NOT NULL, stored_size INTEGER NOT NULL,
+            compression TEXT NOT NULL)""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, content_hash TEXT NOT NULL REFERENCES objects,
+            mode INTEGER NOT NULL, created_ns INTEGER NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS snapshots_path ON snapshots (path, created_ns)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS snapshots_content_hash ON snapshots (content_hash)")
+        self._db.execute(f"PRAGMA user_version={STORE_FORMAT_VERSION}")
+
+    def _object_path(self, content_hash:str)->str:
+        return os.path.join(self.path, 'objects', content_hash[:2], content_hash)
+
+    def _has_object(self, content_hash:str)->bool:
+        return self._db.execute("SELECT 1 FROM objects WHERE content_hash=?", (content_hash,)).fetchone() is not None
+
+    def _write_object(self, content_hash:str, stored:bytes):
+        import tempfile
+        object_path = self._object_path(content_hash)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(stored)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def save(self, filename:str)->Snapshot:
+        """
+        Takes a snapshot of filename.  Its contents are only compressed and written if no earlier
+        snapshot (of any file) had the same contents.
+        """
+        import hashlib
+        filename = os.path.abspath(os.path.expanduser(filename))
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+
+        # compress outside the write lock, so parallel runs don't queue up behind each other's compression
+        stored = None if self._has_object(content_hash) else _compress(data, self.compression)
+
+        created_ns = time.time_ns()
+        written_object = False
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._has_object(content_hash):
+                if stored is None:
+                    stored = _compress(data, self.compression)
+                self._write_object(content_hash, stored)
+                written_object = True
+                self._db.execute("INSERT INTO objects VALUES (?, ?, ?, ?)", (content_hash, len(data), len(stored), self.compression))
+            cursor = self._db.execute("INSERT INTO snapshots (path, content_hash, mode, created_ns) VALUES (?, ?, ?, ?)", (filename, content_hash, st.st_mode & 0o7777, created_ns))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            # the object's index row is gone with the rollback, so nothing would ever refer to (or evict) it;
+            # it is still ours to delete, since the write lock was held since it was written
+            if written_object:
+                try:
+                    os.unlink(self._object_path(content_hash))
+                except OSError:
+                    pass
+            raise
+        return Snapshot(cursor.lastrowid, filename, content_hash, len(data), st.st_mode & 0o7777, created_ns, self.path)
+
+    def _snapshots(self, where:str="", params:tuple=())->list[Snapshot]:
+        rows = self._db.execute(f"SELECT snapshots.id, path, snapshots.content_hash, size, mode, created_ns FROM snapshots JOIN objects USING (content_hash) {where} ORDER BY created_ns, snapshots.id", params)
+        return [Snapshot(*row, self.path) for row in rows]
+
+    def get(self, snapshot_id:int)->Snapshot:
+        snapshots = self._snapshots("WHERE snapshots.id=?", (snapshot_id,))
+        if len(snapshots) == 0:
+            raise KeyError(f"no snapshot {snapshot_id} in {self.path}")
+        return snapshots[0]
+
+    def snapshots(self, filename:str=None)->list[Snapshot]:
+        """
+        Returns every snapshot (or every snapshot of filename), oldest first.
+        """
+        if filename is None:
+            return self._snapshots()
+        return self._snapshots("WHERE path=?", (os.path.abspath(os.path.expanduser(filename)),))
+
+    def read(self, snapshot_id:int)->bytes:
+        """
+        Returns the contents of a snapshot.
+        """
+        content_hash, compression = self._db.execute("SELECT content_hash, compression FROM snapshots JOIN objects USING (content_hash) WHERE snapshots.id=?", (snapshot_id,)).fetchone() or (None, None)
+        if content_hash is None:
+            raise KeyError(f"no snapshot {snapshot_id} in {self.path}")
+        with open(self._object_path(content_hash), 'rb') as f:
+            return _decompress(f.read(), compression)
+
+    def restore(self, snapshot_id:int, dest:str=None)->str:
+        """
+        Atomically writes a snapshot back to its original path (or to dest) with its original mode, and
+        returns the path written.
+        """
+        import tempfile
+        snapshot = self.get(snapshot_id)
+        data = self.read(snapshot_id)
+        dest = os.path.realpath(os.path.expanduser(dest or snapshot.path))
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=f".{os.path.basename(dest)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(temp_path, snapshot.mode)
+            os.replace(temp_path, dest)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return dest
+
+    def stored_bytes(self)->int:
+        """
+        The total size of the compressed objects in the store.
+        """
+        return self._db.execute("SELECT COALESCE(SUM(stored_size), 0) FROM objects").fetchone()[0]
+
+    def evict(self, max_bytes:int=None, max_age_ns:int=None)->int:
+        """
+        Deletes snapshots older than max_age_ns, then the oldest snapshots until the compressed objects
+        total at most max_bytes, and returns how many snapshots were deleted.  The newest snapshot of
+        each file is always kept.  Objects no snapshot refers to any more are deleted with them.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            snapshots = self._snapshots()
+            newest_by_path = {snapshot.path: snapshot.id for snapshot in snapshots}
+            refcounts:dict[str, int] = {}
+            for snapshot in snapshots:
+                refcounts[snapshot.content_hash] = refcounts.get(snapshot.content_hash, 0) + 1
+            stored_sizes = dict(self._db.execute("SELECT content_hash, stored_size FROM objects"))
+            total_bytes = sum(stored_sizes.values())
+
+            now = time.time_ns()
+            doomed_snapshots = []
+            doomed_objects = []
+            for snapshot in snapshots:
+                too_old = max_age_ns is not None and now - snapshot.created_ns > max_age_ns
+                too_big = max_bytes is not None and total_bytes > max_bytes
+                if not (too_old or too_big):
+                    # snapshots are oldest first, so none of the rest are too old, and the store is small enough
+                    break
+                if newest_by_path[snapshot.path] == snapshot.id:
+                    continue
+                doomed_snapshots.append(snapshot.id)
+                refcounts[snapshot.content_hash] -= 1
+                if refcounts[snapshot.content_hash] == 0:
+                    doomed_objects.append(snapshot.content_hash)
+                    total_bytes -= stored_sizes.get(snapshot.content_hash, 0)
+
+            self._db.executemany("DELETE FROM snapshots WHERE id=?", [(snapshot_id,) for snapshot_id in doomed_snapshots])
+            self._db.executemany("DELETE FROM objects WHERE content_hash=?", [(content_hash,) for content_hash in doomed_objects])
+            # objects are deleted under the write lock, so a concurrent save() can't find an object in the
+            # index whose file is about to go
+            for content_hash in doomed_objects:
+                try:
+                    os.unlink(self._object_path(content_hash))
+                except FileNotFoundError:
+                    pass
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return len(doomed_snapshots)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self)->'BackupStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# this process's open stores by path; a forked --jobs worker must not use its parent's connections
+_open_stores:dict[str, BackupStore] = {}
+_open_stores_pid = os.getpid()
+
+def open_backup_store(path:str, compression:str=COMPRESSION_ZLIB)->BackupStore:
+    """
+    Returns this process's connection to the store at path, opening it on first use.
+    """
+    global _open_stores_pid
+    if _open_stores_pid != os.getpid():
+        _open_stores.clear()
+        _open_stores_pid = os.getpid()
+    path = os.path.abspath(os.path.expanduser(path))
+    if path not in _open_stores:
+        _open_stores[path] = BackupStore(path, compression=compression)
+    return _open_stores[path]
+
+def close_backup_stores():
+    while _open_stores:
+        _open_stores.popitem()[1].close()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import re
+from typing import Generator, NamedTuple
+
+class BlockMatch(NamedTuple):
+    """
+    A block found by BlockPattern.finditer(), with the same start()/end() accessors as re.Match.
+    """
+    start_pos:int
+    end_pos:int
+
+    def start(self)->int:
+        return self.start_pos
+
+    def end(self)->int:
+        return self.end_pos
+
+class BlockPattern:
+    """
+    Matches marker-delimited blocks such as `ifdef SLANG ... `endif, honouring nesting, in a single
+    linear scan.  It can be used anywhere a re.Pattern from the library is used (patterns[name]['pat'],
+    ModifiedPatternMatcher), on str, bytes or mmap buffers.
+
+    Markers are recognized at the start of a line, after optional spaces or tabs:
+      - open_marker opens a nesting level (e.g. `ifdef or `ifndef)
+      - close_marker closes one (e.g. `endif)
+      - a block starts at an open marker whose line also matches begin, at any nesting depth (e.g. an
+        `ifdef SLANG inside an `ifdef FOO), and ends at the close marker that brings the depth back to
+        where it was before that open marker; markers in between that don't change the depth (e.g.
+        `else, `elsif) simply stay inside the block
+
+    Spans are the same ones the equivalent ^\\s*begin.*\\n ^(.*\\n)* ^\\s*close.*$ regex would produce for
+    a single, non-nested block: from the start of the run of whitespace-only lines directly before the
+    opening line (the regex's leading ^\\s* takes those in too) to the end of the closing line, not
+    including its newline.  Unlike the regex, a block ends at its own close marker rather than the last
+    one in the file.  An unterminated block is not a match.
+    """
+    def __init__(self, begin:str, open_marker:str, close_marker:str):
+        self.begin = re.compile(begin)
+        self.open_marker = re.compile(open_marker)
+        self.close_marker = re.compile(close_marker)
+        self.pattern = f"{begin} ... {close_marker}"
+        self.flags = 0
+        self._markers = {}
+        self._marker_at = None
+
+    def _compiled(self, is_bytes:bool)->tuple[re.Pattern, re.Pattern]:
+        """
+        Returns (begin, markers) compiled for str or bytes buffers; markers finds every open or close
+        marker line with a named group saying which it is.
+        """
+        if is_bytes not in self._markers:
+            markers_source = rf"^[ \t]*(?:(?P<open>{self.open_marker.pattern})|(?P<close>{self.close_marker.pattern}))"
+            begin_source = self.begin.pattern
+            if is_bytes:
+                self._markers[is_bytes] = (re.compile(begin_source.encode('utf-8')), re.compile(markers_source.encode('utf-8'), re.MULTILINE))
+            else:
+                self._markers[is_bytes] = (self.begin, re.compile(markers_source, re.MULTILINE))
+        return self._markers[is_bytes]
+
+    def finditer(self, s:str|bytes)->Generator[BlockMatch, None, None]:
+        is_bytes = not isinstance(s, str)
+        begin, markers = self._compiled(is_bytes)
+        newline = b'\n' if is_bytes else '\n'
+
+        depth = 0
+        # the depth the current block's open marker was found at, so its close marker is the one that
+        # brings the depth back to it
+        block_depth = None
+        block_start = None
+        search_floor = 0
+        for marker in markers.finditer(s):
+            if marker.group('open') is not None:
+                if block_start is None and begin.match(s, marker.start('open')):
+                    block_start = self._block_start(s, marker.start(), search_floor, newline)
+                    block_depth = depth
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+                if block_start is not None and depth == block_depth:
+                    end_pos = s.find(newline, marker.end())
+                    if end_pos == -1:
+                        end_pos = len(s)
+                    yield BlockMatch(block_start, end_pos)
+                    block_start = None
+                    search_floor = end_pos
+
+    def find_begin(self, s:str, pos:int=0)->int:
+        """
+        Returns the start of the first line at or after pos whose open marker also matches begin, where
+        a block could begin (or at the whitespace-only lines before it), or -1 if there is none.
+        """
+        begin, markers = self._compiled(False)
+        for marker in markers.finditer(s, pos):
+            if marker.group('open') is not None and begin.match(s, marker.start('open')):
+                return marker.start()
+        return -1
+
+    def marker_at(self, s:str, pos:int)->bool:
+        """
+        True if an open or close marker, after optional spaces or tabs, starts at pos, i.e. s[pos:] would
+        be taken for a marker line if a scan started at pos.
+        """
+        if self._marker_at is None:
+            self._marker_at = re.compile(rf"[ \t]*(?:{self.open_marker.pattern}|{self.close_marker.pattern})")
+        return self._marker_at.match(s, pos) is not None
+
+    @staticmethod
+    def _block_start(s:str|bytes, line_start:int, search_floor:int, newline:str|bytes)->int:
+        """
+        Walks back from the opening line over whitespace-only lines, no further than search_floor (the
+        end of the previous block), and returns the start of the earliest one.
+        """
+        while line_start > search_floor:
+            newline_pos = s.rfind(newline, search_floor, line_start-1)
+            if newline_pos != -1:
+                prev_line_start = newline_pos+1
+            elif search_floor == 0 or s[search_floor-1:search_floor] == newline:
+                prev_line_start = search_floor
+            else:
+                # the previous line begins before search_floor
+                break
+            if not s[prev_line_start:line_start].isspace():
+                break
+            line_start = prev_line_start
+        return line_start
+
+    @property
+    def required_literals(self)->tuple[str, ...]:
+        """
+        Literals every block must contain, for the required-literal prefilter.
+        """
+        from file_transform_tools.re_pattern_library import derive_required_literals
+        return tuple(dict.fromkeys(derive_required_literals(self.begin) + derive_required_literals(self.close_marker)))
@@ -1,7 +1,34 @@
+from __future__ import annotations
 import argparse
 import os
+import re
 import sys
 from enum import Enum
+from typing import NamedTuple
+from file_transform_tools.util.backup import BACKUP_AUTO, BACKUP_STORE, BACKUP_STRATEGIES
+from file_transform_tools.util.output_writer import FSYNC_NONE, FSYNC_POLICIES
+from file_transform_tools.util.pattern_registry import PATTERN_FILES_ENV_VAR, PatternRegistry
+
+# the filename that makes replace-block a filter from stdin to stdout
+STDIN_FILENAME = '-'
+# the default --max-span-kb, the longest block a stdin filter can match
+DEFAULT_MAX_SPAN_KB = 1024
+
+# how backups in the store are compressed (see backup_store)
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+COMPRESSIONS = [COMPRESSION_ZLIB, COMPRESSION_LZMA]
+
+# --color modes for dry run diffs (see diff_render)
+COLOR_MODE_AUTO = "auto"
+COLOR_MODE_ALWAYS = "always"
+COLOR_MODE_NEVER = "never"
+COLOR_MODES = [COLOR_MODE_AUTO, COLOR_MODE_ALWAYS, COLOR_MODE_NEVER]
+
+# setting this to a path turns the match cache on without --cache (--no-cache still turns it off)
+MATCH_CACHE_ENV_VAR = "FILE_TRANSFORM_TOOLS_CACHE"
+# the default --cache-max-entries (see match_cache)
+DEFAULT_MAX_ENTRIES = 1_000_000
 
 COLOR_GREEN = '\033[92m'
 COLOR_MAGENTA = '\033[95m'
@@ -17,6 +44,14 @@ COLOR_RED_BKG = '\033[41m'
 COLOR_CYAN_BKG = '\033[46m'
 COLOR_WHITE_BKG = '\033[47m'
 
+def default_store_path()->str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'file-transform-tools', 'backups')
+
+def default_cache_path()->str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'file-transform-tools', 'matches.sqlite')
+
 class ActionIfBlockNotFound(Enum):
     """
     What to do if the block is not found
@@ -25,24 +60,51 @@ class ActionIfBlockNotFound(Enum):
     REPLACE_OR_APPEND = "replace_or_append"
     REPLACE_OR_PREPEND = "replace_or_prepend"
 
-def parse_args(patterns:dict[str, dict[str, str]])->argparse.Namespace:
+class BlockRule(NamedTuple):
+    """
+    One -pat/-r pair: replace the blocks matched by pattern_name with replacement_text.
+
+    The rest override the command line options for this rule only (None means use the command line's):
+    action, affix (what -A's prefix or -P's suffix would be) and blank_line_control ((preceding, trailing)
+    as for -w).  They are set by --manifest jobs.
+    """
+    pattern_name:str|None
+    replacement_text:str|None
+    action:ActionIfBlockNotFound|None = None
+    affix:str|None = None
+    blank_line_control:tuple[int, int]|None = None
+
+class LazyEpilogArgumentParser(argparse.ArgumentParser):
+    """
+    An ArgumentParser whose epilog is built by epilog_factory only when the help is printed, so the
+    pattern list in it costs nothing on a normal run.
+    """
+    def __init__(self, *args, epilog_factory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.epilog_factory = epilog_factory
+
+    def format_help(self)->str:
+        if self.epilog_factory is not None:
+            self.epilog = self.epilog_factory()
+        return super().format_help()
+
+def format_epilog(patterns:PatternRegistry)->str:
+    # listing the patterns only needs their names and descriptions, so nothing is compiled here
     longest_pattern_name = max(len(pattern_name) for pattern_name in patterns)
     patterns_list = ""
     for i, pattern_name in enumerate(patterns):
         patterns_list += f"  {('('+str(i+1)+')').ljust(4)} {pattern_name.ljust(longest_pattern_name+4)} {patterns[pattern_name]['desc']}\n"
 
-    parser = argparse.ArgumentParser(description=f"{COLOR_GREEN}Replace, update, insert or delete a multi-line block in one or more files{COLOR_RESET}", 
-                                     formatter_class=argparse.RawDescriptionHelpFormatter, 
-                                     epilog=f"""
+    return f"""
 
   {COLOR_MAGENTA}NOTES{COLOR_RESET}
-  1. -o/--outfile and --dry-run/--dry-run-preserve-temp-file are mutually exclusive concepts
-  2. Dry run options require the `delta` tool to be installed and in the PATH.  See readme.md for instructions.
+  1. -o/--outfile, --emit-patch and --dry-run/--dry-run-preserve-temp-file are mutually exclusive concepts
+  2. Dry runs print a unified diff; --delta pipes it through the `delta` tool, which must then be installed and in the PATH.  See readme.md for instructions.
   3. The optional arguments to -A and -P are {COLOR_UNDERLINE}only{COLOR_RESET} applied if no replacement is made.
   4. The optional argument to -A is a {COLOR_ITALIC}prefix{COLOR_RESET} to the insertion, while for -P it is a {COLOR_ITALIC}suffix{COLOR_RESET} to the insertion.
 
   {COLOR_MAGENTA}AVAILABLE PATTERNS{COLOR_RESET} 
-  (see `re_pattern_library.py` for more info)
+  (see `re_pattern_library.py` for more info; more can be loaded with --pattern-file or ${PATTERN_FILES_ENV_VAR})
 
   {patterns_list}
 
@@ -56,16 +118,47 @@ def parse_args(patterns:dict[str, dict[str, str]])->argparse.Namespace:
   Try to replace the matching block with 'X=1', but if that's not found, append 'X=1' with a preceding newline (note that two are needed):
     replace-block -y -b -r "X=1" -pat bash_rc_export_path {COLOR_BOLD}{COLOR_ORANGE}-A $'\\n'{COLOR_RESET} --dry-run readme.md
   $'\\n' is a shell convention that inserts an actual newline instead of a backslash,n.
-""")
-    parser.add_argument("filename", type=str, nargs='+', help="One or more input files to replace/delete/insert into (required)")
-    parser.add_argument("--pattern-name", '-pat', type=str, help="The name of the pattern to match against (-h to list all patterns)")
-    parser.add_argument("--replacement", '-r', type=str, help="Text to replace the block with; if no text is provided, the matching block is deleted; '-' for stdin, '@somefile' to read from a file")
+"""
+
+def parse_args(patterns:PatternRegistry, argv:list[str]=None, filenames_required:bool=True)->argparse.Namespace:
+    """
+    Parses and checks the command line (sys.argv[1:], or argv), printing an error and exiting on a bad one.
+    Without filenames_required, no filenames (or --recursive) need be given, for callers that pass the
+    files separately (see make_args()).
+    """
+    # pattern files have to be loaded before the pattern list in the help text is built
+    pattern_file_parser = argparse.ArgumentParser(add_help=False)
+    pattern_file_parser.add_argument("--pattern-file", type=str, action='append')
+    pattern_files = pattern_file_parser.parse_known_args(argv)[0].pattern_file or []
+    try:
+        for pattern_file in pattern_files:
+            patterns.load_file(pattern_file)
+    except (OSError, ValueError) as e:
+        print(f"error: could not load patterns: {e}")
+        sys.exit(1)
+
+    parser = LazyEpilogArgumentParser(description=f"{COLOR_GREEN}Replace, update, insert or delete a multi-line block in one or more files{COLOR_RESET}", 
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, 
+                                     epilog_factory=lambda: format_epilog(patterns))
+    parser.add_argument("filename", type=str, nargs='*', help="One or more input files to replace/delete/insert into (required unless --recursive is given); '-' filters stdin to stdout")
+    parser.add_argument("--pattern-name", '-pat', type=str, action='append', help="The name of the pattern to match against (-h to list all patterns); can be repeated, each -pat paired with the -r in the same position, to apply several rules in one pass")
+    parser.add_argument("--pattern-file", type=str, action='append', metavar='FILE', help="Load additional patterns from a TOML or JSON pattern file (can be repeated)")
+    parser.add_argument("--replacement", '-r', type=str, action='append', help="Text to replace the block with; if no text is provided, the matching block is deleted; '-' for stdin, '@somefile' to read from a file.  With several -pat, give one -r for each (-r '' deletes)")
+    parser.add_argument("--manifest", type=str, metavar='FILE', help="Run the jobs in a TOML or JSON manifest (files/globs, pattern, replacement, action and -w per job) instead of -pat/-r and filenames; each file is rewritten once with all of its jobs' rules")
     parser.add_argument("--backup", '-b', action="store_true", help="Create a backup of the original file(s) in /tmp before overwriting")
+    parser.add_argument("--backup-strategy", type=str, choices=[BACKUP_AUTO]+BACKUP_STRATEGIES+[BACKUP_STORE], default=BACKUP_AUTO, help="How -b makes backups: hardlink (no data copied), reflink (copy on write, e.g. btrfs/XFS), copy_file_range (in-kernel copy) or copy; each falls back to the ones after it when it isn't possible, and auto (default) starts with hardlink.  store saves them in the deduplicated, compressed --backup-store instead of /tmp")
+    parser.add_argument("--backup-store", type=str, metavar='DIR', help=f"Implies -b --backup-strategy store, with the store in DIR (default {default_store_path()}); see replace-block-backups -h for listing, restoring and pruning backups")
+    parser.add_argument("--backup-compression", type=str, choices=COMPRESSIONS, default=COMPRESSION_ZLIB, help="How backups in the store are compressed (default zlib)")
+    parser.add_argument("--backup-max-mb", type=int, metavar='N', help="After the run, delete the oldest backups in the store until it holds at most N MiB (the newest backup of each file is always kept)")
+    parser.add_argument("--backup-max-age-days", type=float, metavar='DAYS', help="After the run, delete backups in the store older than DAYS (the newest backup of each file is always kept)")
 
     output_group = parser.add_mutually_exclusive_group()
     output_group.add_argument("--outfile", '-o', type=str, help="Write output to this file instead of overwriting filename")
-    output_group.add_argument("--dry-run", '-dry', action="store_true", help="Write updated file to a temp file and show diff")
-    output_group.add_argument("--preserve-temp-file-dry-run", '-pdry', action="store_true", help="Implies --dry-run, but save the temp file as '[filename].new' in current directory")
+    output_group.add_argument("--dry-run", '-dry', action="store_true", help="Show the changes as a unified diff instead of writing them")
+    output_group.add_argument("--emit-patch", type=str, metavar='FILE', help="Don't change any files; write the changes to FILE as a unified diff, with paths relative to the current directory, that `git apply` or `patch -p1` can apply later (e.g. to other checkouts) without matching again")
+    output_group.add_argument("--preserve-temp-file-dry-run", '-pdry', action="store_true", help="Implies --dry-run, but also save the updated file as '[filename].new' in current directory")
+    parser.add_argument("--color", type=str, choices=COLOR_MODES, default=COLOR_MODE_AUTO, help="Color dry run diffs: auto (default) colors them when stdout is a terminal")
+    parser.add_argument("--delta", action="store_true", help="Pipe the dry run diffs of all files through one `delta` process for side-by-side, syntax-highlighted output (delta must be in the PATH)")
     
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--append", '-A', type=str, nargs='?', const="", help="If matching block not found, just append the replacement text to file. Argument string is an optional prefix for the replacement text if it is appended (default ''). If you provide anything here, it will probably be $'\\n' as shown in the examples.")
@@ -73,27 +166,95 @@ def parse_args(patterns:dict[str, dict[str, str]])->argparse.Namespace:
 
     parser.add_argument("--blank-line-control", '-w', type=int, nargs=2, metavar=('preceding', 'trailing'), help="Required number of preceding and trailing newlines that should exist after the insertion, deletion or replacement of the block")
 
+    parser.add_argument("--recursive", '-R', type=str, action='append', metavar='DIR', help="Also process every text file under DIR (can be repeated); binary files, symlinks and .git directories are skipped")
+    parser.add_argument("--include", type=str, action='append', metavar='GLOB', help="With --recursive, only process files whose path (relative to DIR) or name matches GLOB (can be repeated)")
+    parser.add_argument("--exclude", type=str, action='append', metavar='GLOB', help="With --recursive, skip files and directories whose path (relative to DIR) or name matches GLOB (can be repeated)")
+    parser.add_argument("--gitignore", action="store_true", help="With --recursive, also skip files ignored by .gitignore files in the tree")
+    parser.add_argument("--jobs", '-j', type=int, default=1, help="Process files on this many worker processes (default 1); output is still printed in input order")
+    parser.add_argument("--windowed", action="store_true", help="Read, match and write each file in windows rather than all at once, so memory stays bounded however large the file is (for files larger than RAM); a block can't be longer than --max-span-kb")
+    parser.add_argument("--max-span-kb", type=int, default=DEFAULT_MAX_SPAN_KB, metavar='N', help=f"With --windowed or '-' as the filename, the longest a block can be, in KiB of text (default {DEFAULT_MAX_SPAN_KB}), unless its pattern declares its own max_span_kb; text further back than this, or before the first line a block could begin on, is written out as soon as it has been read")
+    parser.add_argument("--max-in-flight-mb", type=int, default=1024, help="With --jobs, limit the total size of the files being processed at once to this many MiB (default 1024)")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map each file and match the pattern on the raw bytes (lowest peak memory for very large files)")
+
+    parser.add_argument("--cache", action="store_true", help=f"Cache the blocks found in each file on disk, so files that haven't changed since the last run are neither read nor matched again (also turned on by ${MATCH_CACHE_ENV_VAR}=PATH)")
+    parser.add_argument("--cache-file", type=str, metavar='FILE', help="Implies --cache, with the cache kept in FILE (default ~/.cache/file-transform-tools/matches.sqlite)")
+    parser.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES, metavar='N', help=f"Evict the least recently used cache entries beyond N (default {DEFAULT_MAX_ENTRIES})")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the match cache, even if --cache or the environment turn it on")
+    parser.add_argument("--fsync", type=str, choices=FSYNC_POLICIES, default=FSYNC_NONE, help="When to flush overwritten files to disk: none (default; files are still replaced atomically), per-file (fsync each file and its directory before moving on) or batch (fsync every overwritten file and its directory once, at the end of the run)")
+
     parser.add_argument('-y', action="store_true", help="Don't prompt about overwriting files")
     parser.add_argument("--verbose", '-v', action="store_true", help="Print verbose output")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.manifest is not None:
+        return parse_manifest_args(args, patterns)
+
+    # pair up the -pat and -r options into rules; args.pattern_name and args.replacement are the first pair
+    pattern_names = args.pattern_name or []
+    replacements = args.replacement or []
+    if len(pattern_names) > 1 and len(replacements) != len(pattern_names):
+        print("error: with more than one -pat/--pattern-name, give exactly one -r/--replacement for each (-r '' to delete a block)")
+        sys.exit(1)
+    if len(pattern_names) <= 1 and len(replacements) > 1:
+        print("error: only one -r/--replacement is allowed with a single -pat/--pattern-name")
+        sys.exit(1)
+    if replacements.count('-') > 1:
+        print("error: only one -r/--replacement can read from stdin")
+        sys.exit(1)
+    if len(set(pattern_names)) < len(pattern_names):
+        print("error: the same -pat/--pattern-name is given more than once")
+        sys.exit(1)
+    args.pattern_name = pattern_names[0] if pattern_names else None
+    args.replacement = replacements[0] if replacements else None
 
     if args.append is None and args.prepend is None:
         if not args.pattern_name:
             print("Error: -pat/--pattern-name is required; see -h for help")
             sys.exit(1)
-        if args.pattern_name not in patterns:
+        try:
+            pattern_found = args.pattern_name in patterns
+        except (OSError, ValueError) as e:
+            print(f"error: could not load patterns: {e}")
+            sys.exit(1)
+        if not pattern_found:
             print(f"Error: pattern '{args.pattern_name}' not found in pattern library")
             sys.exit(1)
+    for pattern_name in pattern_names:
+        # compile the patterns that will be used now, so a bad pattern is reported once up front
+        try:
+            patterns[pattern_name]['pat']
+        except KeyError:
+            print(f"Error: pattern '{pattern_name}' not found in pattern library")
+            sys.exit(1)
+        except (re.error, OSError, ValueError) as e:
+            print(f"error: pattern '{pattern_name}' is invalid: {e}")
+            sys.exit(1)
 
-    if not args.filename or len(args.filename) == 0:
-        print("Error: at least one filename is required")
+    if filenames_required and (not args.filename or len(args.filename) == 0) and not args.recursive:
+        print("Error: at least one filename (or --recursive DIR) is required")
+        sys.exit(1)
+
+    if args.recursive:
+        for dir_name in args.recursive:
+            if not os.path.isdir(os.path.expanduser(dir_name)):
+                print(f"error: directory '{dir_name}' not found")
+                sys.exit(1)
+        if args.outfile is not None:
+            print("error: -o/--outfile is not supported with --recursive; use dry run if you don't want to overwrite")
+            sys.exit(1)
+    elif (args.include or args.exclude or args.gitignore):
+        print("error: --include, --exclude and --gitignore only apply with --recursive")
         sys.exit(1)
 
-    if len(args.filename) == 1:
+    if STDIN_FILENAME in args.filename:
+        # see check_filter_args()
+        pass
+    elif len(args.filename) == 1:
         args.filename = [os.path.abspath(os.path.expanduser(args.filename[0]))]
     else:
-        if args.outfile is not None:
+        # no filenames at all is only allowed for make_args(), which checks -o against the files it is given
+        if args.outfile is not None and len(args.filename) > 1:
             print("error: -o/--outfile is not supported with multiple files; use dry run if you don't want to overwrite")
             sys.exit(1)
         files = []
@@ -104,12 +265,17 @@ def parse_args(patterns:dict[str, dict[str, str]])->argparse.Namespace:
             files.append(os.path.abspath(os.path.expanduser(filename)))
         args.filename = files
 
-    if args.replacement and args.replacement.startswith('@'):
-        if not os.path.exists(args.replacement[1:]):
-            print(f"error: replacement file '{args.replacement[1:]}' not found")
-            sys.exit(1)
-        else:
-            args.replacement = open(args.replacement[1:], 'r').read()
+    for i, replacement in enumerate(replacements):
+        if replacement.startswith('@'):
+            if not os.path.exists(replacement[1:]):
+                print(f"error: replacement file '{replacement[1:]}' not found")
+                sys.exit(1)
+            else:
+                replacements[i] = open(replacement[1:], 'r').read()
+    args.replacement = replacements[0] if replacements else None
+
+    # '-' (stdin) is left in place for the caller to read
+    args.rules = [BlockRule(pattern_name, replacements[i] if i < len(replacements) else None) for i, pattern_name in enumerate(pattern_names)]
 
     if args.append is not None:
         args.action = ActionIfBlockNotFound.REPLACE_OR_APPEND
@@ -118,14 +284,122 @@ def parse_args(patterns:dict[str, dict[str, str]])->argparse.Namespace:
     else:
         args.action = ActionIfBlockNotFound.REPLACE_ONLY
 
+    if STDIN_FILENAME in args.filename:
+        check_filter_args(args)
+    check_run_args(args)
+    return args
+
+def check_filter_args(args:argparse.Namespace):
+    """
+    Checks the options of a '-' (stdin to stdout) run, which can only do a plain in-memory transform.
+    """
+    if args.filename != [STDIN_FILENAME] or args.recursive:
+        print("error: '-' (filter stdin to stdout) can't be combined with other files or --recursive")
+        sys.exit(1)
+    if args.replacement == '-' or any(rule.replacement_text == '-' for rule in args.rules):
+        print("error: with '-' as the filename, stdin is the input, so -r can't read from it too")
+        sys.exit(1)
+    if args.outfile or args.dry_run or args.preserve_temp_file_dry_run or args.emit_patch or args.backup or args.backup_store or args.mmap or args.jobs != 1:
+        print("error: '-' (filter stdin to stdout) can't be combined with -o, --dry-run, --emit-patch, -b, --mmap or -j")
+        sys.exit(1)
+    # nothing is overwritten
+    args.y = True
+
+def check_run_args(args:argparse.Namespace):
+    """
+    The checks and the overwrite prompt shared by normal and --manifest runs.
+    """
+    if args.jobs < 1:
+        print("error: -j/--jobs must be at least 1")
+        sys.exit(1)
+    if args.max_span_kb < 1:
+        print("error: --max-span-kb must be at least 1")
+        sys.exit(1)
+
     if args.preserve_temp_file_dry_run:
         args.dry_run = True
 
-    if not args.outfile and not args.dry_run and not args.y:
+    if args.delta and not args.dry_run:
+        print("error: --delta only applies to --dry-run")
+        sys.exit(1)
+    # decided here rather than per file, because --jobs workers' stdout is never a terminal; delta
+    # colors the diff itself
+    args.color_diff = not args.delta and (args.color == COLOR_MODE_ALWAYS or (args.color == COLOR_MODE_AUTO and sys.stdout.isatty()))
+
+    if args.backup_store is not None:
+        args.backup = True
+        args.backup_strategy = BACKUP_STORE
+    elif args.backup_strategy == BACKUP_STORE:
+        args.backup_store = default_store_path()
+    if (args.backup_max_mb is not None or args.backup_max_age_days is not None) and args.backup_strategy != BACKUP_STORE:
+        print("error: --backup-max-mb and --backup-max-age-days only apply to --backup-store")
+        sys.exit(1)
+
+    # the match cache is opt-in; args.cache_file is None unless it is on
+    if args.no_cache:
+        args.cache_file = None
+    elif args.cache_file is None and (args.cache or os.environ.get(MATCH_CACHE_ENV_VAR)):
+        args.cache_file = os.environ.get(MATCH_CACHE_ENV_VAR) or default_cache_path()
+
+    # --windowed never holds a whole file, which rules out everything that works on one
+    if args.windowed:
+        if args.dry_run or args.emit_patch or args.mmap or args.backup_strategy == BACKUP_STORE:
+            print("error: --windowed can't be combined with --dry-run, --emit-patch, --mmap or --backup-store")
+            sys.exit(1)
+        # the cache's block digests need the whole file, so --windowed just doesn't use it
+        args.cache_file = None
+    if args.cache_max_entries < 1:
+        print("error: --cache-max-entries must be at least 1")
+        sys.exit(1)
+
+    if not args.outfile and not args.dry_run and not args.emit_patch and not args.y:
         # prompt the user to make sure overwrite is ok
-        response = input(f"No -o/--outfile specified. Are you sure you want to overwrite '{args.filename}'? [y/N] ")
+        if args.manifest is not None:
+            overwrite_what = f"{len(args.filename)} file(s) from {args.manifest}"
+        elif args.recursive:
+            overwrite_what = f"{args.filename + args.recursive} (recursively)" if args.filename else f"{args.recursive} (recursively)"
+        else:
+            overwrite_what = f"{args.filename}"
+        response = input(f"No -o/--outfile specified. Are you sure you want to overwrite '{overwrite_what}'? [y/N] ")
         if response.lower() != 'y':
             print("OK, aborting with nothing changed")
             sys.exit(1)
 
+def parse_manifest_args(args:argparse.Namespace, patterns:PatternRegistry)->argparse.Namespace:
+    """
+    Loads a --manifest and turns it into args: args.filename is every file named by the jobs (in the
+    order first named) and args.manifest_rules maps each of them to its rules.
+    """
+    from file_transform_tools.util.manifest import group_rules_by_file, load_manifest
+    if args.filename or args.pattern_name or args.replacement or args.append is not None or args.prepend is not None or args.blank_line_control or args.recursive or args.outfile:
+        print("error: --manifest can't be combined with filenames, -pat, -r, -A, -P, -w, -R or -o; set them per job in the manifest")
+        sys.exit(1)
+    try:
+        rules_by_file = group_rules_by_file(load_manifest(args.manifest))
+    except (OSError, ValueError) as e:
+        print(f"error: could not load manifest: {e}")
+        sys.exit(1)
+
+    # compile every pattern the jobs use now, so a bad pattern is reported once up front
+    for pattern_name in dict.fromkeys(rule.pattern_name for rules in rules_by_file.values() for rule in rules):
+        try:
+            patterns[pattern_name]['pat']
+        except KeyError:
+            print(f"Error: pattern '{pattern_name}' not found in pattern library")
+            sys.exit(1)
+        except (re.error, OSError, ValueError) as e:
+            print(f"error: pattern '{pattern_name}' is invalid: {e}")
+            sys.exit(1)
+
+    if len(rules_by_file) == 0:
+        print(f"error: the jobs in {args.manifest} don't match any files")
+        sys.exit(1)
+
+    args.filename = list(rules_by_file)
+    args.manifest_rules = rules_by_file
+    args.pattern_name = None
+    args.replacement = None
+    args.rules = []
+    args.action = ActionIfBlockNotFound.REPLACE_ONLY
+    check_run_args(args)
     return args
@@ -1,227 +1,194 @@
+from __future__ import annotations
+from array import array
+from typing import NamedTuple
 from file_transform_tools.util.find_block import FileLineRange
 
+class BlankLineControl(NamedTuple):
+    """
+    Desired number of blank lines before and after one inserted or replaced line range.
+    None for either count means that side is left with no blank lines.
+    """
+    line_range:FileLineRange
+    desired_preceding_newlines:int|None
+    desired_trailing_newlines:int|None
+
 def correct_newlines(file_lines:list[str], line_ranges_inserted_or_replaced:list[FileLineRange], desired_preceding_newlines:int, desired_trailing_newlines:int)->list[str]:
     """
     Takes file_lines and for each line range that was inserted or replaced, adjusts the number of newlines before or after it to requested values.
-    Returns modified file_lines.
+    Returns modified file_lines.  file_lines may be str or bytes lines.
+    """
+    return correct_newlines_per_range(file_lines, [BlankLineControl(line_range, desired_preceding_newlines, desired_trailing_newlines) for line_range in line_ranges_inserted_or_replaced])
+
+def correct_newlines_per_range(file_lines:list[str], blank_line_controls:list[BlankLineControl])->list[str]:
+    """
+    Same as correct_newlines(), but each line range has its own desired preceding and trailing newline counts.
+
+    Runs in O(lines + edits): the nearest non-blank line on either side of any line is looked up in two
+    arrays built in a single pass, every range is turned into at most two blank-line edits, and the edits
+    are sorted by line and applied in one merge pass over file_lines.
     """
+    newline = b'\n' if len(file_lines) > 0 and isinstance(file_lines[0], bytes) else '\n'
+    num_lines = len(file_lines)
 
     #
-    # Functions
+    # Nearest non-blank line lookups
     #
+
+    # prev_non_blank[i] is the last non-blank line <= i (or -1), next_non_blank[i] the first non-blank line >= i (or num_lines)
+    prev_non_blank = array('q', bytes(8*num_lines))
+    next_non_blank = array('q', bytes(8*(num_lines+1)))
+    last_non_blank = -1
+    for idx, line in enumerate(file_lines):
+        if line.strip():
+            last_non_blank = idx
+        prev_non_blank[idx] = last_non_blank
+    next_non_blank[num_lines] = num_lines
+    for idx in range(num_lines-1, -1, -1):
+        next_non_blank[idx] = idx if prev_non_blank[idx] == idx else next_non_blank[idx+1]
+
     def get_num_leading_and_trailing_blank_lines_within_replacement_block(modified_line_range:FileLineRange)->tuple[int,int]:
         """
         There may be leading or trailing blank lines inside the replacement block itself, so we need to keep track of that.
         Also, the block may be blank and entirely non-existant.
 
-        The function returns the number of leading and trailing blank lines inside the block.  If the block is empty, obviously
-        it returns zero for both.
-
-        Does not return Nones.
+        Returns the number of leading and trailing blank lines inside the block, or zero for both if the block is empty.
         """
-
         if modified_line_range.is_empty():
             return 0,0
 
         # find the first and last non-blank lines in the modified block (if any)
         first_non_blank_within_modified_block = None
         last_non_blank_within_modified_block = None
-        for idx, line in enumerate(file_lines[modified_line_range.start_line:modified_line_range.end_line+1]):
-            if line.strip() != '':
-                if first_non_blank_within_modified_block is None:
-                    first_non_blank_within_modified_block = idx + modified_line_range.start_line
-                last_non_blank_within_modified_block = idx + modified_line_range.start_line
-        
-        
-        assert (first_non_blank_within_modified_block is None and last_non_blank_within_modified_block is None) or (first_non_blank_within_modified_block is not None and last_non_blank_within_modified_block is not None), "sanity check: either they are both None or neither is None"
+        last_line_within_modified_block = min(modified_line_range.end_line, num_lines-1)
+        if modified_line_range.start_line <= last_line_within_modified_block:
+            if next_non_blank[modified_line_range.start_line] <= last_line_within_modified_block:
+                first_non_blank_within_modified_block = next_non_blank[modified_line_range.start_line]
+                last_non_blank_within_modified_block = prev_non_blank[last_line_within_modified_block]
 
         if first_non_blank_within_modified_block is None:
             # entire insertion is blank lines, so add that number of blank lines to our count of leading blanks later on
+            # (and we don't have to add any blanks at the end)
             add_to_leading_blank_lines = len(modified_line_range)
-        else:
-            if first_non_blank_within_modified_block > 0:
-                # zero or more leading blank lines inside replacement block, so that's how many we will add to our count of leading blank lines
-                add_to_leading_blank_lines = first_non_blank_within_modified_block-modified_line_range.start_line
-            else:
-                # the first non-blank line is the first line of the modified block, so we don't need to add any leading blank lines
-                add_to_leading_blank_lines = 0
-
-        if last_non_blank_within_modified_block is None:
-            # entire insertion is blank lines, but we accounted for it already with add_to_leading_blank_lines,
-            # so we don't have to add any blanks at the end
             add_to_trailing_blank_lines = 0
         else:
-            # zero or more trailing blank lines inside replacement block, so that's how many we will add to our count of trailing blank lines
+            add_to_leading_blank_lines = first_non_blank_within_modified_block-modified_line_range.start_line
             add_to_trailing_blank_lines = modified_line_range.end_line-last_non_blank_within_modified_block
 
-        assert add_to_leading_blank_lines is not None and add_to_leading_blank_lines>=0, "this function should never return a none or negative"
-        assert add_to_trailing_blank_lines is not None and add_to_trailing_blank_lines>=0, "this function should never return a none or negative"
+        assert add_to_leading_blank_lines>=0, "this function should never return a negative"
+        assert add_to_trailing_blank_lines>=0, "this function should never return a negative"
         return add_to_leading_blank_lines, add_to_trailing_blank_lines
 
-    def get_last_non_blank_line_idx_before_range_start(file_lines:list[str], modified_line_range:FileLineRange)->int|None:
-        """
-        Returns the last non-blank line before the modified range's start line.
-        If the modified range starts right at the beginning of the file, we return None.
-        Otherwise, return 0-indexed line offset of last non-blank.
-        """
-        # find the last non-blank line before modified_line_range.start
-        last_leading_non_blank = None
-        if modified_line_range.start_line > 0:
-            for idx, line in enumerate(file_lines[:modified_line_range.start_line]):
-                if line.strip() != '':
-                    last_leading_non_blank = idx
-        return last_leading_non_blank
-
-    def get_first_trailing_non_blank_line_idx_after_range_end(file_lines:list[str], modified_line_range:FileLineRange)->int|None:
-        """
-        find the first non-blank line after modified_line_range.end.
-        If there are none, because we are either already at the end of the file or it's just all blank lines until 
-        the end of the file, then we return None.
-        """
-        first_trailing_non_blank = None
-        if modified_line_range.end_line < len(file_lines):
-            for idx, line in enumerate(file_lines[modified_line_range.end_line+1:]):
-                if line.strip() != '':
-                    first_trailing_non_blank = idx + modified_line_range.end_line+1
-                    break
-        return first_trailing_non_blank
-
-    def get_leading_and_trailing_blank_ranges(file_lines:list[str], modified_line_range:FileLineRange)->tuple[FileLineRange|None,FileLineRange|None]:
+    def get_leading_and_trailing_blank_ranges(modified_line_range:FileLineRange)->tuple[FileLineRange|None,FileLineRange|None]:
         """
         Returns a tuple of two FileLineRange representing the leading blank lines range and the trailing blank lines range.
         Either element can be None -- if there are no leading blank lines, or if there are no trailing blank lines.
         """
-        def get_leading_blank_range()->FileLineRange|None:
-            """
-            Gets the line range of the leading blank lines.  Returns None if there are no leading blank lines.
-            """
-            last_leading_non_blank = get_last_non_blank_line_idx_before_range_start(file_lines=file_lines, modified_line_range=modified_line_range)
-            if last_leading_non_blank is not None:
-                if last_leading_non_blank+1 < modified_line_range.start_line:
-                    first_leading_blank_line = last_leading_non_blank+1
-                else:
-                    first_leading_blank_line = None
-            else:
-                first_leading_blank_line = None
-            
-            if modified_line_range.start_line==0 and modified_range_internal_leading_blanks==0:
-                last_leading_blank_line = None
-            else:
-                last_leading_blank_line = modified_line_range.start_line-1+modified_range_internal_leading_blanks
-        
-            if first_leading_blank_line is None or last_leading_blank_line is None:
-                return None
-            else:
-                return FileLineRange(first_leading_blank_line, last_leading_blank_line)
-
-        def get_trailing_blank_range()->FileLineRange|None:
-            """
-            Gets the line range of the trailing blank lines.  Returns None if there are no trailing blank lines.
-            """
-            first_trailing_non_blank = get_first_trailing_non_blank_line_idx_after_range_end(file_lines=file_lines, modified_line_range=modified_line_range)
-            if first_trailing_non_blank is not None:
-                if first_trailing_non_blank >= modified_line_range.end_line:
-                    last_trailing_blank_line = first_trailing_non_blank-1
-                else:
-                    last_trailing_blank_line = None
-            else:
-                last_trailing_blank_line = None
-
-            if modified_line_range.end_line == len(modified_line_range):
-                # already at the end of the file, so there cannot be any trailing blanks
-                first_trailing_blank_line = None
-            else:
-                first_trailing_blank_line = modified_line_range.end_line+1-modified_range_internal_trailing_blanks
-            
-            if first_trailing_blank_line is None or last_trailing_blank_line is None:
-                return None
-            else:
-                return FileLineRange(first_trailing_blank_line, last_trailing_blank_line)
-        
-        # get internal blank line counts within the replacement
-        modified_range_internal_leading_blanks, modified_range_internal_trailing_blanks = get_num_leading_and_trailing_blank_lines_within_replacement_block(modified_line_range=modified_line_range)
-        
-        return get_leading_blank_range(), get_trailing_blank_range()
-    
-    #
-    # Classes
-    #
-
-    class ReplaceLineRangeWith:
-        def __init__(self, line_range:FileLineRange, replacement:list[str]):
-            self.line_range = line_range
-            self.replacement = replacement
-
-    class InsertBeforeLine:
-        def __init__(self, line:int, replacement:list[str]):
-            self.line = line
-            self.replacement = replacement
+        modified_range_internal_leading_blanks, modified_range_internal_trailing_blanks = get_num_leading_and_trailing_blank_lines_within_replacement_block(modified_line_range)
+        start_line, end_line = modified_line_range
+
+        # leading blank lines start after the last non-blank line before the modified range
+        first_leading_blank_line = None
+        if start_line > 0 and num_lines > 0:
+            last_leading_non_blank = prev_non_blank[min(start_line, num_lines)-1]
+            if last_leading_non_blank >= 0 and last_leading_non_blank+1 < start_line:
+                first_leading_blank_line = last_leading_non_blank+1
+        if start_line==0 and modified_range_internal_leading_blanks==0:
+            last_leading_blank_line = None
+        else:
+            last_leading_blank_line = start_line-1+modified_range_internal_leading_blanks
+
+        # trailing blank lines end before the first non-blank line after the modified range
+        last_trailing_blank_line = None
+        if end_line < num_lines:
+            first_trailing_non_blank = next_non_blank[end_line+1]
+            if first_trailing_non_blank < num_lines:
+                last_trailing_blank_line = first_trailing_non_blank-1
+        if end_line == len(modified_line_range):
+            # already at the end of the file, so there cannot be any trailing blanks
+            first_trailing_blank_line = None
+        else:
+            first_trailing_blank_line = end_line+1-modified_range_internal_trailing_blanks
 
-    class InsertAfterLine:
-        def __init__(self, line:int, replacement:list[str]):
-            self.line = line
-            self.replacement = replacement
+        leading_blank_range = None
+        if first_leading_blank_line is not None and last_leading_blank_line is not None:
+            leading_blank_range = FileLineRange(first_leading_blank_line, last_leading_blank_line)
+        trailing_blank_range = None
+        if first_trailing_blank_line is not None and last_trailing_blank_line is not None:
+            trailing_blank_range = FileLineRange(first_trailing_blank_line, last_trailing_blank_line)
+        return leading_blank_range, trailing_blank_range
 
     #
-    # Function body: correct_newlines
+    # Build the edit list
     #
 
-    # Generate a list of all replacements to make to the file
-    replacements:list[ReplaceLineRangeWith|InsertBeforeLine|InsertAfterLine] = []
-    for modified_line_range in line_ranges_inserted_or_replaced:
+    # each edit is (line, kind, replacement) and only affects the line it is keyed on; the order edits
+    # were generated in matters when several land on the same line, so the sort below must be stable
+    REPLACE_START, REPLACE_END, INSERT_BEFORE, INSERT_AFTER = range(4)
+    edits:list[tuple[int,int,list]] = []
+
+    def add_replace_edit(line_range:FileLineRange, replacement:list):
+        edits.append((line_range.start_line, REPLACE_START, replacement))
+        # an empty range (start_line == end_line+1) has no lines to skip over
+        if line_range.start_line != line_range.end_line+1:
+            edits.append((line_range.end_line+1, REPLACE_END, replacement))
+
+    for modified_line_range, desired_preceding_newlines, desired_trailing_newlines in blank_line_controls:
         # these are the two blocks we want to replace
-        leading_blank_lines_range, trailing_blank_lines_range = get_leading_and_trailing_blank_ranges(file_lines=file_lines, modified_line_range=modified_line_range)
+        leading_blank_lines_range, trailing_blank_lines_range = get_leading_and_trailing_blank_ranges(modified_line_range)
 
-        # hack:  to correct for an off-by-one error when the insertion is at the EOF
-        if modified_line_range.end_line == len(file_lines) and desired_preceding_newlines is not None:
-            desired_preceding_newlines += 1 # TODO: hack!
+        # an insertion at EOF needs one more preceding newline, because the last line before it is the one that ends the file
+        if modified_line_range.end_line == num_lines and desired_preceding_newlines is not None:
+            desired_preceding_newlines += 1
 
         # this is what we want to replace them with
-        leading_blank_lines_replacement = []
-        trailing_blank_lines_replacement = []
-        if desired_preceding_newlines is not None:
-            for i in range(0,desired_preceding_newlines):
-                leading_blank_lines_replacement.append('\n')
-        if desired_trailing_newlines is not None:
-            for i in range(0,desired_trailing_newlines):
-                trailing_blank_lines_replacement.append('\n')
+        leading_blank_lines_replacement = [newline] * (desired_preceding_newlines or 0)
+        trailing_blank_lines_replacement = [newline] * (desired_trailing_newlines or 0)
 
         if leading_blank_lines_range is not None:
-            replacements.append(ReplaceLineRangeWith(line_range=leading_blank_lines_range, replacement=leading_blank_lines_replacement))
+            add_replace_edit(leading_blank_lines_range, leading_blank_lines_replacement)
         else:
-            replacements.append(InsertBeforeLine(line=max(0,modified_line_range.start_line-1), replacement=leading_blank_lines_replacement))
+            edits.append((max(0,modified_line_range.start_line-1), INSERT_BEFORE, leading_blank_lines_replacement))
         if trailing_blank_lines_range is not None:
-            replacements.append(ReplaceLineRangeWith(line_range=trailing_blank_lines_range, replacement=trailing_blank_lines_replacement))
+            add_replace_edit(trailing_blank_lines_range, trailing_blank_lines_replacement)
         else:
-            replacements.append(InsertAfterLine(line=max(0,modified_line_range.end_line-1), replacement=trailing_blank_lines_replacement))
+            edits.append((max(0,modified_line_range.end_line-1), INSERT_AFTER, trailing_blank_lines_replacement))
 
-    # iterate over lines making all replacements
+    edits.sort(key=lambda edit: edit[0])
+
+    #
+    # Apply all edits in one pass over the lines
+    #
     new_file_lines = []
     skip = False
-    skip_once = False
+    edit_idx = 0
+    num_edits = len(edits)
     for line_index, line in enumerate(file_lines):
-        for replacement in replacements:
-            if isinstance(replacement, ReplaceLineRangeWith):
-                if line_index == replacement.line_range.start_line:
-                    new_file_lines.extend(replacement.replacement)
-                    skip = True
-                    break
-                elif line_index == replacement.line_range.end_line+1:
-                    skip = False
-                    break
-            elif isinstance(replacement, InsertBeforeLine):
-                if line_index == replacement.line:
-                    new_file_lines.extend(replacement.replacement)
-                    skip = False
-            elif isinstance(replacement, InsertAfterLine):
-                if line_index == replacement.line:
-                    new_file_lines.append(line)
-                    new_file_lines.extend(replacement.replacement)
-                    skip_once = True
+        # skip over edits keyed on lines that don't exist (e.g. the end of a range at EOF)
+        while edit_idx < num_edits and edits[edit_idx][0] < line_index:
+            edit_idx += 1
+
+        skip_once = False
+        while edit_idx < num_edits and edits[edit_idx][0] == line_index:
+            _, kind, replacement = edits[edit_idx]
+            edit_idx += 1
+            if kind == REPLACE_START:
+                new_file_lines.extend(replacement)
+                skip = True
+                break
+            elif kind == REPLACE_END:
+                skip = False
+                break
+            elif kind == INSERT_BEFORE:
+                new_file_lines.extend(replacement)
+                skip = False
+            elif kind == INSERT_AFTER:
+                new_file_lines.append(line)
+                new_file_lines.extend(replacement)
+                skip_once = True
+
         if not skip and not skip_once:
             new_file_lines.append(line)
         if skip_once:
             skip = False
-            skip_once = False
-    
+
     return new_file_lines
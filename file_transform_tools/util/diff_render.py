@@ -0,0 +1,173 @@
+from __future__ import annotations
+import os
+from typing import Generator, Iterable
+from file_transform_tools.util.line_index import LineOffsetIndex
+from file_transform_tools.util.splice import LineEdit
+
+# lines of unchanged context around each change, as for diff -u
+DEFAULT_CONTEXT = 3
+
+COLOR_RED = '\033[31m'
+COLOR_GREEN = '\033[32m'
+COLOR_CYAN = '\033[36m'
+COLOR_BOLD = '\033[1m'
+COLOR_RESET = '\033[0m'
+
+NO_NEWLINE_MARKER = "\\ No newline at end of file\n"
+
+def _as_str(line:str|bytes)->str:
+    return line if isinstance(line, str) else line.decode('utf-8', errors='replace')
+
+def _format_range(start:int, length:int)->str:
+    # the same "start,length" convention as diff -u (and difflib): 1-based, and the line before an empty range
+    if length == 1:
+        return f"{start+1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start+1},{length}"
+
+def _diff_line(prefix:str, line:str, color:bool)->str:
+    has_newline = line.endswith('\n')
+    text = prefix + (line[:-1] if has_newline else line)
+    if color and prefix != ' ':
+        text = f"{COLOR_RED if prefix == '-' else COLOR_GREEN}{text}{COLOR_RESET}"
+    return text + "\n" + ("" if has_newline else NO_NEWLINE_MARKER)
+
+def _file_header(fromfile:str, tofile:str, color:bool)->list[str]:
+    header = [f"--- {fromfile}", f"+++ {tofile}"]
+    return [f"{COLOR_BOLD}{line}{COLOR_RESET}\n" if color else line + "\n" for line in header]
+
+def _hunk_header(old_start:int, old_length:int, new_start:int, new_length:int, color:bool)->str:
+    header = f"@@ -{_format_range(old_start, old_length)} +{_format_range(new_start, new_length)} @@"
+    return f"{COLOR_CYAN}{header}{COLOR_RESET}\n" if color else header + "\n"
+
+def trim_edits(text:str|bytes, line_index:LineOffsetIndex, edits:list[LineEdit])->list[LineEdit]:
+    """
+    Narrows each edit to the lines it really changes, by dropping replacement lines at either end that
+    are the same as the lines they replace, and drops edits that change nothing.  Replacement lines
+    are returned as str.
+    """
+    def line(i:int)->str:
+        return _as_str(text[line_index.line_start(i):line_index.line_end(i)])
+
+    trimmed = []
+    for edit in edits:
+        start_line, end_line = edit.start_line, edit.end_line
+        replacement_lines = [_as_str(replacement_line) for replacement_line in edit.replacement_lines]
+        while start_line < end_line and replacement_lines and line(start_line) == replacement_lines[0]:
+            start_line += 1
+            replacement_lines = replacement_lines[1:]
+        while start_line < end_line and replacement_lines and line(end_line-1) == replacement_lines[-1]:
+            end_line -= 1
+            replacement_lines = replacement_lines[:-1]
+        if start_line < end_line or replacement_lines:
+            trimmed.append(LineEdit(start_line, end_line, replacement_lines))
+    return trimmed
+
+def _join_unterminated_last_line(text:str|bytes, line_index:LineOffsetIndex, edits:list[LineEdit])->list[LineEdit]:
+    # lines inserted after a last line with no newline are joined onto it in the output (see
+    # iter_splice_chunks()), so the diff has to show that line being replaced rather than left as context
+    num_lines = len(line_index)
+    if num_lines == 0 or text[-1:] in ('\n', b'\n') or not edits or edits[-1].start_line != num_lines:
+        return edits
+    if any(edit.end_line == num_lines and edit.start_line < num_lines for edit in edits):
+        return edits
+    inserted = [replacement_line for edit in edits if edit.start_line == num_lines for replacement_line in edit.replacement_lines]
+    edits = [edit for edit in edits if edit.start_line != num_lines]
+    if len(inserted) == 0:
+        return edits
+    last_line = text[line_index.line_start(num_lines-1):]
+    return edits + [LineEdit(num_lines-1, num_lines, [last_line + inserted[0]] + inserted[1:])]
+
+def iter_edits_diff(text:str|bytes, line_index:LineOffsetIndex, edits:list[LineEdit], fromfile:str, tofile:str, context:int=DEFAULT_CONTEXT, color:bool=False)->Generator[str, None, None]:
+    """
+    Yields the unified diff (as diff -u would print it) between text and the result of applying edits to
+    its lines, straight from the edits: only the edited lines and their context are ever looked at, so
+    nothing is written out or compared line by line.  Yields nothing if the edits change nothing.
+
+    edits must be sorted and non-overlapping, as for splice_lines().  With color, the diff is colored
+    with ANSI escapes like git diff's.
+    """
+    edits = trim_edits(text, line_index, _join_unterminated_last_line(text, line_index, edits))
+    if len(edits) == 0:
+        return
+    num_lines = len(line_index)
+
+    def line(i:int)->str:
+        return _as_str(text[line_index.line_start(i):line_index.line_end(i)])
+
+    yield from _file_header(fromfile, tofile, color)
+
+    # new line number = old line number + shift, before the next edit
+    shift = 0
+    i = 0
+    while i < len(edits):
+        # edits whose contexts touch or overlap go in the same hunk
+        j = i
+        while j+1 < len(edits) and edits[j+1].start_line - edits[j].end_line <= 2*context:
+            j += 1
+        old_start = max(0, edits[i].start_line - context)
+        old_end = min(num_lines, edits[j].end_line + context)
+        new_start = old_start + shift
+
+        body = []
+        pos = old_start
+        for edit in edits[i:j+1]:
+            body.extend(_diff_line(' ', line(k), color) for k in range(pos, edit.start_line))
+            body.extend(_diff_line('-', line(k), color) for k in range(edit.start_line, edit.end_line))
+            body.extend(_diff_line('+', replacement_line, color) for replacement_line in edit.replacement_lines)
+            shift += len(edit.replacement_lines) - (edit.end_line - edit.start_line)
+            pos = edit.end_line
+        body.extend(_diff_line(' ', line(k), color) for k in range(pos, old_end))
+
+        old_length = old_end - old_start
+        yield _hunk_header(old_start, old_length, new_start, old_end + shift - new_start, color)
+        yield from body
+        i = j+1
+
+def iter_lines_diff(old_lines:list[str|bytes], new_lines:list[str|bytes], fromfile:str, tofile:str, context:int=DEFAULT_CONTEXT, color:bool=False)->Generator[str, None, None]:
+    """
+    Same as iter_edits_diff(), for when only the old and new lines are known (e.g. after blank-line
+    control, which can change lines outside the edits); uses difflib to find the changes.
+    """
+    import difflib
+    old_lines = [_as_str(line) for line in old_lines]
+    new_lines = [_as_str(line) for line in new_lines]
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    first = True
+    for group in matcher.get_grouped_opcodes(context):
+        if first:
+            yield from _file_header(fromfile, tofile, color)
+            first = False
+        old_start, old_end = group[0][1], group[-1][2]
+        new_start, new_end = group[0][3], group[-1][4]
+        yield _hunk_header(old_start, old_end - old_start, new_start, new_end - new_start, color)
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                yield from (_diff_line(' ', line, color) for line in old_lines[i1:i2])
+                continue
+            yield from (_diff_line('-', line, color) for line in old_lines[i1:i2])
+            yield from (_diff_line('+', line, color) for line in new_lines[j1:j2])
+
+def patch_path(filename:str, prefix:str)->str:
+    """
+    The name of filename in a patch header: relative to the current directory, with / separators and
+    git's a/ or b/ prefix, so the patch applies with `git apply` or `patch -p1` from the same directory.
+
+    Raises ValueError if filename is outside the current directory, since git apply rejects paths with
+    '..' in them.
+    """
+    path = os.path.relpath(filename).replace(os.sep, '/')
+    if path == '..' or path.startswith('../'):
+        raise ValueError(f"{filename} is outside the current directory, so it can't be named in a patch")
+    return prefix + path
+
+def write_diff(diff:Iterable[str], out)->bool:
+    """
+    Writes the diff lines to out, returning whether there were any.
+    """
+    wrote = False
+    for diff_line in diff:
+        out.write(diff_line)
+        wrote = True
+    return wrote
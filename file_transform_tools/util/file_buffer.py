@@ -0,0 +1,125 @@
+from __future__ import annotations
+import io
+import mmap
+import os
+from file_transform_tools.util.line_index import LineOffsetIndex
+
+class FileBuffer:
+    """
+    The contents of one input file, loaded once and shared by the find, splice and write phases so
+    the file is only read once per run, and the line ranges found by matching always refer to the
+    same content that gets spliced and written.
+
+    The text is either a str (the default, decoded exactly like f.read() in text mode) or, with
+    use_mmap, a read-only mmap of the raw bytes.  In the default mode the file is read as raw bytes
+    and only decoded the first time text is used, so contains_all() can reject a file that cannot
+    match without ever decoding it.
+
+    Example:
+        with FileBuffer.load(filename) as file_buffer:
+            line_ranges = find_lines_in_buffer(file_buffer.text, pattern, line_index=file_buffer.line_index)
+            replace_or_insert_block(filename, line_ranges, action, replacement_text, file_buffer=file_buffer)
+    """
+    def __init__(self, filename:str, text:str|bytes|None, mm:mmap.mmap=None, raw:bytes=None, stat:os.stat_result=None):
+        self.filename = filename
+        # the stat of the file as it was opened, when loaded from a file
+        self.stat = stat
+        self._text = text
+        self._raw = raw
+        # the line endings the decoded text was translated from, as in a text file object's newlines
+        # attribute: None until decoded (or if there were none to translate), or e.g. '\r\n'
+        self.newlines = None
+        self.mm = mm
+        self._line_index = None
+
+    @classmethod
+    def load(cls, filename:str, use_mmap:bool=False)->'FileBuffer':
+        if use_mmap:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                # an empty file cannot be mapped
+                if f.seek(0, 2) == 0:
+                    return cls(filename, b'', stat=st)
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls(filename, mm, mm=mm, stat=st)
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            return cls(filename, None, raw=f.read(), stat=st)
+
+    @property
+    def text(self)->str|bytes:
+        """
+        The buffer contents; in the default mode the raw bytes are decoded (with the same encoding and
+        universal newline translation as open(filename, 'r')) on first use.
+        """
+        if self._text is None:
+            wrapper = io.TextIOWrapper(io.BytesIO(self._raw))
+            self._text = wrapper.read()
+            self.newlines = wrapper.newlines
+            self._raw = None
+        return self._text
+
+    def is_bytes(self)->bool:
+        return self.mm is not None or (self._text is not None and not isinstance(self._text, str))
+
+    def contains_all(self, literals:list[str|bytes])->bool:
+        """
+        True if every literal occurs somewhere in the buffer.  This is a plain substring search on the
+        raw bytes, without decoding, so it is a cheap way to rule out files before running a regex.
+
+        str literals are encoded the way the buffer is decoded: with the text encoding for raw bytes,
+        and as UTF-8 for an mmap (which str patterns are run on as UTF-8, see as_bytes_pattern()).
+        """
+        if self._text is None:
+            haystack = self._raw
+            import locale
+            encoding = locale.getpreferredencoding(False)
+            # the substring search only works for encodings that encode each character on its own
+            # (not e.g. UTF-16, whose encoder starts with a byte order mark)
+            if "\n".encode(encoding) != b"\n":
+                return True
+            encoded = []
+            for literal in literals:
+                if isinstance(literal, str):
+                    try:
+                        literal = literal.encode(encoding)
+                    except UnicodeEncodeError:
+                        # the decoded text can't contain it
+                        return False
+                encoded.append(literal)
+            literals = encoded
+        elif isinstance(self._text, str):
+            # already decoded, so search the text rather than keeping the raw bytes around as well
+            haystack = self._text
+            literals = [literal if isinstance(literal, str) else literal.decode('utf-8', errors='replace') for literal in literals]
+        else:
+            haystack = self._text
+            literals = [literal.encode('utf-8') if isinstance(literal, str) else literal for literal in literals]
+        return all(haystack.find(literal) != -1 for literal in literals)
+
+    @property
+    def line_index(self)->LineOffsetIndex:
+        """
+        The newline index of the buffer, built on first use.
+        """
+        if self._line_index is None:
+            self._line_index = LineOffsetIndex(self.text)
+        return self._line_index
+
+    def lines(self)->list[str|bytes]:
+        """
+        Returns the buffer split into lines with their newlines, the same as f.readlines().
+        """
+        line_index = self.line_index
+        return [self.text[line_index.line_start(i):line_index.line_end(i)] for i in range(len(line_index))]
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def __enter__(self)->'FileBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,31 +1,89 @@
+from __future__ import annotations
+import os
 import re
+from typing import TYPE_CHECKING
 from file_transform_tools.util.file_line_range import FileLineRange
-from file_transform_tools.re_pattern_library import ModifiedPatternMatcher, PatternMatcherModifiers
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.line_index import LineOffsetIndex
+from file_transform_tools.re_pattern_library import ModifiedPatternMatcher, PatternMatcherModifiers, derive_required_literals
 
-def find_lines_to_replace(filename, pattern:re.Pattern, verbose=False)->list[FileLineRange]:
-    start_line = 0
-    end_line = 0
+# the match cache is only imported when one is used
+if TYPE_CHECKING:
+    from file_transform_tools.util.match_cache import MatchCache
 
-    with open(filename, 'r') as f:
-        lines = f.readlines()
+def find_lines_to_replace(filename, pattern:re.Pattern, verbose=False, use_mmap=False, required_literals:list[str|bytes]=None, match_cache:'MatchCache'=None)->list[FileLineRange]:
+    """
+    Returns the inclusive line ranges of every match of pattern in filename.
 
-    # Join lines with newline so we can match across them
-    text = ''.join(lines)
+    With use_mmap, the file is memory-mapped and the pattern is run as a bytes regex directly on the
+    mapping, so neither a decoded copy of the file nor a list of its lines is ever built.
+
+    To avoid reading the file a second time when replacing, load it once with FileBuffer.load() and
+    use find_lines_in_file_buffer() instead.  For a file too large to hold in memory, use
+    find_lines_windowed() (util/windowed_scan.py), which reads it in windows.
+
+    required_literals defaults to the literals derived from pattern; see find_lines_in_file_buffer().
+
+    With a match_cache, a file that hasn't changed since its matches were cached isn't read at all.
+    """
+    if required_literals is None:
+        required_literals = list(derive_required_literals(pattern))
+    if match_cache is not None:
+        from file_transform_tools.util.match_cache import pattern_fingerprint
+        fingerprint = pattern_fingerprint(pattern, use_mmap)
+        cached_matches = match_cache.lookup(os.stat(filename), fingerprint)
+        if cached_matches is not None:
+            return [cached_match.line_range for cached_match in cached_matches]
+    with FileBuffer.load(filename, use_mmap=use_mmap) as file_buffer:
+        line_ranges = find_lines_in_file_buffer(file_buffer, pattern, verbose=verbose, required_literals=required_literals)
+        if match_cache is not None:
+            store_matches(match_cache, file_buffer, fingerprint, line_ranges)
+        return line_ranges
+
+def store_matches(match_cache:'MatchCache', file_buffer:FileBuffer, fingerprint:str, line_ranges:list[FileLineRange]):
+    """
+    Caches the line ranges found in a loaded FileBuffer, with the digests of their blocks.
+    """
+    from file_transform_tools.util.match_cache import range_digests
+    if len(line_ranges) > 0:
+        cached_matches = range_digests(file_buffer.text, file_buffer.line_index, line_ranges)
+    else:
+        cached_matches = []
+    match_cache.store(file_buffer.stat, fingerprint, cached_matches)
+
+def find_lines_in_file_buffer(file_buffer:FileBuffer, pattern:re.Pattern, verbose=False, required_literals:list[str|bytes]=None)->list[FileLineRange]:
+    """
+    Returns the inclusive line ranges of every match of pattern in a loaded FileBuffer.
+
+    If required_literals is given and the buffer doesn't contain all of them, there can be no match, so
+    an empty list is returned straight after a substring search of the raw bytes: the file is never
+    decoded, indexed or run through the regex.
+    """
+    if required_literals and not file_buffer.contains_all(required_literals):
+        if verbose:
+            print(f"No match: {file_buffer.filename} does not contain all of {required_literals}")
+        return []
+    return find_lines_in_buffer(file_buffer.text, pattern, verbose=verbose, line_index=file_buffer.line_index)
+
+def find_lines_in_buffer(text:str|bytes, pattern:re.Pattern, verbose=False, line_index:LineOffsetIndex=None)->list[FileLineRange]:
+    """
+    Returns the inclusive line ranges of every match of pattern in text, which may be a str or a
+    bytes-like buffer (bytes, mmap).  Pass line_index if one has already been built for text.
+    """
+    # build the newline index once so each match is translated to line numbers in O(log n)
+    if line_index is None:
+        line_index = LineOffsetIndex(text)
 
     file_line_ranges = []
     modified_pattern_matcher = ModifiedPatternMatcher(text, pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
     for (start_pos,end_pos) in modified_pattern_matcher.finditer():
-        start_char = start_pos
-        end_char = end_pos
-
         # Compute line numbers
-        start_line = text.count('\n', 0, start_char+1)
-        end_line = text.count('\n', 0, end_char)
+        line_range = line_index.line_range(start_pos, end_pos)
 
         if verbose:
-            print(f"Match from line {start_line} to {end_line}")
+            print(f"Match from line {line_range.start_line} to {line_range.end_line}")
             print(repr(text[start_pos:end_pos]))
     
-        file_line_ranges.append(FileLineRange(start_line, end_line))
+        file_line_ranges.append(line_range)
     
     return file_line_ranges
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import re
+from array import array
+from bisect import bisect_left
+from file_transform_tools.util.file_line_range import FileLineRange
+
+_NEWLINE_STR = re.compile('\n')
+_NEWLINE_BYTES = re.compile(b'\n')
+
+class LineOffsetIndex:
+    """
+    Index of the newline positions in a buffer, built once per file and queried by binary search.
+
+    The buffer can be a str, bytes or any object supporting the buffer protocol (e.g. an mmap).
+    Line numbers are 0-indexed and follow the same convention as f.readlines(): a final line that
+    does not end in a newline still counts as a line.
+
+    Example:
+        index = LineOffsetIndex("a\\nbb\\nc")
+        index.line_of(3) == 1          # 'b' is on line 1
+        index.line_start(2) == 5       # 'c' starts at offset 5
+        len(index) == 3
+    """
+    def __init__(self, buf):
+        self.buf_len = len(buf)
+        newline_re = _NEWLINE_STR if isinstance(buf, str) else _NEWLINE_BYTES
+
+        # offsets fit in 4 bytes for anything under 2GB, which halves the size of the index
+        typecode = 'i' if self.buf_len < 2**31 else 'q'
+        self.newline_offsets = array(typecode, (m.start() for m in newline_re.finditer(buf)))
+
+        if self.buf_len > 0 and (len(self.newline_offsets) == 0 or self.newline_offsets[-1] != self.buf_len-1):
+            self.num_lines = len(self.newline_offsets) + 1
+        else:
+            self.num_lines = len(self.newline_offsets)
+
+    def __len__(self)->int:
+        """
+        Returns the number of lines in the buffer (same as len(f.readlines())).
+        """
+        return self.num_lines
+
+    def line_of(self, pos:int)->int:
+        """
+        Returns the number of newlines before character position pos, i.e. the 0-indexed line
+        that pos falls on.  Equivalent to buf.count('\\n', 0, pos) but O(log n).
+        """
+        return bisect_left(self.newline_offsets, pos)
+
+    def line_start(self, line:int)->int:
+        """
+        Returns the character position of the first character of the given line.  Passing
+        len(index) returns the length of the buffer.
+        """
+        if line <= 0:
+            return 0
+        if line > len(self.newline_offsets):
+            return self.buf_len
+        return self.newline_offsets[line-1] + 1
+
+    def line_end(self, line:int)->int:
+        """
+        Returns the character position just past the end of the given line, including its newline.
+        """
+        return self.line_start(line+1)
+
+    def line_range(self, start_pos:int, end_pos:int)->FileLineRange:
+        """
+        Converts a (start_pos, end_pos) match span into an inclusive FileLineRange.
+
+        A match that starts on a newline character (e.g. a leading ^\\s* that swallowed a blank
+        line) is considered to start on the following line.
+        """
+        return FileLineRange(self.line_of(start_pos+1), self.line_of(end_pos))
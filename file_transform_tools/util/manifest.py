@@ -0,0 +1,129 @@
+from __future__ import annotations
+import glob
+import os
+import sys
+from typing import NamedTuple
+from file_transform_tools.util.cli import ActionIfBlockNotFound, BlockRule
+from file_transform_tools.util.pattern_registry import read_config_file
+
+# manifest job 'action' values and the -A/-P behaviour they stand for
+MANIFEST_ACTIONS = {
+    'replace': ActionIfBlockNotFound.REPLACE_ONLY,
+    'append': ActionIfBlockNotFound.REPLACE_OR_APPEND,
+    'prepend': ActionIfBlockNotFound.REPLACE_OR_PREPEND,
+}
+
+MANIFEST_JOB_KEYS = {'files', 'pattern', 'replacement', 'action', 'prefix', 'suffix', 'blank_lines'}
+
+class ManifestJob(NamedTuple):
+    """
+    One [[jobs]] entry of a manifest: apply rule to each of files (absolute paths, globs already expanded).
+    """
+    files:list[str]
+    rule:BlockRule
+
+def _expand_files(base_dir:str, files:list[str], where:str)->list[str]:
+    """
+    Expands the job's file names and globs, relative to the manifest's directory.  A literal file that
+    doesn't exist is an error, while a glob that matches nothing is only a warning.
+    """
+    expanded = []
+    for name in files:
+        path = os.path.join(base_dir, os.path.expanduser(name))
+        if glob.has_magic(path):
+            matches = sorted(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+            if len(matches) == 0:
+                print(f"warning: {where}: '{name}' does not match any files", file=sys.stderr)
+            expanded.extend(os.path.abspath(p) for p in matches)
+        elif not os.path.isfile(path):
+            raise ValueError(f"{where}: file '{name}' not found")
+        else:
+            expanded.append(os.path.abspath(path))
+    return expanded
+
+def load_manifest(path:str)->list[ManifestJob]:
+    """
+    Reads a TOML (.toml) or JSON manifest of jobs, e.g.
+
+        [[jobs]]
+        files = ["hosts/*/.bashrc", "~/.bashrc"]
+        pattern = "bash_rc_export_path"
+        replacement = "@snippets/path.sh"
+        action = "append"
+        prefix = "\\n"
+        blank_lines = [1, 1]
+
+    files can be a single name or a list of names and globs ('**' recurses).  replacement is the text, or
+    '@file' to read it from a file; an omitted replacement deletes the block.  action is one of 'replace'
+    (the default), 'append' or 'prepend', with prefix and suffix the optional -A prefix and -P suffix, and
+    blank_lines is the job's -w setting.  Relative paths are relative to the manifest's directory, and each
+    '@file' is read once however many jobs use it.
+
+    Raises ValueError for a malformed manifest, and OSError if it or a replacement file can't be read.
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    base_dir = os.path.dirname(path)
+    entries = read_config_file(path).get('jobs')
+    if not isinstance(entries, list) or len(entries) == 0:
+        raise ValueError(f"{path} has no [[jobs]] entries")
+
+    replacement_files:dict[str, str] = {}
+    jobs = []
+    for i, entry in enumerate(entries):
+        where = f"{path}: job {i+1}"
+        if not isinstance(entry, dict):
+            raise ValueError(f"{where}: must be a table/object")
+        unknown_keys = set(entry) - MANIFEST_JOB_KEYS
+        if unknown_keys:
+            raise ValueError(f"{where}: unknown key(s) {', '.join(sorted(unknown_keys))}")
+        if 'pattern' not in entry or 'files' not in entry:
+            raise ValueError(f"{where}: 'pattern' and 'files' are required")
+
+        files = entry['files']
+        if isinstance(files, str):
+            files = [files]
+
+        action_name = entry.get('action', 'replace')
+        if action_name not in MANIFEST_ACTIONS:
+            raise ValueError(f"{where}: action must be one of {', '.join(MANIFEST_ACTIONS)}")
+        action = MANIFEST_ACTIONS[action_name]
+        if 'prefix' in entry and action_name != 'append':
+            raise ValueError(f"{where}: 'prefix' only applies to action = \"append\"")
+        if 'suffix' in entry and action_name != 'prepend':
+            raise ValueError(f"{where}: 'suffix' only applies to action = \"prepend\"")
+        affix = entry.get('prefix', entry.get('suffix', ""))
+
+        blank_line_control = entry.get('blank_lines')
+        if blank_line_control is not None:
+            if not isinstance(blank_line_control, list) or len(blank_line_control) != 2 or not all(isinstance(n, int) for n in blank_line_control):
+                raise ValueError(f"{where}: blank_lines must be [preceding, trailing]")
+            blank_line_control = tuple(blank_line_control)
+
+        replacement_text = entry.get('replacement')
+        if replacement_text is not None and replacement_text.startswith('@'):
+            replacement_path = os.path.abspath(os.path.join(base_dir, os.path.expanduser(replacement_text[1:])))
+            if replacement_path not in replacement_files:
+                if not os.path.isfile(replacement_path):
+                    raise ValueError(f"{where}: replacement file '{replacement_text[1:]}' not found")
+                with open(replacement_path, 'r') as f:
+                    replacement_files[replacement_path] = f.read()
+            replacement_text = replacement_files[replacement_path]
+
+        rule = BlockRule(entry['pattern'], replacement_text, action=action, affix=affix, blank_line_control=blank_line_control)
+        jobs.append(ManifestJob(_expand_files(base_dir, files, where), rule))
+    return jobs
+
+def group_rules_by_file(jobs:list[ManifestJob])->dict[str, list[BlockRule]]:
+    """
+    Regroups the jobs by file, in the order files are first named, so every file is opened, rewritten
+    and backed up once with all of its rules.  Raises ValueError if two jobs use the same pattern on one
+    file.
+    """
+    rules_by_file:dict[str, list[BlockRule]] = {}
+    for job in jobs:
+        for filename in job.files:
+            rules = rules_by_file.setdefault(filename, [])
+            if any(rule.pattern_name == job.rule.pattern_name for rule in rules):
+                raise ValueError(f"pattern '{job.rule.pattern_name}' is applied to {filename} by more than one job")
+            rules.append(job.rule)
+    return rules_by_file
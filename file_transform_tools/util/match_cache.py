@@ -0,0 +1,203 @@
+from __future__ import annotations
+import os
+import re
+import time
+from typing import NamedTuple
+from file_transform_tools.util.block_matcher import BlockPattern
+from file_transform_tools.util.file_line_range import FileLineRange
+from file_transform_tools.util.line_index import LineOffsetIndex
+# defined with the command line options, so parsing them doesn't import this module
+from file_transform_tools.util.cli import DEFAULT_MAX_ENTRIES
+
+# bump when the meaning of a cached entry changes; an older cache is then emptied on open
+CACHE_FORMAT_VERSION = 1
+
+# a file modified this recently could be modified again within the same mtime tick after we read it, so
+# its matches aren't cached (the same "racily clean" problem git's index has)
+RACY_WINDOW_NS = 2_000_000_000
+
+# the size limit is enforced every this many stores, and when the cache is closed
+EVICT_EVERY = 1000
+
+# hits' last-used times are written this many at a time (and before evicting or closing), in one
+# transaction, rather than with an UPDATE per hit
+TOUCH_EVERY = 1000
+
+class CachedMatch(NamedTuple):
+    """
+    One cached match: its inclusive line range and the block_digest() of the lines it covers, so a
+    replacement can be known to be a no-op without reading the file.
+    """
+    line_range:FileLineRange
+    digest:str
+
+def block_digest(block:str|bytes)->str:
+    import hashlib
+    if isinstance(block, str):
+        block = block.encode('utf-8')
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+def range_digests(text:str|bytes, line_index:LineOffsetIndex, line_ranges:list[FileLineRange])->list[CachedMatch]:
+    """
+    Pairs each line range with the digest of its lines, newlines included (the same lines a replacement
+    of the range would replace).
+    """
+    return [CachedMatch(line_range, block_digest(text[line_index.line_start(line_range.start_line):line_index.line_start(line_range.end_line+1)])) for line_range in line_ranges]
+
+def pattern_fingerprint(pattern:re.Pattern|BlockPattern, is_bytes:bool)->str:
+    """
+    Identifies what a pattern matches, so a cache entry is only reused for the same pattern.  is_bytes
+    (an --mmap run) is part of it because bytes buffers keep \\r\\n line endings, so block digests differ.
+    """
+    if isinstance(pattern, BlockPattern):
+        source = ('block', pattern.begin.pattern, pattern.open_marker.pattern, pattern.close_marker.pattern)
+    else:
+        source = ('regex', pattern.pattern, pattern.flags & ~re.UNICODE)
+    return block_digest(repr((CACHE_FORMAT_VERSION, source, is_bytes)))
+
+def _int64(value:int)->int:
+    # st_dev and st_ino are unsigned 64-bit, sqlite integers signed
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def file_key(st:os.stat_result)->tuple[int, int, int, int]:
+    return (_int64(st.st_dev), _int64(st.st_ino), st.st_size, st.st_mtime_ns)
+
+class MatchCache:
+    """
+    An on-disk cache of the matches found in files, keyed by (device, inode, size, mtime_ns, pattern
+    fingerprint), so a file that hasn't changed since a previous run needn't be read or matched again.
+
+    It is an sqlite database in WAL mode, so parallel runs and --jobs workers can share it (each process
+    opens its own connection).  Entries are evicted least recently used first once there are more than
+    max_entries; the last-used times of hits are only written in batches (see TOUCH_EVERY), so the
+    cache has to be closed for the last of them to count.
+    """
+    def __init__(self, path:str, max_entries:int=DEFAULT_MAX_ENTRIES):
+        import sqlite3
+        self.path = path
+        self.max_entries = max_entries
+        self._stores_since_evict = 0
+        # (last_used,) + key of each hit whose last-used time hasn't been written yet
+        self._touched:list[tuple] = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # autocommit: every statement is its own short transaction, so concurrent runs never wait long
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != CACHE_FORMAT_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS matches")
+            self._db.execute(f"PRAGMA user_version={CACHE_FORMAT_VERSION}")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS matches (
+            dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, fingerprint TEXT,
+            matches TEXT NOT NULL, last_used INTEGER NOT NULL,
+            PRIMARY KEY (dev, ino, size, mtime_ns, fingerprint)) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)")
+
+    def lookup(self, st:os.stat_result, fingerprint:str)->list[CachedMatch]|None:
+        """
+        Returns the cached matches for the file with stat st, or None on a miss.
+        """
+        key = file_key(st) + (fingerprint,)
+        row = self._db.execute("SELECT matches FROM matches WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND fingerprint=?", key).fetchone()
+        if row is None:
+            return None
+        self._touched.append((time.time_ns(),) + key)
+        if len(self._touched) >= TOUCH_EVERY:
+            self._write_touched()
+        return [CachedMatch(FileLineRange(start_line, end_line), digest) for start_line, end_line, digest in _decode(row[0])]
+
+    def store(self, st:os.stat_result, fingerprint:str, matches:list[CachedMatch]):
+        """
+        Caches the matches found in the file whose stat (taken before it was read) is st.  Files modified
+        within the last RACY_WINDOW_NS are skipped.
+        """
+        now = time.time_ns()
+        if now - st.st_mtime_ns < RACY_WINDOW_NS:
+            return
+        self._db.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)", file_key(st) + (fingerprint, _encode(matches), now))
+        self._stores_since_evict += 1
+        if self._stores_since_evict >= EVICT_EVERY:
+            self.evict()
+
+    def _write_touched(self):
+        """
+        Writes the last-used times of the hits since the last call, in a single transaction.
+        """
+        if len(self._touched) == 0:
+            return
+        self._db.execute("BEGIN")
+        try:
+            self._db.executemany("UPDATE matches SET last_used=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND fingerprint=?", self._touched)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._touched = []
+
+    def evict(self):
+        """
+        Deletes the least recently used entries beyond max_entries.
+        """
+        self._write_touched()
+        self._stores_since_evict = 0
+        # counted in the same statement, so processes evicting at once (e.g. --jobs workers exiting)
+        # don't each delete the same excess
+        self._db.execute("DELETE FROM matches WHERE (dev, ino, size, mtime_ns, fingerprint) IN (SELECT dev, ino, size, mtime_ns, fingerprint FROM matches ORDER BY last_used LIMIT max((SELECT COUNT(*) FROM matches) - ?, 0))", (self.max_entries,))
+
+    def __len__(self)->int:
+        return self._db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def close(self):
+        if self._db is not None:
+            if self._stores_since_evict > 0:
+                self.evict()
+            else:
+                self._write_touched()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self)->'MatchCache':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _encode(matches:list[CachedMatch])->str:
+    return ";".join(f"{m.line_range.start_line},{m.line_range.end_line},{m.digest}" for m in matches)
+
+def _decode(s:str)->list[tuple[int, int, str]]:
+    decoded = []
+    for item in s.split(";") if s else []:
+        start_line, end_line, digest = item.split(",")
+        decoded.append((int(start_line), int(end_line), digest))
+    return decoded
+
+# this process's open caches by path; a forked --jobs worker must not use its parent's connections
+_open_caches:dict[str, MatchCache] = {}
+_open_caches_pid = os.getpid()
+
+def open_match_cache(path:str, max_entries:int=DEFAULT_MAX_ENTRIES)->MatchCache:
+    """
+    Returns this process's connection to the cache at path, opening it on first use.  --jobs workers each
+    open their own.
+    """
+    global _open_caches_pid
+    if _open_caches_pid != os.getpid():
+        _open_caches.clear()
+        _open_caches_pid = os.getpid()
+    path = os.path.abspath(os.path.expanduser(path))
+    if path not in _open_caches:
+        _open_caches[path] = MatchCache(path, max_entries=max_entries)
+    return _open_caches[path]
+
+def close_match_caches():
+    """
+    Closes this process's caches, writing out their pending last-used times and evicting down to
+    max_entries.  --jobs workers do this as they exit (see parallel._init_worker()).
+    """
+    if _open_caches_pid != os.getpid():
+        # inherited from the parent over a fork: its connections aren't this process's to close
+        _open_caches.clear()
+        return
+    while _open_caches:
+        _open_caches.popitem()[1].close()
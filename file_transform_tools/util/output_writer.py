@@ -0,0 +1,111 @@
+from __future__ import annotations
+import os
+from typing import Iterable
+
+# --fsync policies: don't fsync, fsync each file (and its directory) as it is written, or fsync them all
+# at the end of the run (see sync_batch())
+FSYNC_NONE = "none"
+FSYNC_PER_FILE = "per-file"
+FSYNC_BATCH = "batch"
+FSYNC_POLICIES = [FSYNC_NONE, FSYNC_PER_FILE, FSYNC_BATCH]
+
+def write_chunks(filename, chunks:Iterable[str|bytes], binary:bool=False):
+    """
+    Writes a stream of chunks to filename, one chunk at a time.
+    """
+    with open(filename, 'wb' if binary else 'w') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+def fsync_dir(dir_name:str):
+    """
+    fsyncs a directory, so a rename into it is durable; a no-op where directories can't be opened (Windows).
+    """
+    try:
+        fd = os.open(dir_name, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def copy_file_metadata(st:os.stat_result, src:str, dst:str):
+    """
+    Gives dst the permission bits, owner and extended attributes of src (whose stat is st), as far as we
+    are allowed to: changing the owner needs privileges, and some xattr namespaces (e.g. security.*) may
+    be read-only.
+    """
+    os.chmod(dst, st.st_mode & 0o7777)
+    if hasattr(os, 'chown'):
+        dst_st = os.stat(dst)
+        if (dst_st.st_uid, dst_st.st_gid) != (st.st_uid, st.st_gid):
+            try:
+                os.chown(dst, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+            # chown can clear the setuid/setgid bits
+            os.chmod(dst, st.st_mode & 0o7777)
+    if hasattr(os, 'listxattr'):
+        try:
+            names = os.listxattr(src)
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                os.setxattr(dst, name, os.getxattr(src, name))
+            except OSError:
+                pass
+
+def overwrite_with_chunks(filename, chunks:Iterable[str|bytes], binary:bool=False, fsync:str=FSYNC_NONE):
+    """
+    Atomically overwrites filename with a stream of chunks.
+
+    The output is streamed into a temp file in the same directory, which gets the original's mode, owner
+    and xattrs and is then moved over filename with os.replace(), so a crash or a concurrent reader sees
+    either the old file or the new one, never a truncated one.  This also makes it safe to read the
+    chunks out of filename itself (e.g. from an mmap of it).  A symlink is followed, so the file it points
+    to is replaced rather than the link.  Hard links to the old file keep the old contents.
+
+    With fsync=FSYNC_PER_FILE the temp file is fsynced before the rename and the directory after it;
+    with FSYNC_BATCH the caller is expected to call sync_batch() once all files are written.
+    """
+    filename = os.path.realpath(filename)
+    dir_name, base_name = os.path.split(filename)
+    st = os.stat(filename)
+
+    import tempfile
+    fd, temp_filename = tempfile.mkstemp(dir=dir_name, prefix=f".{base_name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            if fsync == FSYNC_PER_FILE:
+                f.flush()
+                os.fsync(f.fileno())
+        copy_file_metadata(st, filename, temp_filename)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+    if fsync == FSYNC_PER_FILE:
+        fsync_dir(dir_name)
+
+def sync_batch(filenames:Iterable[str]):
+    """
+    The end-of-run sync for FSYNC_BATCH: fsyncs each of filenames (the files the run overwrote, including
+    those written by --jobs workers) and then each of their directories once, so the writes are left to
+    the OS until the end rather than waited for one file at a time.  Only these files are flushed, not
+    everything else pending on the machine's filesystems as with os.sync().
+    """
+    dir_names = {}
+    for filename in filenames:
+        filename = os.path.realpath(filename)
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        dir_names[os.path.dirname(filename)] = None
+    for dir_name in dir_names:
+        fsync_dir(dir_name)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import argparse
+import contextlib
+import heapq
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Generator, Iterable
+from file_transform_tools.util.cli import BlockRule
+from file_transform_tools.util.process_file import FileResult, process_file
+from file_transform_tools.re_pattern_library import patterns
+
+def _process_file_captured(filename:str, args:argparse.Namespace, replacement_text:str, rules:list[BlockRule]=None)->tuple[FileResult, str]:
+    """
+    Runs process_file() in a worker, capturing everything it prints so the parent can print it in input order.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        file_result = process_file(filename, args, replacement_text, rules=rules)
+    return file_result, output.getvalue()
+
+def _init_worker(pattern_files:list[str], use_cache:bool=False):
+    """
+    Worker initializer: workers that don't inherit the parent's memory (spawn start method) need the
+    --pattern-file patterns loaded again.  With use_cache (--cache), the match cache a worker opens is
+    closed as it exits (the parent's finish_run() only closes its own), so its last-used times are
+    written and it is evicted down to size.
+    """
+    for pattern_file in pattern_files:
+        patterns.load_file(pattern_file)
+    if use_cache:
+        from multiprocessing.util import Finalize
+        from file_transform_tools.util.match_cache import close_match_caches
+        Finalize(None, close_match_caches, exitpriority=10)
+
+def _file_size(filename:str)->int:
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        return 0
+
+def run_parallel(filenames:Iterable[str], args:argparse.Namespace, replacement_text:str, jobs:int, max_in_flight_bytes:int, lookahead:int=None, rules_by_file:dict[str, list[BlockRule]]=None)->Generator[tuple[FileResult, str], None, None]:
+    """
+    Processes filenames on a pool of jobs worker processes and yields (FileResult, printed output) for each
+    file in the same order as filenames, i.e. the same order a serial run would produce.
+
+    Larger files are scheduled first so a single big file doesn't stretch the end of the run, and new files
+    are only submitted while the total size of the files in flight is within max_in_flight_bytes (a single
+    file larger than that still runs, on its own).
+
+    filenames can be a generator, such as a directory walk: files are pulled from it lazily into a window of
+    lookahead files (default: all of them for a list, 16 per job otherwise) and the largest file in the
+    window goes first.
+
+    rules_by_file gives each file its own rules (see process_file()), e.g. for --manifest runs.
+    """
+    if lookahead is None:
+        lookahead = len(filenames) if isinstance(filenames, (list, tuple)) else 16*jobs
+    lookahead = max(1, lookahead)
+    numbered_filenames = enumerate(filenames)
+
+    # heap of (-size, input index, filename) for files read from filenames but not yet submitted
+    pending:list[tuple[int, int, str]] = []
+    all_read = False
+
+    in_flight = {}
+    in_flight_bytes = 0
+    finished:dict[int, tuple[FileResult, str]] = {}
+    next_to_yield = 0
+
+    pattern_files = getattr(args, 'pattern_file', None) or []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(pattern_files, bool(getattr(args, 'cache_file', None)))) as executor:
+        while True:
+            # top up the lookahead window
+            while not all_read and len(pending) < lookahead:
+                try:
+                    idx, filename = next(numbered_filenames)
+                except StopIteration:
+                    all_read = True
+                    break
+                heapq.heappush(pending, (-_file_size(filename), idx, filename))
+
+            # keep every worker busy (plus one queued each) as long as the byte budget allows
+            while len(pending) > 0 and len(in_flight) < 2*jobs:
+                size = -pending[0][0]
+                if len(in_flight) > 0 and in_flight_bytes + size > max_in_flight_bytes:
+                    break
+                _, idx, filename = heapq.heappop(pending)
+                rules = rules_by_file[filename] if rules_by_file is not None else None
+                in_flight[executor.submit(_process_file_captured, filename, args, replacement_text, rules)] = (idx, size)
+                in_flight_bytes += size
+
+            if len(in_flight) == 0:
+                if all_read and len(pending) == 0:
+                    break
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, size = in_flight.pop(future)
+                in_flight_bytes -= size
+                finished[idx] = future.result()
+
+            # hand back results in input order as soon as the next one is available
+            while next_to_yield in finished:
+                yield finished.pop(next_to_yield)
+                next_to_yield += 1
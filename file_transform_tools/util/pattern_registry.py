@@ -0,0 +1,232 @@
+from __future__ import annotations
+import os
+import re
+import sys
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Iterator
+from file_transform_tools.util.block_matcher import BlockPattern
+
+# os.pathsep separated list of pattern files loaded into the registry on first use
+PATTERN_FILES_ENV_VAR = "FILE_TRANSFORM_TOOLS_PATTERN_FILES"
+
+# installed packages can add patterns by declaring an entry point in this group; it must point at a
+# dict of {name: spec} (the same specs as in pattern files) or a callable returning one
+ENTRY_POINT_GROUP = "file_transform_tools.patterns"
+
+@lru_cache(maxsize=None)
+def compile_pattern(source:str, flags:int)->re.Pattern:
+    """
+    Compiles a regex pattern, once per (source, flags) for the life of the process.
+    """
+    return re.compile(source, flags)
+
+@lru_cache(maxsize=None)
+def compile_block_pattern(begin:str, open_marker:str, close_marker:str)->BlockPattern:
+    """
+    Builds a BlockPattern, once per (begin, open_marker, close_marker) for the life of the process.
+    """
+    return BlockPattern(begin=begin, open_marker=open_marker, close_marker=close_marker)
+
+def parse_flags(flags:int|str|list[str])->int:
+    """
+    Converts pattern file flags to re flags: an int, a name such as "MULTILINE", a "MULTILINE|VERBOSE"
+    string, or a list of names.
+    """
+    if isinstance(flags, int):
+        return flags
+    if isinstance(flags, str):
+        flags = flags.split('|')
+    value = 0
+    for name in flags:
+        flag = getattr(re.RegexFlag, name.strip().upper(), None)
+        if flag is None:
+            raise ValueError(f"unknown regex flag '{name}'")
+        value |= flag
+    return value
+
+class PatternEntry(Mapping):
+    """
+    One pattern in the registry.  It behaves like the {'pat': ..., 'desc': ..., 'literals': ...} dicts
+    the library used to hold, but 'pat' is only compiled the first time it is looked up.
+
+    spec is a dict with a 'desc' and either:
+      - 'regex' (and optionally 'flags'), for a regex pattern
+      - 'begin', 'open_marker' and 'close_marker', for a BlockPattern
+      - 'pat', an already compiled re.Pattern or BlockPattern
+    plus optionally 'literals', the strings every match must contain (see required_literals()), and
+    'max_span_kb', the longest a match can be in KiB of text, which windowed scans hold back instead of
+    --max-span-kb (see util/windowed_scan.py).
+    """
+    def __init__(self, name:str, spec:dict, origin:str):
+        self.name = name
+        self.origin = origin
+        self.desc = spec.get('desc', '')
+        self.literals = spec.get('literals')
+        self.max_span_kb = spec.get('max_span_kb')
+        if self.max_span_kb is not None and (not isinstance(self.max_span_kb, int) or self.max_span_kb < 1):
+            raise ValueError(f"pattern '{name}' from {origin}: max_span_kb must be a whole number of KiB, at least 1")
+        self._pat = spec.get('pat')
+        self._regex = spec.get('regex')
+        self._flags = parse_flags(spec.get('flags', 0))
+        self._block = None
+        if 'begin' in spec:
+            self._block = (spec['begin'], spec.get('open_marker', spec['begin']), spec['close_marker'])
+        if self._pat is None and self._regex is None and self._block is None:
+            raise ValueError(f"pattern '{name}' from {origin} needs a 'regex', or 'begin' and 'close_marker'")
+
+    def is_compiled(self)->bool:
+        return self._pat is not None
+
+    @property
+    def pat(self)->re.Pattern|BlockPattern:
+        if self._pat is None:
+            if self._block is not None:
+                self._pat = compile_block_pattern(*self._block)
+            else:
+                self._pat = compile_pattern(self._regex, self._flags)
+        return self._pat
+
+    def _keys(self)->list[str]:
+        keys = ['pat', 'desc']
+        if self.literals is not None:
+            keys.append('literals')
+        if self.max_span_kb is not None:
+            keys.append('max_span_kb')
+        return keys
+
+    def __getitem__(self, key:str):
+        if key == 'pat':
+            return self.pat
+        elif key == 'desc':
+            return self.desc
+        elif key == 'literals' and self.literals is not None:
+            return self.literals
+        elif key == 'max_span_kb' and self.max_span_kb is not None:
+            return self.max_span_kb
+        raise KeyError(key)
+
+    def __iter__(self)->Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self)->int:
+        return len(self._keys())
+
+    def __repr__(self)->str:
+        return f"PatternEntry({self.name!r}, origin={self.origin!r})"
+
+def read_config_file(path:str)->dict:
+    """
+    Reads a TOML (.toml) or JSON file into a dict.
+    """
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError(f"cannot read {path}: TOML files need Python 3.11+ or the tomli package")
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        import json
+        with open(path, 'r') as f:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a table/object at the top level")
+    return data
+
+def read_pattern_file(path:str)->dict[str, dict]:
+    """
+    Reads the pattern specs from a TOML (.toml) or JSON file, which must have a top-level "patterns"
+    table mapping each pattern name to its spec, e.g.
+
+        [patterns.my_pattern]
+        desc = "for ..."
+        regex = '^# begin.*\\n(.*\\n)*?^# end.*$'
+        flags = ["MULTILINE"]
+        literals = ["# begin", "# end"]
+        max_span_kb = 64
+    """
+    specs = read_config_file(path).get('patterns')
+    if not isinstance(specs, dict):
+        raise ValueError(f"{path} has no 'patterns' table")
+    return specs
+
+class PatternRegistry(Mapping):
+    """
+    The pattern library: a read-only mapping of pattern name to PatternEntry.
+
+    The built-in patterns are registered up front, but nothing is compiled until a pattern's 'pat' is
+    looked up, so listing the patterns (e.g. for --help) costs no compiles.  The first time the registry
+    is used, it also loads the files named in $FILE_TRANSFORM_TOOLS_PATTERN_FILES and the patterns from
+    installed plugins (entry point group 'file_transform_tools.patterns').  More files can be loaded
+    with load_file().  Pattern names must be unique across all sources (a clash with a built-in name is
+    only detected when external patterns get loaded, i.e. when the registry is listed or a name that
+    isn't built in is looked up).
+    """
+    def __init__(self, builtin_specs:dict[str, dict]):
+        self._entries:dict[str, PatternEntry] = {}
+        self._loaded_files:set[str] = set()
+        self._external_loaded = False
+        for name, spec in builtin_specs.items():
+            self.register(name, spec, origin="built-in")
+
+    def register(self, name:str, spec:dict, origin:str):
+        if name in self._entries:
+            raise ValueError(f"pattern '{name}' from {origin} is already defined by {self._entries[name].origin}")
+        self._entries[name] = PatternEntry(name, spec, origin)
+
+    def load_file(self, path:str):
+        """
+        Registers every pattern in a TOML or JSON pattern file; loading the same file again does nothing.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        if path in self._loaded_files:
+            return
+        for name, spec in read_pattern_file(path).items():
+            self.register(name, spec, origin=path)
+        self._loaded_files.add(path)
+
+    def _load_external(self):
+        if self._external_loaded:
+            return
+        self._external_loaded = True
+        for path in os.environ.get(PATTERN_FILES_ENV_VAR, '').split(os.pathsep):
+            if path:
+                self.load_file(path)
+        self._load_plugins()
+
+    def _load_plugins(self):
+        from importlib.metadata import entry_points
+        try:
+            plugins = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # Python < 3.10
+            plugins = entry_points().get(ENTRY_POINT_GROUP, [])
+        for plugin in plugins:
+            # a broken plugin shouldn't stop the built-in patterns from working
+            try:
+                specs = plugin.load()
+                if callable(specs):
+                    specs = specs()
+                for name, spec in specs.items():
+                    self.register(name, spec, origin=f"plugin {plugin.name}")
+            except Exception as e:
+                print(f"warning: could not load patterns from plugin '{plugin.name}': {e}", file=sys.stderr)
+
+    def __getitem__(self, name:str)->PatternEntry:
+        # looking up a built-in (or already loaded) pattern doesn't load the pattern files and plugins,
+        # since finding plugins means importing importlib.metadata and scanning every installed package
+        if name not in self._entries:
+            self._load_external()
+        return self._entries[name]
+
+    def __iter__(self)->Iterator[str]:
+        self._load_external()
+        return iter(self._entries)
+
+    def __len__(self)->int:
+        self._load_external()
+        return len(self._entries)
@@ -0,0 +1,247 @@
+from __future__ import annotations
+import argparse
+import os
+from typing import NamedTuple
+from file_transform_tools.util.cli import ActionIfBlockNotFound, BlockRule
+from file_transform_tools.re_pattern_library import patterns, required_literals
+from file_transform_tools.util.find_block import find_lines_in_file_buffer, store_matches
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.backup import BACKUP_COPY, BACKUP_STORE
+from file_transform_tools.util.output_writer import FSYNC_BATCH, FSYNC_NONE, sync_batch
+from file_transform_tools.util.replace_or_insert import RuleMatch, RuleConflictError, UnpatchableFileError, replace_or_insert_blocks, replacement_text_to_lines, do_dry_run_with_diff, make_patch
+
+class FileResult(NamedTuple):
+    """
+    The outcome of processing one file: how many errors it had, the (filename, backup_filename) pairs
+    of any backups that were made, in the order they were made, and whether the transform changed it.
+    With --emit-patch, patch is its part of the patch ('' if it is unchanged).
+    """
+    filename:str
+    error_count:int
+    backups:list[tuple[str,str]]
+    changed:bool = False
+    patch:str|None = None
+
+def get_rules(args:argparse.Namespace, replacement_text:str)->list[BlockRule]:
+    """
+    Returns the -pat/-r rules to apply.  With a single rule (or none, for a plain -A/-P insertion) that is
+    args.pattern_name with replacement_text; with several, args.rules, whose stdin ('-') replacement the
+    caller has already read in.
+    """
+    rules = getattr(args, 'rules', None)
+    if rules is not None and len(rules) > 1:
+        return rules
+    return [BlockRule(args.pattern_name, replacement_text)]
+
+def default_affix(args:argparse.Namespace)->str:
+    """
+    What a rule without its own action adds to its replacement when its block isn't found: -A's prefix or
+    -P's suffix.
+    """
+    if args.action == ActionIfBlockNotFound.REPLACE_OR_APPEND:
+        return args.append
+    elif args.action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
+        return args.prepend
+    return ""
+
+def _is_cached_noop(rules:list[BlockRule], cached_matches_by_pattern:dict, args:argparse.Namespace)->bool:
+    """
+    True if the match cache shows that every rule's blocks already are its replacement text, so the file
+    would come out unchanged.  Anything that can't be told from the cache (a miss, a rule with nothing to
+    replace, blank-line control, an outfile that has to be written) counts as a change.
+    """
+    from file_transform_tools.util.match_cache import block_digest
+    if args.outfile or args.blank_line_control is not None:
+        return False
+    for pattern_name, replacement_text, _, _, blank_line_control in rules:
+        cached_matches = cached_matches_by_pattern.get(pattern_name)
+        if not pattern_name or blank_line_control is not None or not cached_matches:
+            return False
+        replacement_digest = block_digest(''.join(replacement_text_to_lines(replacement_text, '\n')))
+        if any(cached_match.digest != replacement_digest for cached_match in cached_matches):
+            return False
+    return True
+
+def process_file(filename:str, args:argparse.Namespace, replacement_text:str, rules:list[BlockRule]=None)->FileResult:
+    """
+    Finds, replaces and writes (or dry-runs) a single file according to the parsed command line args.
+    This is the body of the replace-block loop over files, and what each --jobs worker runs.
+
+    rules defaults to get_rules(args, replacement_text); --manifest runs pass each file's own rules.
+    All the rules are matched against the same buffer and applied together, so the file is read once,
+    written once and backed up once however many rules there are.
+
+    With args.cache_file, matches are looked up in and saved to the match cache, and a file the cache
+    shows to be a no-op isn't read at all.
+    """
+    error_count = 0
+    changed = False
+    patch = None
+
+    # backups are collected per file so the caller can report them in a stable order
+    if args.backup:
+        from file_transform_tools.util.backup import CreateBackupInstructions
+        create_backup_instructions = CreateBackupInstructions()
+    else:
+        create_backup_instructions = None
+    backup_store = None
+    if args.backup and getattr(args, 'backup_strategy', None) == BACKUP_STORE:
+        from file_transform_tools.util.backup_store import open_backup_store
+        backup_store = open_backup_store(args.backup_store, compression=args.backup_compression)
+
+    if rules is None:
+        rules = get_rules(args, replacement_text)
+
+    if getattr(args, 'windowed', False):
+        return _process_file_windowed(filename, args, rules, create_backup_instructions)
+
+    # look the file up in the match cache before reading it
+    match_cache = None
+    cached_matches_by_pattern = {}
+    cache_file = getattr(args, 'cache_file', None)
+    if cache_file:
+        from file_transform_tools.util.match_cache import file_key, open_match_cache, pattern_fingerprint
+        match_cache = open_match_cache(cache_file, args.cache_max_entries)
+        fingerprints = {pattern_name: pattern_fingerprint(patterns[pattern_name]['pat'], args.mmap) for pattern_name, *_ in rules if pattern_name}
+        try:
+            st = os.stat(filename)
+        except OSError:
+            # reported when the file is loaded below
+            st = None
+        if st is not None:
+            cached_matches_by_pattern = {pattern_name: match_cache.lookup(st, fingerprint) for pattern_name, fingerprint in fingerprints.items()}
+            if _is_cached_noop(rules, cached_matches_by_pattern, args):
+                print(f"{filename}: unchanged")
+                return FileResult(filename, 0, [], False)
+
+    # load the file once; matching, splicing and writing all work from this buffer
+    with FileBuffer.load(filename, use_mmap=args.mmap) as file_buffer:
+        # cached matches are only good for the very file that was loaded
+        if match_cache is not None and (st is None or file_key(st) != file_key(file_buffer.stat)):
+            cached_matches_by_pattern = {}
+        rule_matches = []
+        for pattern_name, rule_replacement_text, rule_action, affix, blank_line_control in rules:
+            # a rule's own action comes with its own affix
+            if rule_action is None:
+                rule_action = args.action
+                affix = default_affix(args)
+            affix = affix or ""
+            # find lines matching the pattern
+            if pattern_name:
+                cached_matches = cached_matches_by_pattern.get(pattern_name)
+                if cached_matches is not None:
+                    line_ranges = [cached_match.line_range for cached_match in cached_matches]
+                else:
+                    pattern_entry = patterns[pattern_name]
+                    line_ranges = find_lines_in_file_buffer(file_buffer, pattern=pattern_entry['pat'], verbose=args.verbose, required_literals=required_literals(pattern_entry))
+                    if match_cache is not None:
+                        store_matches(match_cache, file_buffer, fingerprints[pattern_name], line_ranges)
+                if len(line_ranges) == 0:
+                    # we were asked to replace only, but there's nothing to replace
+                    if rule_action == ActionIfBlockNotFound.REPLACE_ONLY:
+                        which_block = f"block for pattern '{pattern_name}'" if len(rules) > 1 else "block"
+                        print(f"error: {which_block} not found but nothing to do without --append/-A or --prepend/-P")
+                        error_count += 1
+                    # we were asked to replace or append, there's nothing to replace, so we are appending.  modify the
+                    # replacement str with -A's argument if any
+                    elif rule_action == ActionIfBlockNotFound.REPLACE_OR_APPEND:
+                        rule_replacement_text = affix + rule_replacement_text
+                    # ditto for prepend
+                    elif rule_action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
+                        rule_replacement_text = rule_replacement_text + affix
+            else:
+                line_ranges = []
+            rule_matches.append(RuleMatch(pattern_name, line_ranges, rule_replacement_text, action=rule_action, blank_line_control=blank_line_control))
+
+        # blank line control from -w option
+        blank_line_control = args.blank_line_control
+        if blank_line_control is not None:
+            desired_preceding_newlines = blank_line_control[0]
+            desired_trailing_newlines = blank_line_control[1]
+        else:
+            desired_preceding_newlines = None
+            desired_trailing_newlines = None
+
+        # do the replacement(s)
+        try:
+            if getattr(args, 'emit_patch', None):
+                patch = make_patch(filename, rule_matches, action=args.action, verbose=args.verbose, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer)
+                changed = patch != ""
+                if not changed and error_count == 0:
+                    print(f"{filename}: unchanged")
+            elif args.dry_run:
+                ret = do_dry_run_with_diff(filename, line_ranges=None, action=args.action, verbose=args.verbose, keep_temp_file=args.preserve_temp_file_dry_run, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer, rule_matches=rule_matches, color=getattr(args, 'color_diff', False))
+                error_count += ret
+            else:
+                changed = replace_or_insert_blocks(filename, rule_matches, action=args.action, outfile=args.outfile, verbose=args.verbose, create_backup=args.backup, create_backup_instructions=create_backup_instructions, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer, fsync=getattr(args, 'fsync', FSYNC_NONE), backup_strategy=getattr(args, 'backup_strategy', BACKUP_COPY), backup_store=backup_store)
+                # a no-op leaves the file (and its mtime) alone and makes no backup
+                if not changed and error_count == 0:
+                    print(f"{filename}: unchanged")
+        except (RuleConflictError, UnpatchableFileError) as e:
+            print(f"error: {filename}: {e}")
+            error_count += 1
+        except Exception as e:
+            import traceback
+            print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            error_count += 1
+
+    if create_backup_instructions is not None:
+        backups = list(create_backup_instructions.backup_files_map.items())
+    else:
+        backups = []
+    return FileResult(filename, error_count, backups, changed, patch)
+
+def _process_file_windowed(filename:str, args:argparse.Namespace, rules:list[BlockRule], create_backup_instructions)->FileResult:
+    """
+    process_file() for --windowed: the file is matched and written in one windowed pass (see
+    replace_or_insert_windowed()), so a missing block is only reported once the whole file has been read.
+    """
+    from file_transform_tools.util.stream_filter import replace_or_insert_windowed
+    error_count = 0
+    changed = False
+    try:
+        result = replace_or_insert_windowed(filename, rules, args.action, affix=default_affix(args), blank_line_control=args.blank_line_control, max_span=args.max_span_kb*1024, outfile=args.outfile, verbose=args.verbose, create_backup=args.backup, create_backup_instructions=create_backup_instructions, fsync=getattr(args, 'fsync', FSYNC_NONE), backup_strategy=getattr(args, 'backup_strategy', BACKUP_COPY))
+        for rule in rules:
+            rule_action = rule.action if rule.action is not None else args.action
+            if rule_action == ActionIfBlockNotFound.REPLACE_ONLY and rule.pattern_name in result.unmatched:
+                which_block = f"block for pattern '{rule.pattern_name}'" if len(rules) > 1 else "block"
+                print(f"error: {which_block} not found but nothing to do without --append/-A or --prepend/-P")
+                error_count += 1
+        changed = result.changed
+        if not changed and error_count == 0:
+            print(f"{filename}: unchanged")
+    except RuleConflictError as e:
+        print(f"error: {filename}: {e}")
+        error_count += 1
+    except Exception as e:
+        import traceback
+        print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        error_count += 1
+
+    if create_backup_instructions is not None:
+        backups = list(create_backup_instructions.backup_files_map.items())
+    else:
+        backups = []
+    return FileResult(filename, error_count, backups, changed)
+
+def finish_run(args:argparse.Namespace, changed_filenames:list[str]=None):
+    """
+    The work done once at the end of a run, after every file has been processed: closing the match
+    cache, applying the backup store's retention limits and the --fsync batch sync of changed_filenames
+    (the files whose FileResult says they changed).
+    """
+    if getattr(args, 'cache_file', None):
+        from file_transform_tools.util.match_cache import close_match_caches
+        close_match_caches()
+
+    # apply the backup store's retention limits once the run's backups are in
+    if args.backup and getattr(args, 'backup_strategy', None) == BACKUP_STORE:
+        from file_transform_tools.util.backup_store import close_backup_stores, open_backup_store
+        if args.backup_max_mb is not None or args.backup_max_age_days is not None:
+            backup_store = open_backup_store(args.backup_store, compression=args.backup_compression)
+            backup_store.evict(max_bytes=args.backup_max_mb*1024*1024 if args.backup_max_mb is not None else None, max_age_ns=int(args.backup_max_age_days*86400e9) if args.backup_max_age_days is not None else None)
+        close_backup_stores()
+
+    # the files are fsynced together at the end instead of one at a time
+    if getattr(args, 'fsync', FSYNC_NONE) == FSYNC_BATCH and not args.dry_run and not args.outfile and not getattr(args, 'emit_patch', None):
+        sync_batch(changed_filenames or [])
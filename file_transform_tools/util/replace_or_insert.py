@@ -1,138 +1,295 @@
+from __future__ import annotations
 import os
-import subprocess
 import sys
-import tempfile
-from typing import Optional
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional
 from file_transform_tools.util.find_block import FileLineRange
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.splice import LineEdit, splice_lines, inserted_line_ranges, iter_splice_chunks, edits_leave_buffer_unchanged
+from file_transform_tools.util.backup import BACKUP_COPY
+from file_transform_tools.util.output_writer import FSYNC_NONE, write_chunks, overwrite_with_chunks
 from file_transform_tools.util.cli import ActionIfBlockNotFound
-from file_transform_tools.util.which import which_delta
-from file_transform_tools.util.backup import backup_file, CreateBackupInstructions
-from file_transform_tools.util.correct_newlines.correct_newlines import correct_newlines
+from file_transform_tools.util.correct_newlines.correct_newlines import BlankLineControl, correct_newlines_per_range
 
-def replace_or_insert_block(filename, line_ranges:list[FileLineRange], action:ActionIfBlockNotFound, replacement_text:str="", outfile=None, verbose=False, create_backup=False, create_backup_instructions:CreateBackupInstructions=None, line_ranges_inserted_or_replaced:Optional[list[FileLineRange]]=None, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None):
-    
-    #
-    # Function body: replace_next_occurrence
-    #
-
-    def replace_next_occurrence(file_lines:list[str], replacement_lines:list[str], line_range:FileLineRange, line_ranges_inserted_or_replaced:list[FileLineRange])->list[str]:
-        new_file_lines = file_lines[0:line_range.start_line] + replacement_lines + file_lines[line_range.end_line+1:]
-        if line_ranges_inserted_or_replaced is not None:
-            num_lines_being_replaced = len(line_range)
-            num_lines_inserted_or_replaced = len(replacement_lines)
-            increase_in_file_length = num_lines_inserted_or_replaced - num_lines_being_replaced # negative means decrease
-            # we keep track of which line ranges in the final file were inserted/replaced by us for the final newline modification
-            line_ranges_inserted_or_replaced.append(FileLineRange(line_range.start_line, line_range.end_line+increase_in_file_length))
-        return new_file_lines
-    
-    #
-    # Function body: replace_or_insert_block
-    #
+# backup and dry run support is imported where it is used, so a plain run doesn't pay for loading it
+if TYPE_CHECKING:
+    from file_transform_tools.util.backup import CreateBackupInstructions
+    from file_transform_tools.util.backup_store import BackupStore
 
-    # for debugging purposes, we will use an empty array passed in for line_ranges_inserted_or_replaced.
-    # but if the param is omitted, we just init an empty list here
+class RuleMatch(NamedTuple):
+    """
+    The matches of one rule in a file: the line ranges its pattern matched (empty if none) and the text
+    to replace each of them with.  rule_name is only used in messages and may be None.
+
+    action and blank_line_control (a (preceding, trailing) pair, as for -w) override the ones passed to
+    replace_or_insert_blocks() for this rule only.
+    """
+    rule_name:str|None
+    line_ranges:list[FileLineRange]
+    replacement_text:str
+    action:ActionIfBlockNotFound|None = None
+    blank_line_control:tuple[int|None, int|None]|None = None
+
+class RuleConflictError(ValueError):
+    """
+    Raised when the blocks matched by two rules overlap, so they can't both be replaced.
+    """
+    pass
+
+class UnpatchableFileError(ValueError):
+    """
+    Raised by make_patch() for a file a patch can't be made for: one whose lines don't end in \\n (they
+    are translated to \\n when it is read) or one outside the current directory.
+    """
+    pass
+
+def replacement_text_to_lines(replacement_text:str|bytes|None, newline:str|bytes)->list:
+    """
+    Splits replacement text into lines that each end in newline; None, '' and '-' give no lines.
+    """
+    if not replacement_text or replacement_text == '-':
+        return []
+    replacement_lines = replacement_text.split(newline)
+    replacement_lines = [line + newline for line in replacement_lines]
+
+    # if replacement lines contains a single extra line at the end, remove it
+    if len(replacement_lines) > 0 and replacement_lines[-1] == newline:
+        replacement_lines = replacement_lines[:-1]
+    return replacement_lines
+
+def replace_or_insert_block(filename, line_ranges:list[FileLineRange], action:ActionIfBlockNotFound, replacement_text:str="", outfile=None, verbose=False, create_backup=False, create_backup_instructions:'CreateBackupInstructions'=None, line_ranges_inserted_or_replaced:Optional[list[FileLineRange]]=None, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None, file_buffer:FileBuffer=None, fsync:str=FSYNC_NONE, backup_strategy:str=BACKUP_COPY, backup_store:'BackupStore'=None)->bool:
+    """
+    Replaces each of line_ranges in filename with replacement_text (or appends/prepends it according to
+    action if line_ranges is empty) and writes the result to outfile, or back to filename.
+
+    Pass the file_buffer that line_ranges were found in to avoid reading the file a second time; if it
+    is omitted, the file is loaded here.
+
+    filename is overwritten atomically (see overwrite_with_chunks()), fsynced according to fsync.  If the
+    result is the same as the input, filename is left alone (not even backed up) and False is returned.
+    With create_backup, the backup is made with backup_strategy (see backup_file()), or saved as a snapshot
+    in backup_store if one is given.
+    """
+    return replace_or_insert_blocks(filename, [RuleMatch(None, line_ranges, replacement_text)], action=action, outfile=outfile, verbose=verbose, create_backup=create_backup, create_backup_instructions=create_backup_instructions, line_ranges_inserted_or_replaced=line_ranges_inserted_or_replaced, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer, fsync=fsync, backup_strategy=backup_strategy, backup_store=backup_store)
+
+class PlannedOutput(NamedTuple):
+    """
+    What replace_or_insert_blocks() would write: the edits to the buffer's lines, the output as a stream
+    of chunks, and whether it is the same as the input.  old_lines and new_lines are the input and output
+    split into lines when blank-line control had to work on the lines (it can change lines outside the
+    edits), else None.
+    """
+    edits:list[LineEdit]
+    output_chunks:Iterable[str|bytes]
+    unchanged:bool
+    old_lines:list|None = None
+    new_lines:list|None = None
+
+def plan_output(file_buffer:FileBuffer, rule_matches:list[RuleMatch], action:ActionIfBlockNotFound, verbose=False, line_ranges_inserted_or_replaced:Optional[list[FileLineRange]]=None, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None)->PlannedOutput|None:
+    """
+    Works out the edits for rule_matches and the output they give, without writing anything; returns None
+    if there is nothing to do.  See replace_or_insert_blocks() for the arguments.
+
+    Raises RuleConflictError if blocks matched by different rules overlap.
+    """
     if line_ranges_inserted_or_replaced is None:
         line_ranges_inserted_or_replaced = []
-    
-    # get input file into an array of lines
-    with open(filename, 'r') as f:
-        file_lines = f.readlines()
-    
-    # get replacement text into an array of lines
-    if replacement_text and replacement_text != '-':
-        replacement_lines = replacement_text.split('\n')
-        replacement_lines = [line + '\n' for line in replacement_lines]
-
-        # if replacement lines contains a single extra line at the end, remove it
-        if len(replacement_lines) > 0 and replacement_lines[-1] == '\n':
-            replacement_lines = replacement_lines[:-1]
-    else:
-        replacement_lines = []
-    if verbose:
-        print(f"replacement_lines = {replacement_lines}")
-
-    # catch the case where there's nothing to replace and we were told to replace only
-    if len(line_ranges) == 0:
-        if action == ActionIfBlockNotFound.REPLACE_ONLY:
-            if verbose:
-                print(f"block not found => doing nothing")
-            return
-        elif action == ActionIfBlockNotFound.REPLACE_OR_APPEND:
-            # append the replacement text to the end of the file
-            new_file_lines = file_lines + replacement_lines
-            # keep track of lines in final file that were inserted or replaced by us
-            line_ranges_inserted_or_replaced = [FileLineRange(len(file_lines)+1, len(file_lines) + len(replacement_lines))]
-        elif action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
-            # prepend the replacement text to the beginning of the file
-            new_file_lines = replacement_lines + file_lines
-            # same idea as above
-            line_ranges_inserted_or_replaced = [FileLineRange(1, len(replacement_lines)-1)]
-    else:
-        # if we have any line ranges, they should be non empty
-        for line_range in line_ranges:
-            assert not line_range.is_empty(), "if there are elements in line_ranges, they should never be empty"
-
-        # because we have one or more non-empty line ranges, we treat any REPLACE_* action as equivalent to REPLACE_ONLY
-        # if we were going to append or prepend, we would have done it in the if part of this if...else
-        if action == ActionIfBlockNotFound.REPLACE_ONLY or action == ActionIfBlockNotFound.REPLACE_OR_APPEND or action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
-            # loop over matches and replace each one
-            new_file_lines = file_lines
-            original_num_file_lines = len(file_lines)
-            for line_range_index, line_range in enumerate(line_ranges):
-                new_file_lines = replace_next_occurrence(new_file_lines, replacement_lines, line_range, line_ranges_inserted_or_replaced)
-
-                # if we've shortened (or lengthened) the file, we need to adjust all the line ranges after this one
-                new_num_file_lines = len(new_file_lines)
-                if new_num_file_lines != original_num_file_lines:
-                    new_line_ranges = line_ranges
-                    for idx, line_range in enumerate(line_ranges[line_range_index+1:]):
-                        new_line_ranges[line_range_index+1+idx] = FileLineRange(line_range.start_line + new_num_file_lines - original_num_file_lines, line_range.end_line + new_num_file_lines - original_num_file_lines)
-                    line_ranges = new_line_ranges
-                    original_num_file_lines = new_num_file_lines
+    num_file_lines = len(file_buffer.line_index)
+
+    # a memory-mapped buffer holds raw bytes, so the replacement and output have to be bytes too
+    newline = b'\n' if file_buffer.is_bytes() else '\n'
+
+    # each edit is tagged with the rule it came from, whether it's an append or prepend, and the blank-line
+    # control that applies to it (None for none)
+    APPEND, PREPEND, REPLACE = range(3)
+    tagged_edits:list[tuple[LineEdit, int, str|None, tuple|None]] = []
+    for rule_name, line_ranges, replacement_text, rule_action, blank_line_control in rule_matches:
+        rule_action = rule_action or action
+        if blank_line_control is None and ((desired_preceding_newlines is not None) or (desired_trailing_newlines is not None)):
+            blank_line_control = (desired_preceding_newlines, desired_trailing_newlines)
+
+        if file_buffer.is_bytes() and isinstance(replacement_text, str) and replacement_text and replacement_text != '-':
+            replacement_text = replacement_text.encode('utf-8')
+
+        # get replacement text into an array of lines
+        replacement_lines = replacement_text_to_lines(replacement_text, newline)
+        if verbose:
+            print(f"replacement_lines = {replacement_lines}")
+
+        # catch the case where there's nothing to replace and we were told to replace only
+        if len(line_ranges) == 0:
+            if rule_action == ActionIfBlockNotFound.REPLACE_ONLY:
+                if verbose:
+                    print(f"block not found => doing nothing")
+            elif rule_action == ActionIfBlockNotFound.REPLACE_OR_APPEND:
+                # append the replacement text to the end of the file
+                tagged_edits.append((LineEdit(num_file_lines, num_file_lines, replacement_lines), APPEND, rule_name, blank_line_control))
+            elif rule_action == ActionIfBlockNotFound.REPLACE_OR_PREPEND:
+                # prepend the replacement text to the beginning of the file
+                tagged_edits.append((LineEdit(0, 0, replacement_lines), PREPEND, rule_name, blank_line_control))
+        else:
+            # if we have any line ranges, they should be non empty
+            for line_range in line_ranges:
+                assert not line_range.is_empty(), "if there are elements in line_ranges, they should never be empty"
+
+            # because we have one or more non-empty line ranges, we treat any REPLACE_* action as equivalent to REPLACE_ONLY
+            # if we were going to append or prepend, we would have done it in the if part of this if...else
+            tagged_edits.extend((LineEdit.from_line_range(line_range, replacement_lines), REPLACE, rule_name, blank_line_control) for line_range in line_ranges)
+
+    if len(tagged_edits) == 0:
+        return None
+
+    # all matches are replaced in one left-to-right pass; the caller's line_ranges are left untouched.  the
+    # sort is stable, so appends/prepends at the same line stay in rule order (and go before a block that
+    # starts on that line)
+    tagged_edits.sort(key=lambda tagged_edit: (tagged_edit[0].start_line, tagged_edit[0].end_line))
+    for (prev_edit, _, prev_rule_name, _), (edit, _, rule_name, _) in zip(tagged_edits, tagged_edits[1:]):
+        if edit.start_line < prev_edit.end_line:
+            raise RuleConflictError(f"conflicting rules: the block matched by pattern '{rule_name}' at lines {edit.start_line+1}-{edit.end_line} overlaps the block matched by pattern '{prev_rule_name}' at lines {prev_edit.start_line+1}-{prev_edit.end_line}")
+    edits = [edit for edit, _, _, _ in tagged_edits]
+
+    # we keep track of which line ranges in the final file were inserted/replaced by us for the final newline
+    # modification.  appended and prepended blocks are tracked one line further down than where they really are,
+    # which is what the blank-line control expects for them
+    blank_line_controls = []
+    for (_, kind, _, blank_line_control), line_range in zip(tagged_edits, inserted_line_ranges(edits)):
+        if kind == APPEND:
+            line_range = FileLineRange(line_range.start_line+1, line_range.end_line+1)
+        elif kind == PREPEND:
+            line_range = FileLineRange(line_range.start_line+1, line_range.end_line)
+        line_ranges_inserted_or_replaced.append(line_range)
+        if blank_line_control is not None:
+            blank_line_controls.append(BlankLineControl(line_range, *blank_line_control))
 
     if verbose:
-        print(f"new_file_lines = {new_file_lines}")
+        print(f"edits = {[(edit.start_line, edit.end_line) for edit in edits]}")
         print(f"line_ranges_inserted_or_replaced = {line_ranges_inserted_or_replaced}")
 
-    # do final newline correction
-    if (desired_preceding_newlines is not None) or (desired_trailing_newlines is not None):
-        assert line_ranges_inserted_or_replaced is not None, "code mistake:you must pass an empty list for line_ranges_inserted_or_replaced if you want to use desired_preceding_newlines or desired_trailing_newlines"
-        new_file_lines = correct_newlines(new_file_lines, line_ranges_inserted_or_replaced, desired_preceding_newlines, desired_trailing_newlines)
+    if len(blank_line_controls) > 0:
+        # final newline correction works on the spliced list of lines, only around the blocks of rules with blank-line control
+        file_lines = file_buffer.lines()
+        new_file_lines, _ = splice_lines(file_lines, edits)
+        output_chunks = correct_newlines_per_range(new_file_lines, blank_line_controls)
+        empty = newline[:0]
+        return PlannedOutput(edits, output_chunks, empty.join(output_chunks) == empty.join(file_lines), old_lines=file_lines, new_lines=output_chunks)
+
+    # untouched regions are streamed straight from the input buffer with the replacements in between;
+    # the output is the same as the input exactly when every edit puts back the lines it replaces
+    output_chunks = iter_splice_chunks(file_buffer.text, file_buffer.line_index, edits)
+    return PlannedOutput(edits, output_chunks, edits_leave_buffer_unchanged(file_buffer.text, file_buffer.line_index, edits))
+
+def replace_or_insert_blocks(filename, rule_matches:list[RuleMatch], action:ActionIfBlockNotFound, outfile=None, verbose=False, create_backup=False, create_backup_instructions:'CreateBackupInstructions'=None, line_ranges_inserted_or_replaced:Optional[list[FileLineRange]]=None, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None, file_buffer:FileBuffer=None, fsync:str=FSYNC_NONE, backup_strategy:str=BACKUP_COPY, backup_store:'BackupStore'=None)->bool:
+    """
+    Same as replace_or_insert_block(), but for several rules at once: every rule's matches are replaced
+    (and, according to action, the replacement of every rule that matched nothing is appended or
+    prepended, in rule order) in a single pass over the buffer, and the file is written once.
+
+    Returns whether the output differs from the input.  When it doesn't, an in-place overwrite (and its
+    backup) is skipped, so the file's mtime is left alone; an outfile is written as usual.
+
+    Raises RuleConflictError, before anything is written, if blocks matched by different rules overlap.
+    """
+
+    # for debugging purposes, we will use an empty array passed in for line_ranges_inserted_or_replaced.
+    # but if the param is omitted, we just init an empty list here
+    if line_ranges_inserted_or_replaced is None:
+        line_ranges_inserted_or_replaced = []
+    
+    # get input file, reusing the caller's buffer if we have one
+    if file_buffer is None:
+        with FileBuffer.load(filename) as file_buffer:
+            return replace_or_insert_blocks(filename, rule_matches, action=action, outfile=outfile, verbose=verbose, create_backup=create_backup, create_backup_instructions=create_backup_instructions, line_ranges_inserted_or_replaced=line_ranges_inserted_or_replaced, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer, fsync=fsync, backup_strategy=backup_strategy, backup_store=backup_store)
+
+    planned = plan_output(file_buffer, rule_matches, action=action, verbose=verbose, line_ranges_inserted_or_replaced=line_ranges_inserted_or_replaced, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
+    if planned is None:
+        return False
+    output_chunks, unchanged = planned.output_chunks, planned.unchanged
 
     # write the new file contents to the output file,  creating a backup of the input file if requested
     if outfile:
         if verbose:
             print(f"The output contents will be placed in '{outfile}'")
-        with open(outfile, 'w') as f:
-            f.writelines(new_file_lines)
+        write_chunks(outfile, output_chunks, binary=file_buffer.is_bytes())
+    elif unchanged:
+        if verbose:
+            print(f"output is the same as '{filename}' => not overwriting it")
     else:
         # overwrite original file
         if create_backup:
-            backup_path = backup_file(filename)
-        with open(filename, 'w') as f:
-            f.writelines(new_file_lines)
+            from file_transform_tools.util.backup import backup_file
+            if backup_store is not None:
+                backup_path = backup_store.save(filename).ref
+            else:
+                backup_path = backup_file(filename, strategy=backup_strategy)
+        # written to a temp file and renamed into place, so an mmap of the file stays readable until the last chunk is written
+        overwrite_with_chunks(filename, output_chunks, binary=file_buffer.is_bytes(), fsync=fsync)
         if create_backup and create_backup_instructions is not None:
             create_backup_instructions.append(filename, backup_path)
+    return not unchanged
 
-def do_dry_run_with_diff(filename, line_ranges:list[FileLineRange], action:ActionIfBlockNotFound, replacement_text:str="", verbose=False, keep_temp_file=False, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None)->int:
+def iter_planned_diff(file_buffer:FileBuffer, planned:PlannedOutput, fromfile:str, tofile:str, color:bool=False)->Iterable[str]:
+    """
+    The unified diff of the planned output against file_buffer: from the edits (see iter_edits_diff()), or
+    with difflib when blank-line control left only the new lines.
+    """
+    from file_transform_tools.util.diff_render import iter_edits_diff, iter_lines_diff
+    if planned.new_lines is not None:
+        return iter_lines_diff(planned.old_lines, planned.new_lines, fromfile=fromfile, tofile=tofile, color=color)
+    return iter_edits_diff(file_buffer.text, file_buffer.line_index, planned.edits, fromfile=fromfile, tofile=tofile, color=color)
+
+def make_patch(filename, rule_matches:list[RuleMatch], action:ActionIfBlockNotFound, verbose=False, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None, file_buffer:FileBuffer=None)->str:
+    """
+    Returns the changes the rules would make to filename as a patch (a unified diff with a/ and b/ paths,
+    see patch_path()), or '' if they make none.  Nothing is written.
+
+    Raises RuleConflictError if blocks matched by different rules overlap, and UnpatchableFileError if
+    filename's lines end in \\r\\n or \\r (the diff would be of the translated text, so it wouldn't apply)
+    or filename is outside the current directory (see patch_path()).
+    """
+    from file_transform_tools.util.diff_render import patch_path
+    if file_buffer is None:
+        with FileBuffer.load(filename) as file_buffer:
+            return make_patch(filename, rule_matches, action, verbose=verbose, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer)
+    planned = plan_output(file_buffer, rule_matches, action=action, verbose=verbose, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
+    if planned is None or planned.unchanged:
+        return ""
+    if file_buffer.newlines not in (None, '\n'):
+        # an in-place run would write the whole file back with \n line endings, which no patch of the
+        # changed lines can reproduce
+        raise UnpatchableFileError("--emit-patch doesn't support files with \\r\\n or \\r line endings")
     try:
-        temp_out_file = tempfile.NamedTemporaryFile(mode='w', delete=False)
-        replace_or_insert_block(filename, line_ranges, action=action, replacement_text=replacement_text, outfile=temp_out_file.name, verbose=verbose, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
-        temp_out_file.close()
+        fromfile, tofile = patch_path(filename, 'a/'), patch_path(filename, 'b/')
+    except ValueError as e:
+        raise UnpatchableFileError(str(e)) from None
+    return "".join(iter_planned_diff(file_buffer, planned, fromfile=fromfile, tofile=tofile))
 
-        # show the diff if they have delta installed
-        if not which_delta(print_message=True):
-            return 1
+def do_dry_run_with_diff(filename, line_ranges:list[FileLineRange], action:ActionIfBlockNotFound, replacement_text:str="", verbose=False, keep_temp_file=False, desired_preceding_newlines:int=None, desired_trailing_newlines:int=None, file_buffer:FileBuffer=None, rule_matches:list[RuleMatch]=None, color:bool=False)->int:
+    """
+    Prints the unified diff of the changes the rules would make to filename (colored with color),
+    rendered in-process from the edits (see iter_edits_diff()), or "unchanged".  Nothing is written,
+    except with keep_temp_file, which saves the output as '[basename].new' in the current directory.
+    """
+    from file_transform_tools.util.diff_render import write_diff
+    if rule_matches is None:
+        rule_matches = [RuleMatch(None, line_ranges, replacement_text)]
+    if file_buffer is None:
+        with FileBuffer.load(filename) as file_buffer:
+            return do_dry_run_with_diff(filename, line_ranges, action, replacement_text=replacement_text, verbose=verbose, keep_temp_file=keep_temp_file, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines, file_buffer=file_buffer, rule_matches=rule_matches, color=color)
+    try:
+        planned = plan_output(file_buffer, rule_matches, action=action, verbose=verbose, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
+        if planned is None or planned.unchanged:
+            print(f"{filename}: unchanged")
         else:
-            subprocess.run(['delta', filename, temp_out_file.name], stdout=sys.stdout, stderr=sys.stderr)
+            write_diff(iter_planned_diff(file_buffer, planned, fromfile=filename, tofile=filename, color=color), sys.stdout)
+
+        if keep_temp_file:
+            new_filename = f"{os.path.basename(filename)}.new"
+            output_chunks = planned.output_chunks if planned is not None else iter_splice_chunks(file_buffer.text, file_buffer.line_index, [])
+            write_chunks(new_filename, output_chunks, binary=file_buffer.is_bytes())
+            print(f"Keeping temp file {new_filename}")
+    except RuleConflictError as e:
+        print(f"error: {e}")
+        return 1
     except Exception as e:
         print(f"error (at line {sys.exc_info()[2].tb_lineno}): {e}")
         return 1
-    finally:
-        if not keep_temp_file:
-            os.unlink(temp_out_file.name)
-        else:
-            temp_file_new_name = f"{os.path.basename(filename)}.new"
-            os.rename(temp_out_file.name, temp_file_new_name)
-            print(f"Keeping temp file {temp_file_new_name}")
     return 0
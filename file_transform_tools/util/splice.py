@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import Generator, NamedTuple
+from file_transform_tools.util.file_line_range import FileLineRange
+from file_transform_tools.util.line_index import LineOffsetIndex
+
+# untouched regions are copied out of the input buffer at most this many characters at a time
+CHUNK_SIZE = 1 << 20
+
+class LineEdit(NamedTuple):
+    """
+    Replace the original lines [start_line, end_line) with replacement_lines.
+    Note that unlike FileLineRange, end_line is exclusive, so start_line == end_line is a pure insertion.
+    """
+    start_line:int
+    end_line:int
+    replacement_lines:list
+
+    @classmethod
+    def from_line_range(cls, line_range:FileLineRange, replacement_lines:list)->'LineEdit':
+        """
+        Makes an edit that replaces an inclusive FileLineRange.
+        """
+        return cls(line_range.start_line, line_range.end_line+1, replacement_lines)
+
+def check_edits(edits:list[LineEdit]):
+    """
+    Raises ValueError unless edits are sorted by start line and do not overlap.
+    """
+    prev_end_line = 0
+    for edit in edits:
+        if edit.end_line < edit.start_line:
+            raise ValueError(f"edit ends before it starts: lines {edit.start_line}-{edit.end_line}")
+        if edit.start_line < prev_end_line:
+            raise ValueError(f"edits must be sorted and non-overlapping: edit at line {edit.start_line} overlaps the previous edit ending at line {prev_end_line}")
+        prev_end_line = edit.end_line
+
+def inserted_line_ranges(edits:list[LineEdit])->list[FileLineRange]:
+    """
+    Returns for each edit the inclusive FileLineRange that its replacement lines occupy once all edits
+    have been applied.  For an edit with no replacement lines (a deletion) the range is (start, start-1).
+    """
+    line_ranges_inserted_or_replaced = []
+    shift = 0
+    for edit in edits:
+        new_start_line = edit.start_line + shift
+        line_ranges_inserted_or_replaced.append(FileLineRange(new_start_line, new_start_line+len(edit.replacement_lines)-1))
+        shift += len(edit.replacement_lines) - (edit.end_line - edit.start_line)
+    return line_ranges_inserted_or_replaced
+
+def splice_lines(file_lines:list, edits:list[LineEdit])->tuple[list, list[FileLineRange]]:
+    """
+    Applies all edits to file_lines in a single left-to-right pass.  Neither file_lines nor edits are modified.
+
+    Returns the new list of lines, and the inserted_line_ranges() of the edits.
+    """
+    check_edits(edits)
+
+    new_file_lines = []
+    pos = 0
+    for edit in edits:
+        new_file_lines.extend(file_lines[pos:edit.start_line])
+        new_file_lines.extend(edit.replacement_lines)
+        pos = edit.end_line
+    new_file_lines.extend(file_lines[pos:])
+
+    return new_file_lines, inserted_line_ranges(edits)
+
+def iter_buffer_chunks(buf:str|bytes, start:int, end:int, chunk_size:int=CHUNK_SIZE)->Generator[str|bytes, None, None]:
+    """
+    Yields buf[start:end] in pieces of at most chunk_size, so a large untouched region of an mmap is
+    never copied into memory all at once.
+    """
+    for pos in range(start, end, chunk_size):
+        yield buf[pos:min(pos+chunk_size, end)]
+
+def iter_splice_chunks(buf:str|bytes, line_index:LineOffsetIndex, edits:list[LineEdit], chunk_size:int=CHUNK_SIZE)->Generator[str|bytes, None, None]:
+    """
+    Applies all edits to the lines of buf in a single left-to-right pass, yielding the output as a stream
+    of chunks: untouched regions come straight from buf and each edit's replacement lines are yielded
+    in between.  No list of lines and no copy of the output is built.
+    """
+    check_edits(edits)
+
+    empty = '' if isinstance(buf, str) else b''
+    pos = 0
+    for edit in edits:
+        yield from iter_buffer_chunks(buf, pos, line_index.line_start(edit.start_line), chunk_size)
+        if len(edit.replacement_lines) > 0:
+            yield empty.join(edit.replacement_lines)
+        pos = line_index.line_start(edit.end_line)
+    yield from iter_buffer_chunks(buf, pos, len(buf), chunk_size)
+
+def edits_leave_buffer_unchanged(buf:str|bytes, line_index:LineOffsetIndex, edits:list[LineEdit])->bool:
+    """
+    True if applying edits to the lines of buf would give back buf exactly, i.e. every edit's replacement
+    lines are the same as the lines it replaces.  Only the edited regions are compared.
+    """
+    empty = '' if isinstance(buf, str) else b''
+    for edit in edits:
+        start_pos = line_index.line_start(edit.start_line)
+        end_pos = line_index.line_start(edit.end_line)
+        replacement = empty.join(edit.replacement_lines)
+        if len(replacement) != end_pos - start_pos or buf[start_pos:end_pos] != replacement:
+            return False
+    return True
@@ -0,0 +1,171 @@
+from __future__ import annotations
+import os
+from typing import TYPE_CHECKING, BinaryIO, Generator, Iterable, NamedTuple, TextIO
+from file_transform_tools.util.backup import BACKUP_COPY
+from file_transform_tools.util.cli import DEFAULT_MAX_SPAN_KB, ActionIfBlockNotFound, BlockRule
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.output_writer import FSYNC_NONE, overwrite_with_chunks
+from file_transform_tools.util.replace_or_insert import RuleMatch, plan_output
+from file_transform_tools.util.windowed_scan import STREAM_READ_SIZE, find_lines_windowed, iter_windows
+
+if TYPE_CHECKING:
+    from file_transform_tools.util.backup import CreateBackupInstructions
+
+class FilterResult(NamedTuple):
+    """
+    The outcome of a windowed transform: the pattern names of the rules that matched nothing (for the
+    caller to report when their action is REPLACE_ONLY), whether the output differs from the input, and
+    whether there was anything to do at all (a block to replace or a replacement to insert).
+    """
+    unmatched:list[str]
+    changed:bool
+    edited:bool = False
+
+def _rule_actions(rules:list[BlockRule], action:ActionIfBlockNotFound, affix:str)->list[tuple[ActionIfBlockNotFound, str]]:
+    # a rule's own action comes with its own affix, as in process_file()
+    return [(action, affix) if rule.action is None else (rule.action, rule.affix or "") for rule in rules]
+
+def iter_filtered_chunks(infile:BinaryIO, rules:list[BlockRule], action:ActionIfBlockNotFound, affix:str="", blank_line_control:tuple[int, int]|None=None, max_span:int=DEFAULT_MAX_SPAN_KB*1024, read_size:int=STREAM_READ_SIZE, prepend_unmatched:set[str]|None=None)->Generator[str, None, FilterResult]:
+    """
+    Transforms the text read from infile as it arrives, yielding the output of each window of
+    iter_windows() as soon as it has been scanned, and returns a FilterResult.  The output is the same
+    as a file run's, as long as no match is longer than its pattern's max span.
+
+    A rule that prepends when its block isn't found holds the whole input, since whether to prepend is
+    only known at the end, unless the caller already knows: prepend_unmatched is then the set of
+    pattern names that match nothing (e.g. from find_lines_windowed()).  The replacement of a rule that
+    matched nothing is appended (or prepended) with affix, as for -A/-P.
+    """
+    desired_preceding_newlines, desired_trailing_newlines = blank_line_control if blank_line_control is not None else (None, None)
+    rule_actions = _rule_actions(rules, action, affix)
+    hold_all = prepend_unmatched is None and any(rule_action == ActionIfBlockNotFound.REPLACE_OR_PREPEND for rule_action, _ in rule_actions)
+    # blank-line control needs the blank lines before a block in the same window as the block
+    keep_blank_runs = blank_line_control is not None or any(rule.blank_line_control is not None for rule in rules)
+    matched = [False] * len(rules)
+    changed = False
+    edited = False
+    first = True
+
+    for scan_window in iter_windows(infile, [rule.pattern_name for rule in rules], max_span, read_size, hold_all=hold_all, keep_blank_runs=keep_blank_runs):
+        rule_matches = []
+        for i, (rule, (rule_action, rule_affix), line_ranges) in enumerate(zip(rules, rule_actions, scan_window.line_ranges_by_pattern)):
+            if len(line_ranges) > 0:
+                matched[i] = True
+            # the replacement of a rule whose block isn't found goes at the start of the first window or
+            # the end of the last
+            replacement_text = rule.replacement_text
+            if rule_action == ActionIfBlockNotFound.REPLACE_OR_APPEND and scan_window.final and not matched[i]:
+                replacement_text = rule_affix + (replacement_text or "")
+            elif rule_action == ActionIfBlockNotFound.REPLACE_OR_PREPEND and first and (rule.pattern_name in prepend_unmatched if prepend_unmatched is not None else not matched[i]):
+                replacement_text = (replacement_text or "") + rule_affix
+            else:
+                rule_action = ActionIfBlockNotFound.REPLACE_ONLY
+            rule_matches.append(RuleMatch(rule.pattern_name, line_ranges, replacement_text, action=rule_action, blank_line_control=rule.blank_line_control))
+        planned = plan_output(FileBuffer(None, scan_window.text), rule_matches, action=ActionIfBlockNotFound.REPLACE_ONLY, desired_preceding_newlines=desired_preceding_newlines, desired_trailing_newlines=desired_trailing_newlines)
+        edited = edited or planned is not None
+        if planned is None or planned.unchanged:
+            yield scan_window.text
+        else:
+            changed = True
+            yield "".join(planned.output_chunks)
+        first = False
+    return FilterResult([rule.pattern_name for rule, rule_matched in zip(rules, matched) if rule.pattern_name is not None and not rule_matched], changed, edited)
+
+def filter_stream(infile:BinaryIO, outfile:TextIO, rules:list[BlockRule], action:ActionIfBlockNotFound, affix:str="", blank_line_control:tuple[int, int]|None=None, max_span:int=DEFAULT_MAX_SPAN_KB*1024, read_size:int=STREAM_READ_SIZE)->list[str]:
+    """
+    Transforms the text read from infile as it arrives and writes the result to outfile, holding back
+    only the text from the first line a match could still begin on, and never more than the last
+    max_span characters (the longest a match may be, unless its pattern declares its own max_span_kb)
+    plus at most as much again to keep a block (and with -w, the blank lines before it) together;
+    everything before that is written and flushed as soon as it has been read.
+
+    With REPLACE_OR_PREPEND the whole input is held, since whether to prepend is only known at the end.
+
+    Returns the names of the rules that matched nothing, for the caller to report when action is
+    REPLACE_ONLY.
+    """
+    chunks = iter_filtered_chunks(infile, rules, action, affix=affix, blank_line_control=blank_line_control, max_span=max_span, read_size=read_size)
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as stop:
+            return stop.value.unmatched
+        outfile.write(chunk)
+        outfile.flush()
+
+class _NothingToWrite(Exception):
+    # raised from inside the output chunks to abandon a write that isn't wanted after all
+    pass
+
+def _write_new_file(filename:str, chunks:Iterable[str]):
+    """
+    Writes chunks to filename by way of a temp file in the same directory, which only takes filename's
+    place once every chunk is written, so nothing is left behind if the chunks raise _NothingToWrite.
+    """
+    import tempfile
+    dir_name, base_name = os.path.split(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=dir_name, prefix=f".{base_name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        # the mode a plain open() would have given it
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_filename, 0o666 & ~umask)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+def replace_or_insert_windowed(filename:str, rules:list[BlockRule], action:ActionIfBlockNotFound, affix:str="", blank_line_control:tuple[int, int]|None=None, max_span:int=DEFAULT_MAX_SPAN_KB*1024, outfile:str|None=None, verbose=False, create_backup=False, create_backup_instructions:'CreateBackupInstructions'=None, fsync:str=FSYNC_NONE, backup_strategy:str=BACKUP_COPY, read_size:int=STREAM_READ_SIZE)->FilterResult:
+    """
+    Applies rules to filename (or writes the result to outfile) in one windowed pass, like
+    replace_or_insert_blocks() but with the output written as each window is scanned, so memory stays
+    bounded however large the file is.
+
+    The file is overwritten atomically, and only if it changes: the new copy is streamed into a temp
+    file and dropped if it turns out to be the same.  As with replace_or_insert_blocks(), outfile is only
+    written if there was something to do.  The backup, if any, is made once the new copy is
+    complete, just before it replaces the file.
+
+    A rule that prepends when its block isn't found first gets a windowed scan of its own, so that
+    whether to prepend is known before anything is written.
+    """
+    prepend_unmatched = set()
+    for rule, (rule_action, _) in zip(rules, _rule_actions(rules, action, affix)):
+        if rule_action == ActionIfBlockNotFound.REPLACE_OR_PREPEND and (not rule.pattern_name or len(find_lines_windowed(filename, rule.pattern_name, max_span, read_size)) == 0):
+            prepend_unmatched.add(rule.pattern_name)
+
+    result = None
+    backup_path = None
+    with open(filename, 'rb') as f:
+        def chunks()->Generator[str, None, None]:
+            nonlocal result, backup_path
+            result = yield from iter_filtered_chunks(f, rules, action, affix=affix, blank_line_control=blank_line_control, max_span=max_span, read_size=read_size, prepend_unmatched=prepend_unmatched)
+            if outfile:
+                if not result.edited:
+                    raise _NothingToWrite()
+                return
+            if not result.changed:
+                raise _NothingToWrite()
+            if create_backup:
+                from file_transform_tools.util.backup import backup_file
+                backup_path = backup_file(filename, strategy=backup_strategy)
+
+        if outfile:
+            if verbose:
+                print(f"The output contents will be placed in '{outfile}'")
+            try:
+                _write_new_file(outfile, chunks())
+            except _NothingToWrite:
+                pass
+        else:
+            try:
+                overwrite_with_chunks(filename, chunks(), fsync=fsync)
+            except _NothingToWrite:
+                if verbose:
+                    print(f"output is the same as '{filename}' => not overwriting it")
+    if backup_path is not None and create_backup_instructions is not None:
+        create_backup_instructions.append(filename, backup_path)
+    return result
@@ -0,0 +1,48 @@
+from __future__ import annotations
+import re
+from typing import NamedTuple
+from file_transform_tools.util.block_matcher import BlockPattern
+from file_transform_tools.util.cli import ActionIfBlockNotFound
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.find_block import find_lines_in_buffer
+from file_transform_tools.util.replace_or_insert import RuleMatch, plan_output
+from file_transform_tools.util.splice import LineEdit
+
+class TransformResult(NamedTuple):
+    """
+    The transformed text and the edits that were made to the input's lines (empty if nothing was
+    done).  The edits are the ones before blank-line control, which can also change the blank lines
+    around them.
+    """
+    text:str|bytes
+    edits:list[LineEdit]
+
+def _transform(text:str|bytes, pattern:re.Pattern|BlockPattern|str|None, replacement:str|bytes|None, action:ActionIfBlockNotFound, preceding:int|None, trailing:int|None)->TransformResult:
+    if isinstance(pattern, str):
+        from file_transform_tools.re_pattern_library import patterns
+        pattern = patterns[pattern]['pat']
+    file_buffer = FileBuffer(None, text)
+    line_ranges = find_lines_in_buffer(text, pattern, line_index=file_buffer.line_index) if pattern is not None else []
+    planned = plan_output(file_buffer, [RuleMatch(None, line_ranges, replacement)], action=action, desired_preceding_newlines=preceding, desired_trailing_newlines=trailing)
+    if planned is None or planned.unchanged:
+        return TransformResult(text, planned.edits if planned is not None else [])
+    return TransformResult(text[:0].join(planned.output_chunks), planned.edits)
+
+def transform_text(text:str, pattern:re.Pattern|BlockPattern|str|None, replacement:str|None, action:ActionIfBlockNotFound=ActionIfBlockNotFound.REPLACE_ONLY, preceding:int=None, trailing:int=None)->TransformResult:
+    """
+    Does to text what replace-block does to a file, entirely in memory: replaces every block pattern
+    matches with replacement (None or '' deletes them), or, according to action, appends or prepends
+    replacement if there is none.  preceding and trailing are the blank-line control of -w.
+
+    pattern is a compiled pattern (re.Pattern or BlockPattern), the name of one in the pattern
+    registry, or None to only append or prepend.  Unlike the command line, finding no block with
+    REPLACE_ONLY is not an error; the text is returned as it is.
+    """
+    return _transform(text, pattern, replacement, action, preceding, trailing)
+
+def transform_bytes(data:bytes, pattern:re.Pattern|BlockPattern|str|None, replacement:str|bytes|None, action:ActionIfBlockNotFound=ActionIfBlockNotFound.REPLACE_ONLY, preceding:int=None, trailing:int=None)->TransformResult:
+    """
+    Same as transform_text() for undecoded bytes (as with --mmap): str patterns are run as their bytes
+    equivalents, a str replacement is encoded as UTF-8, and line endings are left exactly as they are.
+    """
+    return _transform(data, pattern, replacement, action, preceding, trailing)
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import fnmatch
+import functools
+import os
+import re
+from typing import TYPE_CHECKING, Generator, Iterable, NamedTuple
+
+if TYPE_CHECKING:
+    import argparse
+
+# how much of each file to look at when deciding if it is binary
+BINARY_CHECK_BYTES = 8192
+
+@functools.lru_cache(maxsize=None)
+def gitignore_regex(pattern:str)->re.Pattern:
+    """
+    Translates a .gitignore pattern (without its leading '!' and trailing '/') the way git matches it:
+    '*', '?' and [...] never match '/', a '**' segment matches any number of directories ('**/' at the
+    start, '/**/' in the middle (including none) and '/**' at the end), and '\\' escapes a character.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i) and (i == 0 or pattern[i-1] == '/') and (i+2 == len(pattern) or pattern[i+2] == '/'):
+            if i+2 == len(pattern):
+                # 'a/**' (or just '**'): everything inside
+                parts.append('.*')
+            else:
+                # '**/': zero or more whole directories
+                parts.append('(?:.*/)?')
+            i += 3
+            continue
+        if c == '*':
+            # any other run of asterisks is a plain '*'
+            while i < len(pattern) and pattern[i] == '*':
+                i += 1
+            parts.append('[^/]*')
+            continue
+        if c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i+2 if pattern[i+1:i+2] in ('!', '^') else i+1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                negate = pattern[i+1] in ('!', '^')
+                body = pattern[i+2 if negate else i+1:end].replace('\\', '\\\\')
+                parts.append(f"[^/{body}]" if negate else f"(?!/)[{body}]")
+                i = end
+        elif c == '\\' and i+1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+class GitIgnoreRule(NamedTuple):
+    """
+    One pattern line from a .gitignore file, relative to the directory that contains it.
+    """
+    base_dir:str
+    pattern:str
+    negate:bool
+    dir_only:bool
+    anchored:bool
+
+    @classmethod
+    def parse(cls, base_dir:str, line:str)->'GitIgnoreRule|None':
+        """
+        Parses a .gitignore line; returns None for blank lines and comments.
+        """
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            return None
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # a slash anywhere but the end anchors the pattern to the .gitignore's directory
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if not line:
+            return None
+        return cls(base_dir, line, negate, dir_only, anchored)
+
+    def matches(self, rel_path:str, is_dir:bool)->bool:
+        """
+        rel_path is relative to the walk root and uses '/' separators.
+        """
+        if self.dir_only and not is_dir:
+            return False
+        if self.base_dir:
+            if not rel_path.startswith(self.base_dir + '/'):
+                return False
+            rel_path = rel_path[len(self.base_dir)+1:]
+        if self.anchored:
+            return gitignore_regex(self.pattern).match(rel_path) is not None
+        return gitignore_regex(self.pattern).match(rel_path.rsplit('/', 1)[-1]) is not None
+
+def is_ignored(rules:list[GitIgnoreRule], rel_path:str, is_dir:bool)->bool:
+    """
+    Applies .gitignore rules in order; the last rule that matches decides.
+    """
+    ignored = False
+    for rule in rules:
+        if rule.matches(rel_path, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+def read_gitignore(dir_path:str, rel_dir:str)->list[GitIgnoreRule]:
+    try:
+        with open(os.path.join(dir_path, '.gitignore'), 'r') as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        rule = GitIgnoreRule.parse(rel_dir, line)
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+def matches_any(globs:list[str], rel_path:str)->bool:
+    """
+    True if any glob matches either the path relative to the walk root or just the file name.
+    """
+    name = rel_path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatchcase(rel_path, glob) or fnmatch.fnmatchcase(name, glob) for glob in globs)
+
+def is_binary_file(path:str)->bool:
+    """
+    Treats a file as binary if its first BINARY_CHECK_BYTES contain a NUL byte (the same heuristic git uses).
+    """
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' in f.read(BINARY_CHECK_BYTES)
+    except OSError:
+        return True
+
+def iter_files(root:str, include:list[str]=None, exclude:list[str]=None, use_gitignore:bool=False, skip_binary:bool=True)->Generator[str, None, None]:
+    """
+    Walks root with os.scandir and yields the absolute path of every regular file, as it is found, so
+    processing can start before the walk finishes.
+
+    include and exclude are glob lists matched against the path relative to root or the file name; a file
+    must match an include glob (if any are given) and no exclude glob.  An excluded directory is not
+    descended into.  Symlinks are not followed and .git directories are always skipped.  With use_gitignore,
+    .gitignore files found along the way are honoured.
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    include = include or []
+    exclude = exclude or []
+
+    # depth first, visiting entries in sorted order so runs are reproducible
+    stack:list[tuple[str, str, list[GitIgnoreRule]]] = [(root, '', [])]
+    while stack:
+        dir_path, rel_dir, rules = stack.pop()
+        if use_gitignore:
+            rules = rules + read_gitignore(dir_path, rel_dir)
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name == '.git' or matches_any(exclude, rel_path) or (use_gitignore and is_ignored(rules, rel_path, True)):
+                    continue
+                subdirs.append((entry.path, rel_path, rules))
+            elif entry.is_file(follow_symlinks=False):
+                if include and not matches_any(include, rel_path):
+                    continue
+                if matches_any(exclude, rel_path) or (use_gitignore and is_ignored(rules, rel_path, False)):
+                    continue
+                if skip_binary and is_binary_file(entry.path):
+                    continue
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+def iter_input_files(filenames:Iterable[str], args:'argparse.Namespace')->Generator[str, None, None]:
+    """
+    Yields filenames followed by the files found under each of args.recursive's directories (filtered by
+    args.include, args.exclude and args.gitignore), lazily, so the first files are processed while the
+    directory walk is still going.
+    """
+    yield from filenames
+    for dir_name in args.recursive or []:
+        yield from iter_files(dir_name, include=args.include, exclude=args.exclude, use_gitignore=args.gitignore)
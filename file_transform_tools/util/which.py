@@ -1,3 +1,5 @@
+from __future__ import annotations
+import contextlib
 import shutil
 
 def which_delta(print_message:bool=True) -> bool:
@@ -12,3 +14,21 @@ def which_delta(print_message:bool=True) -> bool:
         print("  (Ubuntu/Debian) see readme.md for instructions to download and install the .deb package")
         return False
     return True
+
+@contextlib.contextmanager
+def stdout_through_delta():
+    """
+    Sends everything printed to stdout inside the with block through a single delta process, which
+    renders the diffs in it (and passes anything else through).  Returns when delta has finished.
+    """
+    import subprocess
+    delta = subprocess.Popen(['delta'], stdin=subprocess.PIPE, text=True)
+    try:
+        with contextlib.redirect_stdout(delta.stdin):
+            yield
+    finally:
+        try:
+            delta.stdin.close()
+        except BrokenPipeError:
+            pass
+        delta.wait()
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import re
+import sys
+from typing import BinaryIO, Callable, Generator, NamedTuple
+from file_transform_tools.re_pattern_library import derive_leading_literal, patterns
+from file_transform_tools.util.block_matcher import BlockPattern
+from file_transform_tools.util.cli import DEFAULT_MAX_SPAN_KB
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.file_line_range import FileLineRange
+from file_transform_tools.util.find_block import find_lines_in_buffer
+
+# input is read this much at a time (or whatever is available, if less)
+STREAM_READ_SIZE = 64*1024
+
+class ScanWindow(NamedTuple):
+    """
+    A run of whole lines that a windowed scan is done with: text, whose first line is line start_line of
+    the input, and each pattern's matches in it (line numbers relative to text).  final is set on the
+    last window, which runs to the end of the input.
+    """
+    text:str
+    start_line:int
+    line_ranges_by_pattern:list[list[FileLineRange]]
+    final:bool
+
+def iter_stream_text(infile:BinaryIO, read_size:int=STREAM_READ_SIZE)->Generator[str, None, None]:
+    """
+    Yields the text of infile as it arrives, decoded the same way FileBuffer decodes a file (the
+    locale's encoding, universal newlines).
+    """
+    import codecs
+    import io
+    import locale
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(locale.getpreferredencoding(False))(), translate=True)
+    read = getattr(infile, 'read1', infile.read)
+    while True:
+        data = read(read_size)
+        text = decoder.decode(data, final=not data)
+        if text:
+            yield text
+        if not data:
+            return
+
+def max_span_of(pattern_name:str|None, default_max_span:int)->int:
+    """
+    The longest a match of pattern_name can be, in characters: its library entry's max_span_kb if it
+    declares one, or else default_max_span.
+    """
+    if pattern_name is None:
+        return default_max_span
+    max_span_kb = patterns[pattern_name].get('max_span_kb')
+    return max_span_kb*1024 if max_span_kb is not None else default_max_span
+
+class _MatchStarts(NamedTuple):
+    """
+    Where a pattern's matches can begin, so iter_windows() holds back only text that a match still to
+    come could start in.  find(buf, pos) returns the first place at or after pos where one could begin,
+    or -1.  line_start is set for patterns whose matches only begin at the start of a line (or of the
+    whitespace-only lines before it); for those, is_marker(buf, pos) says whether buf[pos:] would be
+    taken for such a line if a window started at pos.  final is set for patterns whose matches don't
+    change as more text arrives (a regex's match may still grow).
+    """
+    find:Callable[[str, int], int]
+    line_start:bool
+    is_marker:Callable[[str, int], bool]|None
+    final:bool
+
+def _match_starts(pattern:re.Pattern|BlockPattern)->_MatchStarts|None:
+    """
+    Returns where pattern's matches can begin: at its BlockPattern begin lines, or at the literal every
+    match of a regex begins with (see derive_leading_literal()).  Returns None if that isn't known, and
+    a match could begin anywhere.
+    """
+    if isinstance(pattern, BlockPattern):
+        return _MatchStarts(pattern.find_begin, True, pattern.marker_at, True)
+    leading_literal = derive_leading_literal(pattern)
+    if leading_literal is None:
+        return None
+    literal, at_line_start = leading_literal
+    if not at_line_start:
+        return _MatchStarts(lambda buf, pos: buf.find(literal, pos), False, None, False)
+    line_re = re.compile(r'^[^\S\n]*' + re.escape(literal), re.MULTILINE)
+    marker_re = re.compile(r'[^\S\n]*' + re.escape(literal))
+    def find(buf:str, pos:int)->int:
+        match = line_re.search(buf, pos)
+        return match.start() if match else -1
+    return _MatchStarts(find, True, lambda buf, pos: marker_re.match(buf, pos) is not None, False)
+
+def _flush_boundary(buf:str, file_buffer:FileBuffer, line_ranges:list[FileLineRange], max_span:int, keep_blank_runs:bool=False, hold_from:int|None=None)->int:
+    """
+    Returns how many whole lines at the start of buf can be written out now: those before the line
+    hold_from is in (the earliest place a match still to come could begin), but at least those more than
+    max_span characters before the end of buf, which can't be part of such a match.  hold_from defaults
+    to that max_span limit.  The boundary is moved back out of any match it falls in.  With
+    keep_blank_runs (for -w), it is also moved back over the run of blank lines just before it, and out
+    of a match just before that run, so a block and the blank lines around it are written out together.
+
+    The boundary is never moved back more than another max_span (a block that limit falls in is
+    written out whole instead), so however the input looks (e.g. double-spaced), what is held back
+    stays bounded.
+    """
+    line_index = file_buffer.line_index
+    span_start = max(0, len(buf) - max_span)
+    if hold_from is None:
+        hold_from = span_start
+    boundary = line_index.line_of(max(hold_from, span_start))
+    limit = line_index.line_of(max(0, len(buf) - 2*max_span))
+    # a block the limit falls in is written out whole rather than split
+    for line_range in sorted(line_ranges):
+        if line_range.start_line < limit <= line_range.end_line:
+            limit = line_range.end_line + 1
+
+    def is_blank(line:int)->bool:
+        return not buf[line_index.line_start(line):line_index.line_end(line)].strip()
+
+    def out_of_matches(boundary:int, include_end:bool)->int:
+        # include_end also moves back out of a match that ends on the line just before boundary
+        moved = boundary
+        for line_range in line_ranges:
+            if line_range.start_line < boundary <= line_range.end_line + (1 if include_end else 0):
+                moved = min(moved, line_range.start_line)
+        if moved < boundary:
+            # a block takes in the whitespace-only lines before the line it is reported to start on
+            while moved > limit and is_blank(moved-1):
+                moved -= 1
+        return moved
+
+    boundary = out_of_matches(boundary, include_end=False)
+    if keep_blank_runs:
+        while boundary > limit and is_blank(boundary-1):
+            boundary -= 1
+        boundary = out_of_matches(boundary, include_end=True)
+    return max(boundary, limit)
+
+def iter_windows(infile:BinaryIO, pattern_names:list[str|None], default_max_span:int=DEFAULT_MAX_SPAN_KB*1024, read_size:int=STREAM_READ_SIZE, hold_all:bool=False, keep_blank_runs:bool=False)->Generator[ScanWindow, None, None]:
+    """
+    Scans infile for each of pattern_names (None matches nothing) in windows, and yields each run of
+    lines as soon as no match still to come can reach back into it.  Text is only held back from the
+    first line a match could still begin on (a BlockPattern's begin line, or the literal a regex's
+    matches begin with; see _match_starts()), and never more than the last max span of text (the
+    largest of the patterns' max_span_of()), plus at most as much again to keep a block (and with
+    keep_blank_runs, the blank lines before it) in one window, so memory stays bounded however long the
+    input is.  With hold_all, everything is held for a single final window.
+
+    A line longer than twice the max span is split between windows, before any place in it a match
+    could begin.  If that isn't known for every pattern (see derive_leading_literal()), the line is held
+    whole instead, and a warning is printed once to stderr, since memory then grows with that line.
+
+    A match longer than its pattern's max span means the span is too small: blocks that long can be
+    split between windows and missed, so a warning is printed (once per pattern) to stderr.
+    """
+    pattern_list = [patterns[pattern_name]['pat'] if pattern_name else None for pattern_name in pattern_names]
+    match_starts = [_match_starts(pattern) if pattern is not None else None for pattern in pattern_list]
+    # a long line can only be split if it is known where in it each pattern's matches can begin
+    can_split_lines = all(starts is not None for pattern, starts in zip(pattern_list, match_starts) if pattern is not None)
+    max_spans = [max_span_of(pattern_name, default_max_span) for pattern_name in pattern_names]
+    max_span = max(max_spans, default=default_max_span)
+    warned:set[str] = set()
+    warned_long_line = False
+    # the held-back text is only scanned again once a quarter of it (at most a quarter of max_span) more
+    # has arrived, so it isn't rescanned for every small read, but a short input is passed on at once
+    scan_every = max(1, max_span // 4)
+
+    def find_all(buf:str, file_buffer:FileBuffer)->list[list[FileLineRange]]:
+        return [find_lines_in_buffer(buf, pattern, line_index=file_buffer.line_index) if pattern is not None else [] for pattern in pattern_list]
+
+    def hold_from(buf:str, file_buffer:FileBuffer, line_ranges_by_pattern:list[list[FileLineRange]])->int:
+        """
+        Returns the earliest place in buf where a match still to come could begin: the start of the
+        first line (in the last max_span) a match could begin on, or of the whitespace-only lines before
+        it.  The last, unfinished line is always held.
+        """
+        line_index = file_buffer.line_index
+        span_start = max(0, len(buf) - max_span)
+        span_start_line = line_index.line_of(span_start)
+
+        def lead_in(line:int)->int:
+            # the start of the whitespace-only lines just before line, which a match beginning on it takes in
+            while line > span_start_line and buf[line_index.line_start(line-1):line_index.line_start(line)].isspace():
+                line -= 1
+            return line_index.line_start(line)
+
+        # blank lines at the end may yet be followed by a line a match begins on
+        hold = line_index.line_of(len(buf))
+        hold = lead_in(hold) if any(starts.line_start for starts in match_starts if starts is not None) else line_index.line_start(hold)
+        for pattern, starts, line_ranges in zip(pattern_list, match_starts, line_ranges_by_pattern):
+            if pattern is None:
+                continue
+            if starts is None:
+                hold = min(hold, span_start)
+                continue
+            # a match that can't change is done with, and so is one that ends before the last max_span
+            search_from = line_index.line_start(span_start_line)
+            for line_range in line_ranges:
+                match_end = line_index.line_end(line_range.end_line)
+                if starts.final or match_end <= span_start:
+                    search_from = max(search_from, match_end)
+            pos = starts.find(buf, search_from)
+            if pos == -1:
+                continue
+            line = line_index.line_of(pos)
+            hold = min(hold, lead_in(line) if starts.line_start else line_index.line_start(line))
+        return hold
+
+    def split_point(buf:str, file_buffer:FileBuffer)->int:
+        """
+        Returns where the long first line of buf can be split so that only about its last max_span is
+        held: before any place in it a match can begin, not on whitespace (which a window starting
+        there would take for indentation) and not where it would be taken for a line a match begins on.
+        Returns 0 if there is no such place.
+        """
+        split = min(len(buf) - max_span, file_buffer.line_index.line_end(0) - 1)
+        for starts in match_starts:
+            if starts is not None and not starts.line_start:
+                pos = starts.find(buf, 0)
+                if pos != -1:
+                    split = min(split, pos)
+        floor = max(0, split - max_span)
+        while split > floor and (buf[split].isspace() or any(starts.is_marker(buf, split) for starts in match_starts if starts is not None and starts.line_start)):
+            split -= 1
+        return split if split > floor else 0
+
+    def window(buf:str, file_buffer:FileBuffer, line_ranges_by_pattern:list[list[FileLineRange]], start_line:int, end_line:int, final:bool)->ScanWindow:
+        line_index = file_buffer.line_index
+        released = []
+        for pattern_name, span, line_ranges in zip(pattern_names, max_spans, line_ranges_by_pattern):
+            line_ranges = [line_range for line_range in line_ranges if line_range.end_line < end_line]
+            for line_range in line_ranges:
+                length = line_index.line_end(line_range.end_line) - line_index.line_start(line_range.start_line)
+                if length > span and pattern_name not in warned:
+                    print(f"warning: a block of {length} characters was found for pattern '{pattern_name}', more than its max span of {span}; blocks that long can be missed (raise --max-span-kb or the pattern's max_span_kb)", file=sys.stderr)
+                    warned.add(pattern_name)
+            released.append(line_ranges)
+        return ScanWindow(buf[:line_index.line_start(end_line)], start_line, released, final)
+
+    buf = ""
+    start_line = 0
+    scanned_len = 0
+    for text in iter_stream_text(infile, read_size):
+        buf += text
+        if hold_all or len(buf) - scanned_len < min(scan_every, max(1, scanned_len // 4)):
+            continue
+        file_buffer = FileBuffer(None, buf)
+        line_index = file_buffer.line_index
+        line_ranges_by_pattern = find_all(buf, file_buffer)
+        all_line_ranges = [line_range for line_ranges in line_ranges_by_pattern for line_range in line_ranges]
+        end_line = _flush_boundary(buf, file_buffer, all_line_ranges, max_span, keep_blank_runs, hold_from(buf, file_buffer, line_ranges_by_pattern))
+        if end_line > 0:
+            scan_window = window(buf, file_buffer, line_ranges_by_pattern, start_line, end_line, final=False)
+            yield scan_window
+            buf = buf[len(scan_window.text):]
+            start_line += end_line
+        elif line_index.line_end(0) > 2*max_span:
+            # a single line longer than twice the max span; its start can be written out if no match can
+            # begin inside it, otherwise it is held whole
+            split = 0
+            if can_split_lines and not any(line_range.start_line == 0 for line_range in all_line_ranges):
+                split = split_point(buf, file_buffer)
+            if split > 0:
+                # the rest of the line is still line 0 of the next window, so start_line stays the same
+                yield ScanWindow(buf[:split], start_line, [[] for _ in pattern_list], False)
+                buf = buf[split:]
+            elif not warned_long_line:
+                print(f"warning: a line of more than {2*max_span} characters is held in memory whole, since a match could begin inside it (memory grows with the longest line)", file=sys.stderr)
+                warned_long_line = True
+        scanned_len = len(buf)
+
+    # the rest of the input
+    file_buffer = FileBuffer(None, buf)
+    yield window(buf, file_buffer, find_all(buf, file_buffer), start_line, len(file_buffer.line_index), final=True)
+
+def find_lines_windowed(filename:str, pattern_name:str, default_max_span:int=DEFAULT_MAX_SPAN_KB*1024, read_size:int=STREAM_READ_SIZE)->list[FileLineRange]:
+    """
+    Returns the inclusive line ranges of every match of pattern_name in filename, like
+    find_lines_to_replace(), but read in windows (see iter_windows()) rather than as one string, so a
+    file larger than memory can be scanned.  The line numbers are those of the whole file.
+    """
+    line_ranges = []
+    with open(filename, 'rb') as f:
+        for scan_window in iter_windows(f, [pattern_name], default_max_span, read_size):
+            line_ranges.extend(FileLineRange(scan_window.start_line + line_range.start_line, scan_window.start_line + line_range.end_line) for line_range in scan_window.line_ranges_by_pattern[0])
+    return line_ranges
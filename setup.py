@@ -19,15 +19,17 @@ setup(
         "Operating System :: MacOS :: MacOS X",
         "Operating System :: POSIX :: Linux",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
-        "Programming Language :: Python :: 3.7",
-        "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
+        "Programming Language :: Python :: 3.13",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.9",
     entry_points={
         'console_scripts': [
             'replace-block=file_transform_tools.replace_block:main',
+            'replace-block-backups=file_transform_tools.backups:main',
         ],
     },
     install_requires=[
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark for find_lines_to_replace: shows how the time to translate matches into line numbers
+scales with the number of matching blocks in a file.
+
+The old approach (text.count('\\n', 0, pos) for every match) is quadratic in the number of matches
+because every match rescans the file from the beginning.  LineOffsetIndex is built once per file
+and queried by binary search, so the total time should roughly double when the match count doubles.
+
+Usage:
+    ./tests/bench_find_block.py [--max-blocks N]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from file_transform_tools.re_pattern_library import patterns, ModifiedPatternMatcher, PatternMatcherModifiers
+from file_transform_tools.util.find_block import find_lines_to_replace
+
+BLOCK = """#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from 'github.com/mikegoelzer/ecp5-first-steps'
+#
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+
+alias ll='ls -l'
+"""
+
+def make_file_str(num_blocks:int)->str:
+    return BLOCK * num_blocks
+
+def find_lines_to_replace_with_count(filename, pattern)->list[tuple[int,int]]:
+    """
+    The original per-match text.count() implementation, kept here for comparison.
+    """
+    with open(filename, 'r') as f:
+        text = f.read()
+    ranges = []
+    for (start_pos, end_pos) in ModifiedPatternMatcher(text, pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES).finditer():
+        ranges.append((text.count('\n', 0, start_pos+1), text.count('\n', 0, end_pos)))
+    return ranges
+
+def time_it(fn, *args)->float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark match-to-line translation in find_lines_to_replace")
+    parser.add_argument("--max-blocks", type=int, default=8000, help="Largest number of blocks to test (default 8000)")
+    args = parser.parse_args()
+
+    pattern = patterns['bash_rc_export_path']['pat']
+    print(f"{'blocks':>8} {'count() (s)':>12} {'index (s)':>12} {'index us/match':>15}")
+    num_blocks = 1000
+    while num_blocks <= args.max_blocks:
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            temp.write(make_file_str(num_blocks))
+            temp.close()
+            t_count = time_it(find_lines_to_replace_with_count, temp.name, pattern)
+            t_index = time_it(find_lines_to_replace, temp.name, pattern)
+            assert len(find_lines_to_replace(temp.name, pattern)) == num_blocks
+            print(f"{num_blocks:>8} {t_count:>12.4f} {t_index:>12.4f} {1e6*t_index/num_blocks:>15.2f}")
+        finally:
+            os.unlink(temp.name)
+        num_blocks *= 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from file_transform_tools.util.cli import COLOR_GREEN_BKG, COLOR_RESET
+from file_transform_tools.re_pattern_library import bash_rc_export_path_pattern, ifdef_slang_pattern, ModifiedPatternMatcher, PatternMatcherModifiers
+from file_transform_tools.util.block_matcher import BlockPattern
+from file_transform_tools.util.pattern_registry import PatternRegistry, PATTERN_FILES_ENV_VAR, compile_pattern
+
+#
+# Tests for the patterns in re_pattern_library.py.  These are also run from the main test module in
+# tests/test_replaceblock.py
+#
+class TestPatterns(unittest.TestCase):
+    disable_color=True
+    
+    def test_bash_rc_export_path(self):
+        did_match = False
+        s = """
+#
+# Lattice Diamond license
+#
+LATTICE_LICENSE_FILE=/usr/local/diamond/3.13/license/license.dat
+
+#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
+# 
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/template_tool:/home/mwg/ecp5-first-steps/my-designs/util/continuous_make:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+"""
+        # for match in bash_rc_export_path_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+
+        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+
+        self.assertTrue(did_match)
+
+    def test_bash_rc_export_path_with_new_lines(self):
+        did_match = False
+        s = """
+#
+# Added by brew
+#
+eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
+
+#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
+#
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
+
+export RISC_REPO_ROOT=/home/mwg/ecp5-first-steps
+export RISC_COMMON_DIR=/home/mwg/ecp5-first-steps/my-designs/common
+export RISCV_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc/riscv
+export RISCV_SOC_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc
+"""
+        # for match in bash_rc_export_path_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+        self.assertTrue(did_match)
+
+    def test_bash_rc_export_path_with_no_riscv_lines(self):
+        did_match = False
+        s = """
+#
+# Added by brew
+#
+eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
+
+#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
+#
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
+
+
+
+
+"""
+        # for match in bash_rc_export_path_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_YELLOW_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+        self.assertTrue(did_match)
+
+    def test_bash_rc_export_path_with_new_lines_and_two_blocks(self):
+        did_match = False
+        s = """
+#
+# Added by brew
+#
+eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
+
+#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
+#
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/parse_sv_enums
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/cache_tool4
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/slang-parse-tools
+
+export RISC_REPO_ROOT=/home/mwg/ecp5-first-steps
+export RISC_COMMON_DIR=/home/mwg/ecp5-first-steps/my-designs/common
+export RISCV_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc/riscv
+export RISCV_SOC_DIR=/home/mwg/ecp5-first-steps/my-designs/riscv-soc
+
+#
+# Added by brew
+#
+eval "$(/home/linuxbrew/.linuxbrew/bin/brew shellenv)"
+"""
+        # for match in bash_rc_export_path_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+        self.assertTrue(did_match)
+
+    def test_ifdef_slang(self):
+        did_match = False
+        s = """
+// This is the beginning of the file.
+
+`ifdef SLANG  // maybe some comment
+    `include "my_slang_file.sv"  // some comment
+    `include "my_slang_file2.sv" // some other comment
+`endif // maybe some comment
+
+// This is the rest of the file...
+"""
+        # for match in ifdef_slang_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+        modified_pattern_matcher = ModifiedPatternMatcher(s, ifdef_slang_pattern, modifier=PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+        self.assertTrue(did_match)
+
+    def test_bash_rc_export_path_with_env_vars_run_twice(self):
+        did_match = False
+        s = """
+#
+# Lattice Diamond license
+#
+LATTICE_LICENSE_FILE=/usr/local/diamond/3.13/license/license.dat
+
+#
+# Added by /home/mwg/ecp5-first-steps/my-designs/util/update_bashrc.sh from git@github.com:mikegoelzer/ecp5-first-steps.git
+# 
+export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/template_tool:/home/mwg/ecp5-first-steps/my-designs/util/continuous_make:/home/mwg/ecp5-first-steps/my-designs/util/slang_tb_gtkwave_helper:/home/mwg/ecp5-first-steps/my-designs/util/clog2
+export FOO=bar
+export BAR="baz"
+export BAZ='qux'
+"""
+        # for match in bash_rc_export_path_pattern.finditer(s):
+        #     print(f"match.start() = {match.start()}, match.end() = {match.end()}")
+        #     print(f"{COLOR_BLUE_BKG}{s[match.start():match.end()]}{COLOR_RESET}")
+        #     did_match = True
+        modified_pattern_matcher = ModifiedPatternMatcher(s, bash_rc_export_path_pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES)
+        for (start_pos,end_pos) in modified_pattern_matcher.finditer():
+            print(f"match.start() = {start_pos}, match.end() = {end_pos}")
+            if not self.disable_color:
+                print(f"{COLOR_GREEN_BKG}{s[start_pos:end_pos]}{COLOR_RESET}")
+            else:
+                print(f"{s[start_pos:end_pos]}")
+            did_match = True
+        self.assertTrue(did_match)
+
+class TestPatternRegistry(unittest.TestCase):
+    builtin_specs = {
+        "begin_end": {'regex': r"^# begin.*\n(.*\n)*?^# end.*$", 'flags': ["MULTILINE"], 'desc': 'begin/end comments'},
+        "ifdef_foo": {'begin': r"\`ifdef\s+FOO", 'open_marker': r"\`ifn?def\b", 'close_marker': r"\`endif\b", 'desc': 'ifdef FOO'},
+    }
+    test_file_str = "x\n# begin\nfoo\n# end\ny\n"
+
+    def make_registry(self)->PatternRegistry:
+        # keep the test independent of the environment and installed plugins
+        with mock.patch.dict(os.environ, {PATTERN_FILES_ENV_VAR: ''}), mock.patch('importlib.metadata.entry_points', return_value=[]):
+            registry = PatternRegistry(self.builtin_specs)
+            len(registry)
+        return registry
+
+    def write_pattern_file(self, suffix:str, contents:str)->str:
+        temp = tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False)
+        temp.write(contents)
+        temp.close()
+        self.addCleanup(os.unlink, temp.name)
+        return temp.name
+
+    def test_listing_does_not_compile(self):
+        registry = self.make_registry()
+        self.assertEqual(list(registry), ["begin_end", "ifdef_foo"])
+        self.assertEqual([registry[name]['desc'] for name in registry], ['begin/end comments', 'ifdef FOO'])
+        self.assertFalse(any(registry[name].is_compiled() for name in registry))
+
+        spans = list(ModifiedPatternMatcher(self.test_file_str, registry['begin_end']['pat'], PatternMatcherModifiers.NO_TRAILING_NEWLINES).finditer())
+        self.assertEqual(spans, [(2, self.test_file_str.index("\ny\n"))])
+        self.assertTrue(registry['begin_end'].is_compiled())
+        self.assertFalse(registry['ifdef_foo'].is_compiled())
+        self.assertIsInstance(registry['ifdef_foo']['pat'], BlockPattern)
+
+    def test_compiled_pattern_cache(self):
+        self.assertIs(compile_pattern(r"a+b", 0), compile_pattern(r"a+b", 0))
+        self.assertIsNot(compile_pattern(r"a+b", 0), compile_pattern(r"a+b", re.IGNORECASE))
+        self.assertIs(self.make_registry()['begin_end']['pat'], self.make_registry()['begin_end']['pat'])
+
+    def test_load_toml_and_json_files(self):
+        toml_file = self.write_pattern_file('.toml', """
+[patterns.toml_pattern]
+desc = "from toml"
+regex = '^toml.*$'
+flags = "MULTILINE|IGNORECASE"
+literals = ["toml"]
+""")
+        json_file = self.write_pattern_file('.json', json.dumps({'patterns': {'json_pattern': {'desc': 'from json', 'regex': '^json.*$', 'flags': ['MULTILINE']}}}))
+        registry = self.make_registry()
+        registry.load_file(toml_file)
+        registry.load_file(json_file)
+        registry.load_file(toml_file)
+        self.assertEqual(list(registry), ["begin_end", "ifdef_foo", "toml_pattern", "json_pattern"])
+        self.assertEqual(registry['toml_pattern']['pat'].flags & (re.MULTILINE | re.IGNORECASE), re.MULTILINE | re.IGNORECASE)
+        self.assertEqual(registry['toml_pattern']['literals'], ["toml"])
+        self.assertNotIn('literals', registry['json_pattern'])
+
+    def test_duplicate_and_invalid_patterns(self):
+        registry = self.make_registry()
+        with self.assertRaises(ValueError):
+            registry.load_file(self.write_pattern_file('.json', json.dumps({'patterns': {'begin_end': {'regex': 'x'}}})))
+        with self.assertRaises(ValueError):
+            registry.load_file(self.write_pattern_file('.json', json.dumps({'patterns': {'no_regex': {'desc': 'x'}}})))
+        with self.assertRaises(ValueError):
+            registry.load_file(self.write_pattern_file('.json', json.dumps({'not_patterns': {}})))
+
+    def test_env_var_and_plugins(self):
+        json_file = self.write_pattern_file('.json', json.dumps({'patterns': {'from_env': {'regex': 'env'}}}))
+        plugin = mock.Mock()
+        plugin.name = 'test_plugin'
+        plugin.load.return_value = lambda: {'from_plugin': {'regex': 'plugin'}}
+        broken_plugin = mock.Mock()
+        broken_plugin.name = 'broken_plugin'
+        broken_plugin.load.side_effect = ImportError("no module named broken_plugin")
+        with mock.patch.dict(os.environ, {PATTERN_FILES_ENV_VAR: json_file}), mock.patch('importlib.metadata.entry_points', return_value=[plugin, broken_plugin]), mock.patch('sys.stderr'):
+            registry = PatternRegistry(self.builtin_specs)
+            self.assertEqual(list(registry), ["begin_end", "ifdef_foo", "from_env", "from_plugin"])
+
+    def test_cli_pattern_file(self):
+        pattern_file = self.write_pattern_file('.toml', """
+[patterns.begin_end]
+desc = "begin/end comments"
+regex = '^# begin.*\\n(.*\\n)*?^# end.*$'
+flags = ["MULTILINE"]
+""")
+        input_file = self.write_pattern_file('.txt', self.test_file_str)
+        output_file = input_file + '.out'
+        self.addCleanup(lambda: os.path.exists(output_file) and os.unlink(output_file))
+        help_output = subprocess.run(['replace-block', '--pattern-file', pattern_file, '-h'], capture_output=True, text=True).stdout
+        self.assertIn('begin_end', help_output)
+        subprocess.run(['replace-block', '--pattern-file', pattern_file, '-pat', 'begin_end', '-r', 'replaced\n', '-o', output_file, input_file], check=True, capture_output=True)
+        with open(output_file, 'r') as f:
+            self.assertEqual(f.read(), "x\nreplaced\ny\n")
+
+if __name__ == "__main__":
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_suite = unittest.TestLoader().loadTestsFromModule(sys.modules[__name__])
+    result = test_runner.run(test_suite)
+    if result.wasSuccessful():
+        print("✅ all tests passed!")
+        sys.exit(0)
+    else:
+        print("❌ some tests failed")
+        sys.exit(1)
@@ -1,15 +1,40 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+import difflib
 import os
+import random
+import re
 import subprocess
 import sys
 import tempfile
+import time
 import unittest
 
 from file_transform_tools.util.find_block import find_lines_to_replace, FileLineRange
-from file_transform_tools.re_pattern_library import patterns, TestPatterns
-from file_transform_tools.util.cli import ActionIfBlockNotFound
+from file_transform_tools.util.line_index import LineOffsetIndex
+from file_transform_tools.util.file_buffer import FileBuffer
+from file_transform_tools.util.find_block import find_lines_in_buffer, find_lines_in_file_buffer
+from file_transform_tools.re_pattern_library import derive_leading_literal, derive_required_literals, required_literals, ifdef_slang_pattern, ifdef_slang_block_pattern, ModifiedPatternMatcher, PatternMatcherModifiers
+from file_transform_tools.util.splice import LineEdit, splice_lines, iter_splice_chunks
+from file_transform_tools.util.correct_newlines.correct_newlines import correct_newlines
+from reference_correct_newlines import reference_correct_newlines
+from file_transform_tools.util.walk import GitIgnoreRule, is_ignored, iter_files
+from file_transform_tools.re_pattern_library import patterns
+from test_patterns import TestPatterns, TestPatternRegistry
+from file_transform_tools.util.cli import ActionIfBlockNotFound, BlockRule
 from file_transform_tools.replace_block import replace_or_insert_block
+from file_transform_tools.util.replace_or_insert import RuleMatch, RuleConflictError, replace_or_insert_blocks
+from file_transform_tools.util.diff_render import iter_edits_diff, iter_lines_diff
+from file_transform_tools.util.transform import transform_text, transform_bytes
+from file_transform_tools.util.async_transform import atransform_files, make_args
+from file_transform_tools.util.stream_filter import filter_stream
+from file_transform_tools.util.windowed_scan import find_lines_windowed, iter_windows, max_span_of
+from file_transform_tools.util.manifest import load_manifest, group_rules_by_file
+from file_transform_tools.util.backup import BACKUP_AUTO, BACKUP_COPY, BACKUP_FUNCTIONS, BACKUP_HARDLINK, BACKUP_REFLINK, BACKUP_STRATEGIES, CreateBackupInstructions, backup_file
+from file_transform_tools.util.backup_store import COMPRESSIONS, BackupStore, format_snapshot_ref, parse_snapshot_ref
+from file_transform_tools.util.match_cache import CachedMatch, MatchCache, block_digest
+from file_transform_tools.util.output_writer import FSYNC_BATCH, FSYNC_PER_FILE, overwrite_with_chunks, sync_batch
 
 class TestFindLinesToReplaceBashRc(unittest.TestCase):
     def assert_lines_to_remove(self, test_file_str, expected_start_line, expected_end_line):
@@ -81,6 +106,35 @@ export PATH=$PATH:/home/mwg/ecp5-first-steps/my-designs/util/build_helpers/templ
 """
         self.assert_lines_to_remove(test_file_str, 0, 3)
 
+class TestFindLinesToReplaceMmap(unittest.TestCase):
+    def assert_same_as_text_mode(self, test_file_str, pattern_name):
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            pat = patterns[pattern_name]['pat']
+            temp.write(test_file_str)
+            temp.close()
+            line_ranges = find_lines_to_replace(temp.name, pat)
+            line_ranges_mmap = find_lines_to_replace(temp.name, pat, use_mmap=True)
+            self.assertEqual(line_ranges_mmap, line_ranges, f"line_ranges_mmap = {line_ranges_mmap}, line_ranges = {line_ranges}")
+        finally:
+            os.unlink(temp.name)
+
+    def test_bash_rc_vectors(self):
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        for subdir in ["replace_with_string", "replace_with_file_contents"]:
+            for filename in os.listdir(f"{script_dir}/test_vectors/{subdir}/input"):
+                with open(f"{script_dir}/test_vectors/{subdir}/input/{filename}", 'r') as f:
+                    self.assert_same_as_text_mode(f.read(), 'bash_rc_export_path')
+
+    def test_multiple_copies_of_block(self):
+        self.assert_same_as_text_mode(TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block, 'bash_rc_export_path')
+
+    def test_ifdef_slang(self):
+        self.assert_same_as_text_mode(TestSlangReplacer.test_file_str, 'ifdef_slang')
+
+    def test_empty_file(self):
+        self.assert_same_as_text_mode("", 'ifdef_slang')
+
 class TestReplaceBlockBashRc(unittest.TestCase):
     test_replacement_text = """ZZZZZ
 YYYYY
@@ -270,6 +324,277 @@ LATTICE_LICENSE_FILE=/usr/local/diamond/3.13/license/license.dat (4)
     def test_multiple_copies_of_block(self):
         self.replace_with_asserts(self.test_file_str_contains_multiple_copies_of_block, ActionIfBlockNotFound.REPLACE_ONLY, self.test_replacement_text, [FileLineRange(4, 7), FileLineRange(9, 12), FileLineRange(14, 17)], self.test_file_str_contains_multiple_copies_of_block_expected_output, 3)
 
+class TestLineOffsetIndex(unittest.TestCase):
+    test_strs = [
+        "",
+        "\n",
+        "A",
+        "A\n",
+        "A\nB",
+        "\n\nA\n\nB\n\n",
+        "# (0)\n# (1)\nexport PATH=$PATH:/usr/local/bin (2)\n\nXXXXXX (4)\n",
+    ]
+
+    def test_line_of_matches_count(self):
+        for s in self.test_strs:
+            index = LineOffsetIndex(s)
+            for pos in range(0, len(s)+2):
+                self.assertEqual(index.line_of(pos), s.count('\n', 0, pos), f"s = {s!r}, pos = {pos}")
+
+    def test_num_lines_matches_readlines(self):
+        for s in self.test_strs:
+            self.assertEqual(len(LineOffsetIndex(s)), len(s.splitlines(keepends=True)), f"s = {s!r}")
+
+    def test_line_start_and_end(self):
+        for s in self.test_strs:
+            index = LineOffsetIndex(s)
+            lines = s.splitlines(keepends=True)
+            for line_num, line in enumerate(lines):
+                self.assertEqual(s[index.line_start(line_num):index.line_end(line_num)], line, f"s = {s!r}, line_num = {line_num}")
+            self.assertEqual(index.line_start(len(lines)), len(s))
+
+    def test_bytes_buffer(self):
+        for s in self.test_strs:
+            index = LineOffsetIndex(s.encode('utf-8'))
+            for pos in range(0, len(s)+2):
+                self.assertEqual(index.line_of(pos), s.count('\n', 0, pos), f"s = {s!r}, pos = {pos}")
+
+class TestReadOnce(unittest.TestCase):
+    def replace_from_buffer(self, test_file_str, replacement_text, use_mmap, modify_file_after_load=False)->str:
+        pat = patterns['bash_rc_export_path']['pat']
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            temp.write(test_file_str)
+            temp.close()
+            with FileBuffer.load(temp.name, use_mmap=use_mmap) as file_buffer:
+                line_ranges = find_lines_in_buffer(file_buffer.text, pat, line_index=file_buffer.line_index)
+                if modify_file_after_load:
+                    # the line ranges refer to the loaded buffer, so changes on disk after loading must not leak in
+                    with open(temp.name, 'a') as f:
+                        f.write("appended after load\n")
+                replace_or_insert_block(temp.name, line_ranges, ActionIfBlockNotFound.REPLACE_ONLY, replacement_text, file_buffer=file_buffer)
+            with open(temp.name, 'r') as f:
+                return f.read()
+        finally:
+            os.unlink(temp.name)
+
+    def test_replace_from_text_buffer(self):
+        actual_file_str = self.replace_from_buffer(TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block, TestReplaceBlockBashRc.test_replacement_text, use_mmap=False)
+        self.assertEqual(actual_file_str, TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block_expected_output)
+
+    def test_replace_from_mmap_buffer(self):
+        actual_file_str = self.replace_from_buffer(TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block, TestReplaceBlockBashRc.test_replacement_text, use_mmap=True)
+        self.assertEqual(actual_file_str, TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block_expected_output)
+
+    def test_file_changed_after_load(self):
+        actual_file_str = self.replace_from_buffer(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file, TestReplaceBlockBashRc.test_replacement_text, use_mmap=False, modify_file_after_load=True)
+        self.assertEqual(actual_file_str, TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file_expected_output)
+
+class TestRequiredLiterals(unittest.TestCase):
+    def write_temp_file(self, data:bytes)->str:
+        temp = tempfile.NamedTemporaryFile(mode='wb', delete=False)
+        temp.write(data)
+        temp.close()
+        self.addCleanup(os.unlink, temp.name)
+        return temp.name
+
+    def test_derived_literals_cover_declared_literals(self):
+        for pattern_name, pattern_entry in patterns.items():
+            derived = derive_required_literals(pattern_entry['pat'])
+            for literal in pattern_entry['literals']:
+                self.assertIn(literal, derived, f"pattern_name = {pattern_name}")
+
+    def test_derive_skips_optional_parts(self):
+        self.assertEqual(derive_required_literals(re.compile(r"foo(bar|baz)?qux(?:abc)+")), ('abc', 'foo', 'qux'))
+        self.assertEqual(derive_required_literals(re.compile(rb"^\s*needle.*$", re.MULTILINE)), (b'needle',))
+        self.assertEqual(derive_required_literals(re.compile(r"needle", re.IGNORECASE)), ())
+
+    def test_derive_leading_literal(self):
+        self.assertEqual(derive_leading_literal(re.compile(r"^[ \t]*# begin.*$", re.MULTILINE)), ('# begin', True))
+        self.assertEqual(derive_leading_literal(re.compile(r"foo\d+bar")), ('foo', False))
+        self.assertEqual(derive_leading_literal(patterns['bash_rc_export_path']['pat']), ('#', True))
+        # ^ without MULTILINE, a leading group, and case-insensitive and block patterns aren't followed
+        self.assertIsNone(derive_leading_literal(re.compile(r"^foo")))
+        self.assertIsNone(derive_leading_literal(re.compile(r"(foo|bar)")))
+        self.assertIsNone(derive_leading_literal(re.compile(r"foo", re.IGNORECASE)))
+        self.assertIsNone(derive_leading_literal(ifdef_slang_block_pattern))
+
+    def test_rejected_without_decoding(self):
+        # not valid UTF-8, so decoding it would fail; the prefilter must reject it from the raw bytes
+        filename = self.write_temp_file(b"# \xff\xfe no block in here\n")
+        pattern_entry = patterns['bash_rc_export_path']
+        with FileBuffer.load(filename) as file_buffer:
+            line_ranges = find_lines_in_file_buffer(file_buffer, pattern_entry['pat'], required_literals=required_literals(pattern_entry))
+            self.assertEqual(line_ranges, [])
+            self.assertIsNone(file_buffer._text)
+
+    def test_literals_dont_span_line_breaks(self):
+        pattern = re.compile(r"^# begin\n# end", re.MULTILINE)
+        self.assertEqual(derive_required_literals(pattern), ('# begin', '# end'))
+        self.assertEqual(required_literals({'pat': pattern, 'literals': ["# begin\r\n# end"]}), ['# begin', '# end'])
+        # a CRLF file that contains the block must get past the prefilter
+        filename = self.write_temp_file(b"x\r\n# begin\r\n# end\r\n")
+        for use_mmap in [False, True]:
+            with FileBuffer.load(filename, use_mmap=use_mmap) as file_buffer:
+                expected = find_lines_in_buffer(file_buffer.text, pattern, line_index=file_buffer.line_index)
+            with FileBuffer.load(filename, use_mmap=use_mmap) as file_buffer:
+                actual = find_lines_in_file_buffer(file_buffer, pattern, required_literals=required_literals({'pat': pattern}))
+            self.assertEqual(actual, expected)
+        self.assertEqual(find_lines_to_replace(filename, pattern), [FileLineRange(1, 2)])
+
+    def test_same_result_with_and_without_prefilter(self):
+        test_file_strs = [
+            TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block,
+            TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file,
+            TestSlangReplacer.test_file_str,
+            "no block here\n",
+            "",
+        ]
+        for test_file_str in test_file_strs:
+            filename = self.write_temp_file(test_file_str.replace('\n', '\r\n').encode('utf-8'))
+            for pattern_name, pattern_entry in patterns.items():
+                for use_mmap in [False, True]:
+                    with FileBuffer.load(filename, use_mmap=use_mmap) as file_buffer:
+                        expected = find_lines_in_buffer(file_buffer.text, pattern_entry['pat'], line_index=file_buffer.line_index)
+                    with FileBuffer.load(filename, use_mmap=use_mmap) as file_buffer:
+                        actual = find_lines_in_file_buffer(file_buffer, pattern_entry['pat'], required_literals=required_literals(pattern_entry))
+                    self.assertEqual(actual, expected, f"pattern_name = {pattern_name}, use_mmap = {use_mmap}, test_file_str = {test_file_str!r}")
+
+class TestBlockPattern(unittest.TestCase):
+    # inputs with a single, non-nested `ifdef SLANG block, on which the old regex gets it right
+    single_block_strs = [
+        "`ifdef SLANG\n`include \"a.sv\"\n`endif\n",
+        "// x\n\n  \n\t`ifdef SLANG // c\n`include \"a.sv\"\n  `endif // c",
+        "\n\n`ifdef  SLANG\n`else\n`include \"b.sv\"\n`endif\n\n\n// rest\n",
+        "`ifdef SLANG\n  `ifndef FOO\n  `include \"a.sv\"\n  `endif\n`endif\n// rest\n",
+        "no block here\n`endif\n",
+        "",
+    ]
+
+    def spans(self, s:str|bytes, pattern)->list[tuple[int,int]]:
+        return list(ModifiedPatternMatcher(s, pattern, PatternMatcherModifiers.NO_TRAILING_NEWLINES).finditer())
+
+    def test_same_spans_as_regex(self):
+        for s in [TestSlangReplacer.test_file_str] + self.single_block_strs:
+            self.assertEqual(self.spans(s, ifdef_slang_block_pattern), self.spans(s, ifdef_slang_pattern), f"s = {s!r}")
+            self.assertEqual(self.spans(s.encode('utf-8'), ifdef_slang_block_pattern), self.spans(s, ifdef_slang_pattern), f"s = {s!r}")
+
+    def test_ends_at_matching_endif(self):
+        s = "`ifdef SLANG\n`ifdef FOO\n`else\n`endif\n`endif\nmiddle\n`ifdef BAR\n`endif\n"
+        self.assertEqual(self.spans(s, ifdef_slang_block_pattern), [(0, s.index("\nmiddle"))])
+
+    def test_multiple_blocks(self):
+        s = "`ifdef SLANG\na\n`endif\nmiddle\n\n`ifdef SLANG\nb\n`endif\n"
+        self.assertEqual(self.spans(s, ifdef_slang_block_pattern), [(0, s.index("\nmiddle")), (s.index("\n\n`ifdef")+1, len(s)-1)])
+
+    def test_nested_slang_block(self):
+        # a begin marker is found at any depth, and its block ends at its own `endif
+        s = "module m;\n`ifdef FOO\n`ifdef SLANG\nx\n`endif\n`endif\n"
+        self.assertEqual(self.spans(s, ifdef_slang_block_pattern), [(s.index("`ifdef SLANG"), s.index("\n`endif\n")+len("\n`endif"))])
+        self.assertEqual(find_lines_in_buffer(s, ifdef_slang_block_pattern), [FileLineRange(2, 4)])
+        self.assertEqual(self.spans(s.encode('utf-8'), ifdef_slang_block_pattern), self.spans(s, ifdef_slang_block_pattern))
+        # a SLANG block inside a SLANG block is part of the outer one
+        s = "`ifdef SLANG\n`ifdef SLANG\na\n`endif\n`endif\n"
+        self.assertEqual(self.spans(s, ifdef_slang_block_pattern), [(0, len(s)-1)])
+        # blocks nested at different depths, one after the other
+        s = "`ifdef A\n`ifdef B\n`ifdef SLANG\na\n`endif\n`endif\n`ifdef SLANG\nb\n`endif\n`endif\n"
+        self.assertEqual(find_lines_in_buffer(s, ifdef_slang_block_pattern), [FileLineRange(2, 4), FileLineRange(6, 8)])
+
+    def test_unterminated_block(self):
+        self.assertEqual(self.spans("`ifdef SLANG\n`ifdef FOO\n`endif\n", ifdef_slang_block_pattern), [])
+
+class TestSpliceLines(unittest.TestCase):
+    file_lines = ["0\n", "1\n", "2\n", "3\n", "4\n", "5\n"]
+
+    def test_replace_grow_and_shrink(self):
+        edits = [LineEdit(1, 2, ["a\n", "b\n", "c\n"]), LineEdit(3, 5, ["d\n"])]
+        new_file_lines, inserted = splice_lines(self.file_lines, edits)
+        self.assertEqual(new_file_lines, ["0\n", "a\n", "b\n", "c\n", "2\n", "d\n", "5\n"])
+        self.assertEqual(inserted, [FileLineRange(1, 3), FileLineRange(5, 5)])
+
+    def test_delete_and_insert(self):
+        edits = [LineEdit(0, 0, ["x\n"]), LineEdit(2, 4, [])]
+        new_file_lines, inserted = splice_lines(self.file_lines, edits)
+        self.assertEqual(new_file_lines, ["x\n", "0\n", "1\n", "4\n", "5\n"])
+        self.assertEqual(inserted, [FileLineRange(0, 0), FileLineRange(3, 2)])
+
+    def test_streamed_chunks_match_spliced_lines(self):
+        for text in ["".join(self.file_lines), "".join(self.file_lines)+"no newline at end"]:
+            file_lines = text.splitlines(keepends=True)
+            line_index = LineOffsetIndex(text)
+            for edits in [[], [LineEdit(0, 1, ["a\n"])], [LineEdit(1, 2, ["a\n", "b\n"]), LineEdit(4, len(file_lines), [])], [LineEdit(len(file_lines), len(file_lines), ["x\n"])]]:
+                expected = "".join(splice_lines(file_lines, edits)[0])
+                for chunk_size in [1, 3, 1 << 20]:
+                    self.assertEqual("".join(iter_splice_chunks(text, line_index, edits, chunk_size=chunk_size)), expected, f"edits = {edits}, chunk_size = {chunk_size}")
+                    self.assertEqual(b"".join(iter_splice_chunks(text.encode(), LineOffsetIndex(text.encode()), [LineEdit(e.start_line, e.end_line, [l.encode() for l in e.replacement_lines]) for e in edits], chunk_size=chunk_size)), expected.encode())
+
+    def test_overlapping_edits_rejected(self):
+        with self.assertRaises(ValueError):
+            splice_lines(self.file_lines, [LineEdit(1, 3, []), LineEdit(2, 4, [])])
+
+    def test_caller_line_ranges_not_mutated(self):
+        pat = patterns['bash_rc_export_path']['pat']
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            temp.write(TestReplaceBlockBashRc.test_file_str_contains_multiple_copies_of_block)
+            temp.close()
+            line_ranges = find_lines_to_replace(temp.name, pat)
+            line_ranges_copy = list(line_ranges)
+            replace_or_insert_block(temp.name, line_ranges, ActionIfBlockNotFound.REPLACE_ONLY, "ZZZZZ\n")
+            self.assertEqual(line_ranges, line_ranges_copy)
+        finally:
+            os.unlink(temp.name)
+
+class TestCorrectNewlinesMatchesReference(unittest.TestCase):
+    """
+    Property test: the linear correct_newlines() gives the same output as the original implementation
+    on random files with random replacements, appends and prepends.
+    """
+    line_choices = ["x\n", "y\n", "\n", "  \n"]
+
+    def random_lines(self, rng:random.Random, max_lines:int)->list[str]:
+        return [rng.choice(self.line_choices) for _ in range(rng.randint(0, max_lines))]
+
+    def random_case(self, rng:random.Random)->tuple[list[str], list[FileLineRange]]:
+        """
+        Returns the spliced file lines and the inserted/replaced ranges, built the same way replace_or_insert_block does.
+        """
+        file_lines = self.random_lines(rng, 12)
+        replacement_lines = self.random_lines(rng, 4)
+        kind = rng.choice(["replace", "append", "prepend"])
+        if kind == "append":
+            new_file_lines, _ = splice_lines(file_lines, [LineEdit(len(file_lines), len(file_lines), replacement_lines)])
+            return new_file_lines, [FileLineRange(len(file_lines)+1, len(file_lines) + len(replacement_lines))]
+        elif kind == "prepend":
+            new_file_lines, _ = splice_lines(file_lines, [LineEdit(0, 0, replacement_lines)])
+            return new_file_lines, [FileLineRange(1, len(replacement_lines)-1)]
+        else:
+            edits = []
+            pos = 0
+            while pos < len(file_lines) and len(edits) < 3:
+                start_line = rng.randint(pos, len(file_lines)-1)
+                end_line = rng.randint(start_line+1, len(file_lines))
+                edits.append(LineEdit(start_line, end_line, replacement_lines))
+                pos = end_line + rng.randint(0, 3)
+            return splice_lines(file_lines, edits)
+
+    def test_random_inputs(self):
+        rng = random.Random(1234)
+        num_compared = 0
+        for _ in range(5000):
+            file_lines, line_ranges = self.random_case(rng)
+            desired_preceding_newlines = rng.choice([None, 0, 1, 2, 3])
+            desired_trailing_newlines = rng.choice([None, 0, 1, 2, 3])
+            try:
+                expected = reference_correct_newlines(file_lines, line_ranges, desired_preceding_newlines, desired_trailing_newlines)
+            except (AssertionError, ValueError):
+                # degenerate ranges the reference rejects (e.g. prepending nothing)
+                continue
+            actual = correct_newlines(file_lines, line_ranges, desired_preceding_newlines, desired_trailing_newlines)
+            self.assertEqual(actual, expected, f"file_lines = {file_lines}, line_ranges = {line_ranges}, desired = ({desired_preceding_newlines}, {desired_trailing_newlines})")
+            num_compared += 1
+        self.assertGreater(num_compared, 4000)
+
 class TestVectors(unittest.TestCase):
     replacement_text = """Hello,
 world!
@@ -493,6 +818,1209 @@ Z
     def test_append_with_desired_newlines(self):
         self.slang_replace_with_asserts(self.test_file_str_append, ActionIfBlockNotFound.REPLACE_OR_APPEND, self.replacement_text, expected_line_ranges=[FileLineRange(3, 6)], expected_file_str=self.test_file_str_append_expected_output_with_3_2, expected_lines_inserted_or_replaced=[FileLineRange(3, 5)], desired_preceding_newlines=3, desired_trailing_newlines=2)
 
+class TestParallelJobs(unittest.TestCase):
+    def make_files(self, num_files)->list[str]:
+        filenames = []
+        for i in range(num_files):
+            temp = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=f"-{i}.txt")
+            # vary the sizes so the largest-first schedule differs from the input order
+            temp.write(("filler\n" * (i * 37 % 11)) + TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+            temp.close()
+            filenames.append(temp.name)
+        return filenames
+
+    def test_results_in_input_order(self):
+        from file_transform_tools.util.parallel import run_parallel
+        import argparse
+        filenames = self.make_files(8)
+        try:
+            args = argparse.Namespace(backup=False, mmap=False, pattern_name='bash_rc_export_path', action=ActionIfBlockNotFound.REPLACE_ONLY, blank_line_control=None, dry_run=False, outfile=None, verbose=True, preserve_temp_file_dry_run=False)
+            results = list(run_parallel(filenames, args, TestReplaceBlockBashRc.test_replacement_text, jobs=3, max_in_flight_bytes=1000))
+            self.assertEqual([file_result.filename for file_result, _ in results], filenames)
+            for (file_result, output), filename in zip(results, filenames):
+                self.assertEqual(file_result.error_count, 0)
+                self.assertIn("Match from line", output)
+                with open(filename, 'r') as f:
+                    self.assertTrue(f.read().endswith(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file_expected_output))
+        finally:
+            for filename in filenames:
+                os.unlink(filename)
+
+    def test_same_output_as_serial_run(self):
+        outputs = []
+        for jobs in ["1", "4"]:
+            filenames = self.make_files(6)
+            try:
+                p = subprocess.run([sys.executable, "-m", "file_transform_tools.replace_block", "-y", "-v", "-j", jobs, "-r", "ZZZZZ", "-pat", "bash_rc_export_path"] + filenames, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), stdout=subprocess.PIPE, text=True)
+                output = p.stdout
+                for filename in filenames:
+                    output = output.replace(filename, "<file>")
+                outputs.append(output)
+            finally:
+                for filename in filenames:
+                    os.unlink(filename)
+        self.assertEqual(outputs[0], outputs[1])
+
+class TestRecursiveWalk(unittest.TestCase):
+    tree = {
+        "a.sh": "#!/bin/sh\n",
+        "b.txt": "text\n",
+        "image.bin": b"\x89PNG\x00\x00",
+        ".gitignore": "build/\n*.log\n!keep.log\n",
+        "x.log": "log\n",
+        "keep.log": "log\n",
+        "build/out.txt": "generated\n",
+        "sub/c.sh": "#!/bin/sh\n",
+        "sub/.gitignore": "/d.txt\n",
+        "sub/d.txt": "text\n",
+        "sub/deeper/d.txt": "text\n",
+        ".git/config": "[core]\n",
+    }
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for rel_path, contents in self.tree.items():
+            path = os.path.join(self.temp_dir.name, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb' if isinstance(contents, bytes) else 'w') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def walk(self, **kwargs)->list[str]:
+        return [os.path.relpath(path, self.temp_dir.name) for path in iter_files(self.temp_dir.name, **kwargs)]
+
+    def test_all_text_files(self):
+        self.assertEqual(sorted(self.walk()), sorted(rel_path for rel_path in self.tree if rel_path not in ("image.bin", ".git/config")))
+
+    def test_include_and_exclude(self):
+        self.assertEqual(sorted(self.walk(include=["*.sh"])), ["a.sh", "sub/c.sh"])
+        self.assertEqual(sorted(self.walk(include=["*.txt"], exclude=["sub"])), ["b.txt", "build/out.txt"])
+
+    def test_gitignore(self):
+        self.assertEqual(sorted(self.walk(include=["*.txt", "*.log"], use_gitignore=True)), ["b.txt", "keep.log", "sub/deeper/d.txt"])
+
+    def test_gitignore_wildcards_match_like_git(self):
+        def ignored(pattern:str, rel_path:str, is_dir:bool=False)->bool:
+            return is_ignored([GitIgnoreRule.parse('', pattern)], rel_path, is_dir)
+        # '*' and '?' stay within a path segment
+        self.assertTrue(ignored("build/*.o", "build/x.o"))
+        self.assertFalse(ignored("build/*.o", "build/sub/x.o"))
+        self.assertFalse(ignored("build/?/x.o", "build/a/b/x.o"))
+        # '**' segments match any number of directories, including none
+        for rel_path in ["a/b", "a/x/b", "a/x/y/b"]:
+            self.assertTrue(ignored("a/**/b", rel_path), rel_path)
+        self.assertFalse(ignored("a/**/b", "a/xb"))
+        self.assertTrue(ignored("**/logs", "logs", True))
+        self.assertTrue(ignored("**/logs", "x/y/logs", True))
+        self.assertTrue(ignored("a/**", "a/x/y"))
+        self.assertFalse(ignored("a/**", "a"))
+
+    def test_cli_recursive(self):
+        with open(os.path.join(self.temp_dir.name, "sub", "c.sh"), 'w') as f:
+            f.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+        p = subprocess.run([sys.executable, "-m", "file_transform_tools.replace_block", "-y", "-r", TestReplaceBlockBashRc.test_replacement_text, "-pat", "bash_rc_export_path", "-A", "--recursive", self.temp_dir.name, "--include", "*.sh"], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), stdout=subprocess.PIPE, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout)
+        with open(os.path.join(self.temp_dir.name, "sub", "c.sh"), 'r') as f:
+            self.assertEqual(f.read(), TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file_expected_output)
+        with open(os.path.join(self.temp_dir.name, "a.sh"), 'r') as f:
+            self.assertEqual(f.read(), "#!/bin/sh\n" + TestReplaceBlockBashRc.test_replacement_text)
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.filename = os.path.join(self.temp_dir.name, 'file.txt')
+        with open(self.filename, 'w') as f:
+            f.write("old\n")
+
+    def read(self, path:str)->str:
+        with open(path, 'r') as f:
+            return f.read()
+
+    def test_overwrite_keeps_metadata(self):
+        os.chmod(self.filename, 0o640)
+        has_xattr = hasattr(os, 'setxattr')
+        if has_xattr:
+            try:
+                os.setxattr(self.filename, 'user.file_transform_tools', b'kept')
+            except OSError:
+                has_xattr = False
+        for fsync in [None, FSYNC_PER_FILE, FSYNC_BATCH]:
+            kwargs = {} if fsync is None else {'fsync': fsync}
+            overwrite_with_chunks(self.filename, ["new", "\n"], **kwargs)
+            self.assertEqual(self.read(self.filename), "new\n")
+            self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o640)
+            if has_xattr:
+                self.assertEqual(os.getxattr(self.filename, 'user.file_transform_tools'), b'kept')
+        # no temp files left behind
+        self.assertEqual(os.listdir(self.temp_dir.name), ['file.txt'])
+
+    def test_failed_write_leaves_file_untouched(self):
+        def chunks():
+            yield "partial"
+            raise RuntimeError("interrupted")
+        with self.assertRaises(RuntimeError):
+            overwrite_with_chunks(self.filename, chunks())
+        self.assertEqual(self.read(self.filename), "old\n")
+        self.assertEqual(os.listdir(self.temp_dir.name), ['file.txt'])
+
+    def test_symlink_target_is_replaced(self):
+        link = os.path.join(self.temp_dir.name, 'link.txt')
+        os.symlink(self.filename, link)
+        overwrite_with_chunks(link, ["new\n"])
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(self.filename), "new\n")
+
+    def test_sync_batch_fsyncs_only_the_given_files(self):
+        from unittest import mock
+        other = os.path.join(self.temp_dir.name, 'other.txt')
+        with open(other, 'w') as f:
+            f.write("other\n")
+        synced_inodes = []
+        real_fsync = os.fsync
+        def fsync(fd):
+            synced_inodes.append(os.fstat(fd).st_ino)
+            real_fsync(fd)
+        with mock.patch.object(os, 'fsync', side_effect=fsync), mock.patch.object(os, 'sync', create=True) as sync:
+            sync_batch([self.filename, other])
+        sync.assert_not_called()
+        # each file, then their directory once
+        self.assertEqual(synced_inodes, [os.stat(self.filename).st_ino, os.stat(other).st_ino, os.stat(self.temp_dir.name).st_ino])
+
+    def test_cli_fsync(self):
+        bashrc_filename = os.path.join(self.temp_dir.name, 'bashrc')
+        with open(bashrc_filename, 'w') as f:
+            f.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+        for fsync in ['none', 'per-file', 'batch']:
+            p = subprocess.run(['replace-block', '-y', '--fsync', fsync, '-A', '-pat', 'bash_rc_export_path', '-r', 'X=1', bashrc_filename], capture_output=True, text=True)
+            self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+            self.assertIn("X=1\n", self.read(bashrc_filename))
+        p = subprocess.run(['replace-block', '-y', '--fsync', 'sometimes', '-pat', 'bash_rc_export_path', bashrc_filename], capture_output=True, text=True)
+        self.assertNotEqual(p.returncode, 0)
+
+class TestNoOpWrite(unittest.TestCase):
+    test_file_str = "A\n# begin\nX=1\n# end\n\nB\n"
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.filename = os.path.join(self.temp_dir.name, 'file.txt')
+        with open(self.filename, 'w') as f:
+            f.write(self.test_file_str)
+        # an old mtime, so a rewrite would show
+        os.utime(self.filename, ns=(1_000_000_000, 1_000_000_000))
+
+    def assert_untouched(self):
+        self.assertEqual(os.stat(self.filename).st_mtime_ns, 1_000_000_000)
+        with open(self.filename, 'r') as f:
+            self.assertEqual(f.read(), self.test_file_str)
+
+    def test_same_replacement_is_not_written(self):
+        instructions = CreateBackupInstructions()
+        for desired_newlines in [(None, None), (0, 0)]:
+            changed = replace_or_insert_block(self.filename, [FileLineRange(1, 3)], ActionIfBlockNotFound.REPLACE_ONLY, "# begin\nX=1\n# end\n", create_backup=True, create_backup_instructions=instructions, desired_preceding_newlines=desired_newlines[0], desired_trailing_newlines=desired_newlines[1])
+            self.assertFalse(changed)
+            self.assert_untouched()
+        self.assertTrue(instructions.is_empty())
+
+        # a different block is written
+        self.assertTrue(replace_or_insert_block(self.filename, [FileLineRange(1, 3)], ActionIfBlockNotFound.REPLACE_ONLY, "# begin\nX=2\n# end\n"))
+        with open(self.filename, 'r') as f:
+            self.assertEqual(f.read(), "A\n# begin\nX=2\n# end\n\nB\n")
+
+    def test_cli_reports_unchanged(self):
+        pattern_file = os.path.join(self.temp_dir.name, 'patterns.toml')
+        with open(pattern_file, 'w') as f:
+            f.write("[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n")
+        p = subprocess.run(['replace-block', '-y', '-b', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "# begin\nX=1\n# end", self.filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        self.assertIn(f"{self.filename}: unchanged", p.stdout)
+        self.assertNotIn(".bak", p.stdout)
+        self.assert_untouched()
+
+class TestMatchCache(unittest.TestCase):
+    old_mtime_ns = 1_000_000_000
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.cache_file = os.path.join(self.temp_dir.name, 'cache', 'matches.sqlite')
+        self.filename = os.path.join(self.temp_dir.name, 'bashrc')
+        self.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+
+    def write(self, contents:str):
+        with open(self.filename, 'w') as f:
+            f.write(contents)
+        # cache entries are only made for files that weren't modified just now
+        os.utime(self.filename, ns=(self.old_mtime_ns, self.old_mtime_ns))
+
+    def test_unchanged_file_is_not_read_again(self):
+        pattern = patterns['bash_rc_export_path']['pat']
+        with MatchCache(self.cache_file) as match_cache:
+            line_ranges = find_lines_to_replace(self.filename, pattern, match_cache=match_cache)
+            self.assertEqual(line_ranges, find_lines_to_replace(self.filename, pattern))
+            self.assertEqual(len(match_cache), 1)
+
+            # same inode, size and mtime: the cached ranges are returned without reading the file
+            self.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file.replace("github.com", "example.co"))
+            self.assertEqual(find_lines_to_replace(self.filename, pattern), [])
+            self.assertEqual(find_lines_to_replace(self.filename, pattern, match_cache=match_cache), line_ranges)
+
+            # any change of the key is a miss
+            os.utime(self.filename, ns=(self.old_mtime_ns, self.old_mtime_ns+1))
+            self.assertEqual(find_lines_to_replace(self.filename, pattern, match_cache=match_cache), [])
+            self.assertEqual(find_lines_to_replace(self.filename, pattern, use_mmap=True, match_cache=match_cache), [])
+            self.assertEqual(len(match_cache), 3)
+
+    def test_recently_modified_files_are_not_cached(self):
+        with open(self.filename, 'a') as f:
+            f.write("\n")
+        with MatchCache(self.cache_file) as match_cache:
+            find_lines_to_replace(self.filename, patterns['bash_rc_export_path']['pat'], match_cache=match_cache)
+            self.assertEqual(len(match_cache), 0)
+
+    def test_least_recently_used_are_evicted(self):
+        matches = [CachedMatch(FileLineRange(1, 2), block_digest("x\n"))]
+        stats = [os.stat_result((0o644, ino, 1, 1, 0, 0, 10, 0, 0, 0, 0.0, 0.0, 0.0, 0, self.old_mtime_ns, 0)) for ino in range(5)]
+        with MatchCache(self.cache_file, max_entries=3) as match_cache:
+            for st in stats:
+                match_cache.store(st, 'fp', matches)
+                time.sleep(0.001)
+            # use the first one again, so it is the most recently used
+            self.assertEqual(match_cache.lookup(stats[0], 'fp'), matches)
+            match_cache.evict()
+            self.assertEqual(len(match_cache), 3)
+            self.assertEqual([match_cache.lookup(st, 'fp') is not None for st in stats], [True, False, False, True, True])
+            self.assertIsNone(match_cache.lookup(stats[0], 'other pattern'))
+
+    def test_hits_are_written_in_batches(self):
+        matches = [CachedMatch(FileLineRange(1, 2), block_digest("x\n"))]
+        st = os.stat_result((0o644, 1, 1, 1, 0, 0, 10, 0, 0, 0, 0.0, 0.0, 0.0, 0, self.old_mtime_ns, 0))
+        import sqlite3
+        def last_used()->int:
+            db = sqlite3.connect(self.cache_file)
+            try:
+                return db.execute("SELECT last_used FROM matches").fetchone()[0]
+            finally:
+                db.close()
+        with MatchCache(self.cache_file) as match_cache:
+            match_cache.store(st, 'fp', matches)
+            stored = last_used()
+            time.sleep(0.001)
+            self.assertEqual(match_cache.lookup(st, 'fp'), matches)
+            self.assertEqual(last_used(), stored)
+        self.assertGreater(last_used(), stored)
+
+    def test_jobs_workers_evict_on_exit(self):
+        pattern_file = os.path.join(self.temp_dir.name, 'patterns.toml')
+        with open(pattern_file, 'w') as f:
+            f.write("[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n")
+        filenames = []
+        for i in range(6):
+            filenames.append(os.path.join(self.temp_dir.name, f"file{i}"))
+            with open(filenames[-1], 'w') as f:
+                f.write("A\n# begin\nX=1\n# end\nB\n")
+            os.utime(filenames[-1], ns=(self.old_mtime_ns, self.old_mtime_ns))
+        p = subprocess.run(['replace-block', '-y', '--pattern-file', pattern_file, '--cache-file', self.cache_file, '--cache-max-entries', '2', '-pat', 'hash_block', '-r', "# begin\nX=1\n# end", '-j', '2', *filenames], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        with MatchCache(self.cache_file) as match_cache:
+            self.assertEqual(len(match_cache), 2)
+
+    def test_cli_cache(self):
+        self.write("A\n# begin\nX=1\n# end\nB\n")
+        other_filename = os.path.join(self.temp_dir.name, 'other')
+        with open(other_filename, 'w') as f:
+            f.write("A\n# begin\nX=1\n# end\nB\n")
+        os.utime(other_filename, ns=(self.old_mtime_ns, self.old_mtime_ns))
+        pattern_file = os.path.join(self.temp_dir.name, 'patterns.toml')
+        with open(pattern_file, 'w') as f:
+            f.write("[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n")
+        command = ['replace-block', '-y', '--pattern-file', pattern_file, '--cache-file', self.cache_file, '-pat', 'hash_block', '-r', "# begin\nX=1\n# end"]
+        for jobs in ['1', '2']:
+            p = subprocess.run(command + ['-j', jobs, self.filename, other_filename], capture_output=True, text=True)
+            self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+            self.assertIn(f"{self.filename}: unchanged", p.stdout)
+            self.assertIn(f"{other_filename}: unchanged", p.stdout)
+        with MatchCache(self.cache_file) as match_cache:
+            self.assertEqual(len(match_cache), 2)
+
+        # a stale entry proves the file isn't read on a cache hit; --no-cache reads it
+        self.write("A\n# begin\nX=2\n# end\nB\n")
+        p = subprocess.run(command + [self.filename], capture_output=True, text=True)
+        self.assertIn(f"{self.filename}: unchanged", p.stdout)
+        p = subprocess.run(command + ['--no-cache', self.filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        self.assertNotIn("unchanged", p.stdout)
+        with open(self.filename, 'r') as f:
+            self.assertEqual(f.read(), "A\n# begin\nX=1\n# end\nB\n")
+
+class TestBackupStrategies(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.filename = os.path.join(temp_dir.name, 'file.txt')
+        with open(self.filename, 'w') as f:
+            f.write("A\n# begin\nX=1\n# end\nB\n")
+        os.chmod(self.filename, 0o640)
+
+    def backup(self, strategy:str)->str:
+        backup_path = backup_file(self.filename, strategy=strategy)
+        self.addCleanup(os.unlink, backup_path)
+        return backup_path
+
+    def test_every_strategy_copies_contents_and_mode(self):
+        for strategy in BACKUP_STRATEGIES + [BACKUP_AUTO]:
+            backup_path = self.backup(strategy)
+            with open(backup_path, 'r') as f:
+                self.assertEqual(f.read(), "A\n# begin\nX=1\n# end\nB\n", strategy)
+            self.assertEqual(os.stat(backup_path).st_mode & 0o777, 0o640, strategy)
+            if strategy == BACKUP_COPY:
+                self.assertFalse(os.path.samefile(backup_path, self.filename))
+
+    def test_hardlink_backup_survives_overwrite(self):
+        instructions = CreateBackupInstructions(color_enabled=False)
+        replace_or_insert_block(self.filename, [FileLineRange(1, 3)], ActionIfBlockNotFound.REPLACE_ONLY, "Y=2\n", create_backup=True, create_backup_instructions=instructions, backup_strategy=BACKUP_HARDLINK)
+        backup_path = instructions.backup_files_map[self.filename]
+        self.addCleanup(os.unlink, backup_path)
+        with open(self.filename, 'r') as f:
+            self.assertEqual(f.read(), "A\nY=2\nB\n")
+        with open(backup_path, 'r') as f:
+            self.assertEqual(f.read(), "A\n# begin\nX=1\n# end\nB\n")
+        self.assertIn(f"mv {backup_path} {self.filename}", instructions.get_instructions_str())
+
+    def test_fallback_when_strategy_is_not_possible(self):
+        def not_possible(filename:str, backup_path:str):
+            raise OSError("cross-device link")
+        saved = dict(BACKUP_FUNCTIONS)
+        self.addCleanup(BACKUP_FUNCTIONS.update, saved)
+        BACKUP_FUNCTIONS.update({BACKUP_HARDLINK: not_possible, BACKUP_REFLINK: not_possible})
+        backup_path = self.backup(BACKUP_HARDLINK)
+        self.assertFalse(os.path.samefile(backup_path, self.filename))
+        with open(backup_path, 'r') as f:
+            self.assertEqual(f.read(), "A\n# begin\nX=1\n# end\nB\n")
+
+class TestBackupStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.store_path = os.path.join(self.temp_dir.name, 'store')
+        self.filename = os.path.join(self.temp_dir.name, 'bashrc')
+        self.write(self.filename, TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+
+    def write(self, path:str, contents:str):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_identical_contents_are_stored_once(self):
+        other_filename = os.path.join(self.temp_dir.name, 'zshrc')
+        self.write(other_filename, TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+        for compression in COMPRESSIONS:
+            with BackupStore(os.path.join(self.store_path, compression), compression=compression) as backup_store:
+                snapshots = [backup_store.save(self.filename), backup_store.save(self.filename), backup_store.save(other_filename)]
+                self.assertEqual(len({snapshot.content_hash for snapshot in snapshots}), 1)
+                self.assertEqual(len(backup_store.snapshots()), 3)
+                self.assertEqual([snapshot.id for snapshot in backup_store.snapshots(other_filename)], [snapshots[2].id])
+                self.assertEqual(len(os.listdir(os.path.join(backup_store.path, 'objects'))), 1)
+                self.assertLess(backup_store.stored_bytes(), snapshots[0].size)
+                self.assertEqual(backup_store.read(snapshots[0].id).decode('utf-8'), TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+
+    def test_failed_save_leaves_no_object(self):
+        import sqlite3
+        with BackupStore(self.store_path) as backup_store:
+            db = sqlite3.connect(os.path.join(backup_store.path, 'index.sqlite'))
+            db.execute("CREATE TRIGGER fail_snapshot BEFORE INSERT ON snapshots BEGIN SELECT RAISE(ABORT, 'no snapshots'); END")
+            db.close()
+            with self.assertRaises(sqlite3.DatabaseError):
+                backup_store.save(self.filename)
+            self.assertEqual([files for _, _, files in os.walk(os.path.join(backup_store.path, 'objects')) if files], [])
+            self.assertEqual(backup_store.stored_bytes(), 0)
+
+    def test_restore(self):
+        os.chmod(self.filename, 0o600)
+        with BackupStore(self.store_path) as backup_store:
+            snapshot = backup_store.save(self.filename)
+            self.write(self.filename, "changed\n")
+            os.chmod(self.filename, 0o644)
+            self.assertEqual(backup_store.restore(snapshot.id), self.filename)
+            with open(self.filename, 'r') as f:
+                self.assertEqual(f.read(), TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+            self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o600)
+            with self.assertRaises(KeyError):
+                backup_store.restore(snapshot.id+1)
+
+    def test_eviction_keeps_newest_snapshot_of_each_file(self):
+        other_filename = os.path.join(self.temp_dir.name, 'zshrc')
+        with BackupStore(self.store_path) as backup_store:
+            for i in range(5):
+                self.write(self.filename, f"version {i}\n" * 100)
+                backup_store.save(self.filename)
+            self.write(other_filename, "other\n")
+            backup_store.save(other_filename)
+
+            self.assertEqual(backup_store.evict(max_age_ns=3600*10**9), 0)
+            time.sleep(0.01)
+            self.assertEqual(backup_store.evict(max_age_ns=10**6), 4)
+            snapshots = backup_store.snapshots()
+            self.assertEqual([(snapshot.path, backup_store.read(snapshot.id).decode()[:9]) for snapshot in snapshots], [(self.filename, "version 4"), (other_filename, "other\n")])
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(backup_store.path, 'objects'))), 2)
+
+            self.write(self.filename, "version 5\n")
+            backup_store.save(self.filename)
+            self.assertEqual(backup_store.evict(max_bytes=0), 1)
+            self.assertEqual(len(backup_store.snapshots()), 2)
+
+    def test_cli_backup_store(self):
+        command = ['replace-block', '-y', '--backup-store', self.store_path, '-pat', 'bash_rc_export_path', '-A', '-r']
+        for replacement in ['X=1', 'X=2']:
+            p = subprocess.run(command + [replacement, self.filename], capture_output=True, text=True)
+            self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+            self.assertIn(f"replace-block-backups --store {self.store_path} restore", p.stdout)
+        with BackupStore(self.store_path) as backup_store:
+            snapshots = backup_store.snapshots(self.filename)
+        self.assertEqual(len(snapshots), 2)
+
+        p = subprocess.run(['replace-block-backups', '--store', self.store_path, 'restore', str(snapshots[0].id)], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        with open(self.filename, 'r') as f:
+            self.assertEqual(f.read(), TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+
+        p = subprocess.run(['replace-block-backups', '--store', self.store_path, 'prune', '--max-mb', '0'], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        p = subprocess.run(['replace-block-backups', '--store', self.store_path, 'list'], capture_output=True, text=True)
+        self.assertEqual(len(p.stdout.splitlines()), 1)
+
+    def test_instructions_for_snapshots(self):
+        instructions = CreateBackupInstructions(color_enabled=False)
+        instructions.append(self.filename, format_snapshot_ref(self.store_path, 7))
+        self.assertEqual(parse_snapshot_ref(instructions.backup_files_map[self.filename]), (self.store_path, 7))
+        self.assertIn(f"replace-block-backups --store {self.store_path} restore 7  # restores bashrc", instructions.get_instructions_str())
+
+class TestDiffRender(unittest.TestCase):
+    def render(self, file_lines:list[str], edits:list[LineEdit], context:int=3)->list[str]:
+        text = "".join(file_lines)
+        return list(iter_edits_diff(text, LineOffsetIndex(text), edits, fromfile='a', tofile='b', context=context))
+
+    def test_matches_difflib(self):
+        rng = random.Random(20)
+        for _ in range(200):
+            # unique lines, so difflib's diff is the only possible one
+            file_lines = [f"line {i}\n" for i in range(rng.randint(0, 40))]
+            edits = []
+            pos = 0
+            while pos <= len(file_lines) and rng.random() < 0.7:
+                start_line = rng.randint(pos, min(len(file_lines), pos+10))
+                end_line = rng.randint(start_line, min(len(file_lines), start_line+3))
+                edits.append(LineEdit(start_line, end_line, [f"new {start_line} {k}\n" for k in range(rng.randint(0 if end_line > start_line else 1, 3))]))
+                pos = end_line + 1
+            new_file_lines, _ = splice_lines(file_lines, edits)
+            for context in [0, 1, 3]:
+                self.assertEqual(self.render(file_lines, edits, context), list(difflib.unified_diff(file_lines, new_file_lines, fromfile='a', tofile='b', n=context)), (file_lines, edits, context))
+
+    def test_unchanged_lines_of_an_edit_are_context(self):
+        file_lines = ["A\n", "# begin\n", "X=1\n", "# end\n", "B\n"]
+        self.assertEqual(self.render(file_lines, [LineEdit(1, 4, ["# begin\n", "X=2\n", "# end\n"])], context=0), ["--- a\n", "+++ b\n", "@@ -3 +3 @@\n", "-X=1\n", "+X=2\n"])
+        self.assertEqual(self.render(file_lines, [LineEdit(1, 4, ["# begin\n", "X=1\n", "# end\n"])]), [])
+
+    def test_no_newline_at_end_of_file(self):
+        diff = "".join(self.render(["A\n", "B"], [LineEdit(1, 2, ["C"])]))
+        self.assertEqual(diff, "--- a\n+++ b\n@@ -1,2 +1,2 @@\n A\n-B\n\\ No newline at end of file\n+C\n\\ No newline at end of file\n")
+
+    def test_lines_diff_and_color(self):
+        old_lines = ["A\n", "B\n", "C\n"]
+        new_lines = ["A\n", "\n", "B2\n", "C\n"]
+        self.assertEqual(list(iter_lines_diff(old_lines, new_lines, fromfile='a', tofile='b')), list(difflib.unified_diff(old_lines, new_lines, fromfile='a', tofile='b')))
+        colored = "".join(iter_lines_diff(old_lines, new_lines, fromfile='a', tofile='b', color=True))
+        self.assertIn("\033[31m-B\033[0m\n", colored)
+        self.assertIn("\033[32m+B2\033[0m\n", colored)
+
+    def test_cli_dry_run_without_delta(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'file.txt')
+            with open(filename, 'w') as f:
+                f.write("A\n# begin\nX=1\n# end\nB\n")
+            pattern_file = os.path.join(temp_dir, 'patterns.toml')
+            with open(pattern_file, 'w') as f:
+                f.write("[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n")
+            env = dict(os.environ, PATH=os.path.dirname(sys.executable))
+            p = subprocess.run([os.path.join(os.path.dirname(sys.executable), 'replace-block'), '--dry-run', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "# begin\nX=2\n# end", filename], capture_output=True, text=True, env=env)
+            self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+            self.assertEqual(p.stdout, f"--- {filename}\n+++ {filename}\n@@ -1,5 +1,5 @@\n A\n # begin\n-X=1\n+X=2\n # end\n B\n")
+            self.assertEqual(sorted(os.listdir(temp_dir)), ['file.txt', 'patterns.toml'])
+
+            p = subprocess.run([os.path.join(os.path.dirname(sys.executable), 'replace-block'), '--delta', '--dry-run', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "X", filename], capture_output=True, text=True, env=env)
+            self.assertEqual(p.returncode, 1)
+            self.assertIn("'delta' command not found", p.stdout)
+
+class TestEmitPatch(unittest.TestCase):
+    test_files = {
+        'replaced.txt': "A\n# begin\nX=1\n# end\nB\n",
+        'sub/appended.txt': "no block here",
+        'unchanged.txt': "# begin\nX=2\n# end\n",
+    }
+
+    def make_checkout(self, dir_name:str):
+        for name, contents in self.test_files.items():
+            os.makedirs(os.path.join(dir_name, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(dir_name, name), 'w') as f:
+                f.write(contents)
+
+    def read_checkout(self, dir_name:str)->dict[str, str]:
+        contents = {}
+        for name in self.test_files:
+            with open(os.path.join(dir_name, name), 'r') as f:
+                contents[name] = f.read()
+        return contents
+
+    def run_replace_block(self, cwd:str, *extra_args:str)->subprocess.CompletedProcess:
+        p = subprocess.run(['replace-block', '--pattern-file', self.pattern_file, '-A', '-pat', 'hash_block', '-r', "# begin\nX=2\n# end", *extra_args, *self.test_files], cwd=cwd, capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        return p
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.pattern_file = os.path.join(self.temp_dir.name, 'patterns.toml')
+        with open(self.pattern_file, 'w') as f:
+            f.write("[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n")
+
+        # what an in-place run gives
+        expected_dir = os.path.join(self.temp_dir.name, 'expected')
+        self.make_checkout(expected_dir)
+        self.run_replace_block(expected_dir, '-y')
+        self.expected = self.read_checkout(expected_dir)
+
+        # the patch, made once
+        source_dir = os.path.join(self.temp_dir.name, 'source')
+        self.make_checkout(source_dir)
+        self.patch_file = os.path.join(self.temp_dir.name, 'changes.diff')
+        p = self.run_replace_block(source_dir, '-j', '2', '--emit-patch', self.patch_file)
+        self.assertIn("unchanged.txt: unchanged", p.stdout)
+        self.assertIn("wrote the changes to 2 file(s)", p.stdout)
+        self.assertEqual(self.read_checkout(source_dir), self.test_files)
+
+    def test_patch_headers(self):
+        with open(self.patch_file, 'r') as f:
+            patch = f.read()
+        self.assertTrue(patch.startswith("--- a/replaced.txt\n+++ b/replaced.txt\n"), patch)
+        self.assertIn("--- a/sub/appended.txt\n+++ b/sub/appended.txt\n", patch)
+        self.assertNotIn("unchanged.txt", patch)
+
+    def test_git_apply(self):
+        checkout_dir = os.path.join(self.temp_dir.name, 'checkout')
+        self.make_checkout(checkout_dir)
+        p = subprocess.run(['git', 'apply', self.patch_file], cwd=checkout_dir, capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        self.assertEqual(self.read_checkout(checkout_dir), self.expected)
+
+    def test_patch_p1(self):
+        import shutil
+        if shutil.which('patch') is None:
+            self.skipTest("patch not installed")
+        checkout_dir = os.path.join(self.temp_dir.name, 'checkout')
+        self.make_checkout(checkout_dir)
+        p = subprocess.run(['patch', '-p1', '-i', self.patch_file], cwd=checkout_dir, capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        self.assertEqual(self.read_checkout(checkout_dir), self.expected)
+
+    def emit_patch_error(self, cwd:str, filename:str)->subprocess.CompletedProcess:
+        patch_file = os.path.join(self.temp_dir.name, 'rejected.diff')
+        p = subprocess.run(['replace-block', '--pattern-file', self.pattern_file, '-A', '-pat', 'hash_block', '-r', "# begin\nX=2\n# end", '--emit-patch', patch_file, filename], cwd=cwd, capture_output=True, text=True)
+        self.assertNotEqual(p.returncode, 0, p.stdout + p.stderr)
+        self.assertFalse(os.path.exists(patch_file) and os.path.getsize(patch_file) > 0)
+        return p
+
+    def test_crlf_file_is_rejected(self):
+        with open(os.path.join(self.temp_dir.name, 'crlf.txt'), 'wb') as f:
+            f.write(b"A\r\n# begin\r\nX=1\r\n# end\r\nB\r\n")
+        p = self.emit_patch_error(self.temp_dir.name, 'crlf.txt')
+        self.assertIn("crlf.txt: --emit-patch doesn't support files with \\r\\n or \\r line endings", p.stdout)
+
+    def test_file_outside_cwd_is_rejected(self):
+        source_dir = os.path.join(self.temp_dir.name, 'source')
+        p = self.emit_patch_error(os.path.join(source_dir, 'sub'), os.path.join('..', 'replaced.txt'))
+        self.assertIn("is outside the current directory, so it can't be named in a patch", p.stdout)
+
+class TestTransformText(unittest.TestCase):
+    pattern = re.compile(r'^# begin.*\n(.*\n)*?^# end.*$', re.MULTILINE)
+    test_file_str = "A\n# begin\nX=1\n# end\n\nB\n# begin\nX=1\n# end\n"
+
+    def transform_file(self, text:str, replacement:str|None, action:ActionIfBlockNotFound, preceding:int=None, trailing:int=None)->str:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'in.txt')
+            outfile = os.path.join(temp_dir, 'out.txt')
+            with open(filename, 'w') as f:
+                f.write(text)
+            line_ranges = find_lines_to_replace(filename, self.pattern)
+            if not replace_or_insert_block(filename, line_ranges, action, replacement, outfile=outfile, desired_preceding_newlines=preceding, desired_trailing_newlines=trailing):
+                return text
+            with open(outfile, 'r') as f:
+                return f.read()
+
+    def test_matches_file_transform(self):
+        cases = [
+            (self.test_file_str, "# begin\nX=2\n# end", ActionIfBlockNotFound.REPLACE_ONLY, None, None),
+            (self.test_file_str, None, ActionIfBlockNotFound.REPLACE_ONLY, None, None),
+            (self.test_file_str, "Y=1", ActionIfBlockNotFound.REPLACE_OR_APPEND, 0, 0),
+            ("A\nB\n", "Y=1", ActionIfBlockNotFound.REPLACE_OR_APPEND, None, None),
+            ("A\nB\n", "Y=1\nY=2", ActionIfBlockNotFound.REPLACE_OR_PREPEND, None, None),
+            ("A\nB", "Y=1", ActionIfBlockNotFound.REPLACE_OR_APPEND, None, None),
+        ]
+        for text, replacement, action, preceding, trailing in cases:
+            result = transform_text(text, self.pattern, replacement, action, preceding, trailing)
+            self.assertEqual(result.text, self.transform_file(text, replacement, action, preceding, trailing), (text, replacement, action))
+
+    def test_edits_and_no_match(self):
+        new_text, edits = transform_text(self.test_file_str, self.pattern, "X")
+        self.assertEqual(new_text, "A\nX\n\nB\nX\n")
+        self.assertEqual(edits, [LineEdit(1, 4, ["X\n"]), LineEdit(6, 9, ["X\n"])])
+        self.assertEqual(transform_text("A\nB\n", self.pattern, "X"), ("A\nB\n", []))
+        # a named pattern from the registry
+        self.assertEqual(transform_text("A\n", 'bash_rc_export_path', "X", ActionIfBlockNotFound.REPLACE_OR_APPEND).text, "A\nX\n")
+
+    def test_bytes(self):
+        data = self.test_file_str.replace("\n", "\r\n").encode('utf-8')
+        new_data, edits = transform_bytes(data, self.pattern, "X")
+        self.assertEqual(new_data, b"A\r\nX\n\r\nB\r\nX\n")
+        self.assertEqual(len(edits), 2)
+        self.assertEqual(transform_bytes(b"\xff\n", None, b"\xfe", ActionIfBlockNotFound.REPLACE_OR_PREPEND).text, b"\xfe\n\xff\n")
+
+class TestAsyncTransform(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.filenames = TestParallelJobs.make_files(self, 6)
+        self.addCleanup(lambda: [os.unlink(filename) for filename in self.filenames])
+
+    def test_transforms_files_as_they_finish(self):
+        import asyncio
+        args = make_args('-pat', 'bash_rc_export_path', '-r', TestReplaceBlockBashRc.test_replacement_text, '--backup-store', os.path.join(self.temp_dir.name, 'backups'))
+        pulled = []
+        def lazy_filenames():
+            for filename in self.filenames:
+                pulled.append(filename)
+                yield filename
+
+        async def run()->tuple[list, int]:
+            # the event loop has to stay free to run other tasks while the files are transformed
+            ticks = 0
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+            ticker_task = asyncio.create_task(ticker())
+            results = []
+            async for file_result, output in atransform_files(lazy_filenames(), args, concurrency=2):
+                # no more than concurrency files are taken ahead of the results handed back
+                self.assertLessEqual(len(pulled), len(results) + 2)
+                results.append((file_result, output))
+            ticker_task.cancel()
+            return results, ticks
+
+        results, ticks = asyncio.run(run())
+        self.assertGreater(ticks, 0)
+        self.assertEqual(sorted(file_result.filename for file_result, _ in results), sorted(self.filenames))
+        for file_result, output in results:
+            self.assertEqual(file_result.error_count, 0, output)
+            self.assertTrue(file_result.changed)
+            self.assertEqual(len(file_result.backups), 1)
+            with open(file_result.filename, 'r') as f:
+                self.assertTrue(f.read().endswith(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file_expected_output))
+        with BackupStore(os.path.join(self.temp_dir.name, 'backups')) as backup_store:
+            self.assertEqual(len(backup_store.snapshots()), len(self.filenames))
+
+    def test_dry_run_and_errors(self):
+        import asyncio
+        async def run(args)->list:
+            return [result async for result in atransform_files(self.filenames[:2], args)]
+        results = asyncio.run(run(make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', '--dry-run', '--color', 'never')))
+        for file_result, output in results:
+            self.assertIn(f"--- {file_result.filename}\n", output)
+            self.assertFalse(file_result.changed)
+        # a manifest's files come from the manifest
+        args = make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', '--dry-run')
+        args.manifest_rules = {}
+        with self.assertRaises(ValueError):
+            asyncio.run(run(args))
+
+    def test_outfile_needs_a_single_file(self):
+        import asyncio
+        async def run(filenames, args)->list:
+            return [result async for result in atransform_files(filenames, args)]
+        outfile = os.path.join(self.temp_dir.name, 'out.txt')
+        args = make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', '-o', outfile)
+        with self.assertRaises(ValueError):
+            asyncio.run(run(iter(self.filenames[:2]), args))
+        self.assertFalse(os.path.exists(outfile))
+        [(file_result, output)] = asyncio.run(run(self.filenames[:1], args))
+        self.assertEqual(file_result.error_count, 0, output)
+        with open(outfile, 'r') as f:
+            self.assertIn("X=1\n", f.read())
+
+    def test_recursive(self):
+        import asyncio
+        tree_dir = os.path.join(self.temp_dir.name, 'tree')
+        os.makedirs(os.path.join(tree_dir, 'sub'))
+        tree_files = [os.path.join(tree_dir, 'a.sh'), os.path.join(tree_dir, 'sub', 'b.sh'), os.path.join(tree_dir, 'sub', 'c.txt')]
+        for filename in tree_files:
+            with open(filename, 'w') as f:
+                f.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+        async def run(args)->list:
+            return [result async for result in atransform_files(self.filenames[:1], args)]
+        results = asyncio.run(run(make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', '--dry-run', '-R', tree_dir, '--include', '*.sh')))
+        self.assertEqual(sorted(file_result.filename for file_result, _ in results), sorted([self.filenames[0]] + tree_files[:2]))
+
+    def test_cli_only_options_are_rejected(self):
+        for options in [('-j', '2'), ('--emit-patch', os.path.join(self.temp_dir.name, 'x.diff')), ('--dry-run', '--delta')]:
+            with self.assertRaises(ValueError):
+                make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', *options)
+
+    def test_stdin_options_are_rejected(self):
+        # nothing would ever be read from stdin, so the block would be deleted
+        with self.assertRaises(ValueError):
+            make_args('-pat', 'bash_rc_export_path', '-r', '-')
+        with self.assertRaises(ValueError):
+            make_args('-pat', 'bash_rc_export_path', '-r', 'X=1', '-')
+
+class TestStreamFilter(unittest.TestCase):
+    pattern_toml = "[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\n"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.pattern_file = os.path.join(cls.temp_dir.name, 'patterns.toml')
+        with open(cls.pattern_file, 'w') as f:
+            f.write(cls.pattern_toml)
+        patterns.load_file(cls.pattern_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def test_same_output_as_whole_text(self):
+        import io
+        rng = random.Random(24)
+        for _ in range(100):
+            lines = []
+            for i in range(rng.randint(0, 150)):
+                r = rng.random()
+                if r < 0.05:
+                    lines += ["# begin\n", "X=1\n", "# end\n"]
+                elif r < 0.3:
+                    lines.append("\n")
+                else:
+                    lines.append(f"line {i}\n")
+            text = "".join(lines)
+            if rng.random() < 0.3:
+                text = text.rstrip("\n")
+            for action in ActionIfBlockNotFound:
+                out = io.StringIO()
+                # a tiny span and read size, so the text is written out in many pieces
+                filter_stream(io.BytesIO(text.encode('utf-8')), out, [BlockRule('hash_block', "NEW")], action, affix="\n", max_span=20, read_size=7)
+                expected_replacement = "\nNEW" if action == ActionIfBlockNotFound.REPLACE_OR_APPEND else "NEW\n" if action == ActionIfBlockNotFound.REPLACE_OR_PREPEND else "NEW"
+                expected = transform_text(text, patterns['hash_block']['pat'], "NEW" if "# begin" in text else expected_replacement, action).text
+                self.assertEqual(out.getvalue(), expected, (text, action))
+
+    def test_double_spaced_input_is_written_before_end_of_input(self):
+        import io
+        text = "x = 1\n\n" * 20000 + "# begin\nX=1\n# end\n"
+        infile = io.BytesIO(text.encode('utf-8'))
+
+        class Output(io.StringIO):
+            # remembers how much of the input had been read at each write
+            read_positions = []
+            def write(self, s):
+                self.read_positions.append(infile.tell())
+                return super().write(s)
+
+        for blank_line_control in [None, (1, 1)]:
+            infile.seek(0)
+            out = Output()
+            out.read_positions = []
+            filter_stream(infile, out, [BlockRule('hash_block', "NEW")], ActionIfBlockNotFound.REPLACE_ONLY, blank_line_control=blank_line_control, max_span=1024, read_size=512)
+            self.assertGreater(len(out.read_positions), 10)
+            self.assertLess(out.read_positions[0], len(text) // 10)
+            self.assertTrue(out.getvalue().startswith("x = 1\n\nx = 1\n"))
+            self.assertIn("NEW", out.getvalue())
+
+    def test_cli_passes_text_through_before_end_of_input(self):
+        import select
+        p = subprocess.Popen(['replace-block', '--max-span-kb', '1', '--pattern-file', self.pattern_file, '-pat', 'hash_block', '-r', "NEW", '-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            head = "".join(f"line {i}\n" for i in range(1000)) + "# begin\nX=1\n# end\n"
+            p.stdin.write(head.encode('utf-8'))
+            p.stdin.flush()
+            # the start of the output arrives while stdin is still open
+            ready, _, _ = select.select([p.stdout], [], [], 30)
+            self.assertTrue(ready)
+            self.assertTrue(os.read(p.stdout.fileno(), 7).startswith(b"line 0"))
+            p.stdin.write(b"tail\n")
+            stdout, stderr = p.communicate()
+        finally:
+            if p.poll() is None:
+                p.kill()
+        self.assertEqual(p.returncode, 0, stderr)
+        self.assertTrue(stdout.endswith(b"line 999\nNEW\ntail\n"), stdout[-50:])
+
+    def test_cli_passes_short_input_through_before_end_of_input(self):
+        import select
+        # much less than the default max span, so only holding back from where a block could begin
+        # lets any of it through before stdin is closed
+        p = subprocess.Popen(['replace-block', '-pat', 'ifdef_slang', '-r', "NEW", '-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            p.stdin.write(b"line 0\nline 1\n\n  `ifdef SLANG\nx\n")
+            p.stdin.flush()
+            ready, _, _ = select.select([p.stdout], [], [], 30)
+            self.assertTrue(ready)
+            self.assertTrue(b"line 0\nline 1\n".startswith(os.read(p.stdout.fileno(), 14)))
+            p.stdin.write(b"`endif\ntail\n")
+            stdout, stderr = p.communicate()
+        finally:
+            if p.poll() is None:
+                p.kill()
+        self.assertEqual(p.returncode, 0, stderr)
+        self.assertTrue(stdout.endswith(b"NEW\ntail\n"), stdout)
+
+    def test_cli_errors_go_to_stderr(self):
+        p = subprocess.run(['replace-block', '-v', '--pattern-file', self.pattern_file, '-pat', 'hash_block', '-r', "NEW", '-'], input="no block\n", capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertEqual(p.stdout, "no block\n")
+        self.assertIn("not found", p.stderr)
+        p = subprocess.run(['replace-block', '-b', '--pattern-file', self.pattern_file, '-pat', 'hash_block', '-r', "NEW", '-'], input="", capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+
+class TestWindowedScan(unittest.TestCase):
+    pattern_toml = "[patterns.hash_block]\nregex = '^# begin.*\\n(.*\\n)*?^# end.*$'\nflags = 'MULTILINE'\nmax_span_kb = 1\n"
+
+    @classmethod
+    def setUpClass(cls):
+        patterns.register('windowed_hash_block', {'regex': r'^# begin.*\n(.*\n)*?^# end.*$', 'flags': 'MULTILINE', 'max_span_kb': 1}, origin="test")
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def write_file(self, name, text):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def random_text(self, rng, num_lines, block_every=0.02):
+        lines = []
+        for i in range(num_lines):
+            if rng.random() < block_every:
+                lines += ["# begin\n"] + [f"X={j}\n" for j in range(rng.randint(0, 5))] + ["# end\n"]
+            lines.append("\n" if rng.random() < 0.2 else f"line {i}\n")
+        return "".join(lines)
+
+    def test_same_line_ranges_as_whole_file(self):
+        rng = random.Random(25)
+        for _ in range(50):
+            filename = self.write_file('in.txt', self.random_text(rng, rng.randint(0, 400)))
+            expected = find_lines_to_replace(filename, patterns['windowed_hash_block']['pat'])
+            # windows much smaller than the file, so blocks cross window boundaries
+            self.assertEqual(find_lines_windowed(filename, 'windowed_hash_block', read_size=13), expected)
+
+    def test_double_spaced_input_is_scanned_in_windows(self):
+        import io
+        text = "x = 1\n\n" * 20000 + "# begin\nX=1\n# end\n"
+        for keep_blank_runs in [False, True]:
+            scan_windows = list(iter_windows(io.BytesIO(text.encode('utf-8')), ['windowed_hash_block'], read_size=512, keep_blank_runs=keep_blank_runs))
+            self.assertGreater(len(scan_windows), 1)
+            # windows stay near the pattern's max span (1 KiB) rather than growing with the input
+            self.assertLess(max(len(scan_window.text) for scan_window in scan_windows[:-1]), 4096)
+            self.assertEqual("".join(scan_window.text for scan_window in scan_windows), text)
+
+    def test_long_lines_are_split_between_windows(self):
+        import contextlib
+        import io
+        text = "z"*20000 + "\n" + "# begin\nX=1\n# end\n" + "y "*20000
+        expected = find_lines_in_buffer(text, patterns['windowed_hash_block']['pat'])
+        scan_windows = list(iter_windows(io.BytesIO(text.encode('utf-8')), ['windowed_hash_block'], read_size=512))
+        self.assertLess(max(len(scan_window.text) for scan_window in scan_windows), 4096)
+        self.assertEqual("".join(scan_window.text for scan_window in scan_windows), text)
+        self.assertEqual([FileLineRange(scan_window.start_line + line_range.start_line, scan_window.start_line + line_range.end_line) for scan_window in scan_windows for line_range in scan_window.line_ranges_by_pattern[0]], expected)
+        # where a match could begin isn't known, so the line is held whole, with a warning
+        patterns.register('windowed_unanchored', {'regex': r'\bX=\d', 'max_span_kb': 1}, origin="test")
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            scan_windows = list(iter_windows(io.BytesIO(text.encode('utf-8')), ['windowed_unanchored'], read_size=512))
+        self.assertEqual("".join(scan_window.text for scan_window in scan_windows), text)
+        self.assertIn("warning: a line of more than 2048 characters", stderr.getvalue())
+
+    def test_pattern_max_span(self):
+        self.assertEqual(max_span_of('windowed_hash_block', 5000), 1024)
+        self.assertEqual(max_span_of('bash_rc_export_path', 5000), 5000)
+        with self.assertRaises(ValueError):
+            patterns.register('windowed_bad_span', {'regex': 'x', 'max_span_kb': 0}, origin="test")
+
+    def test_warns_about_blocks_longer_than_max_span(self):
+        import contextlib
+        import io
+        text = "".join(f"line {i}\n" for i in range(500)) + "# begin\n" + "X=1\n"*300 + "# end\n" + "".join(f"line {i}\n" for i in range(500))
+        filename = self.write_file('in.txt', text)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            find_lines_windowed(filename, 'windowed_hash_block')
+        self.assertIn("warning: a block of", stderr.getvalue())
+        self.assertIn("'windowed_hash_block'", stderr.getvalue())
+
+    def test_cli_same_output_as_whole_file(self):
+        pattern_file = self.write_file('patterns.toml', self.pattern_toml)
+        rng = random.Random(250)
+        for action_options in [[], ['-A', '\n'], ['-P', '\n']]:
+            for block_every in [0.0, 0.01]:
+                text = self.random_text(rng, 1000, block_every)
+                filename = self.write_file('in.txt', text)
+                expected_file = os.path.join(self.temp_dir.name, 'expected.txt')
+                windowed_file = os.path.join(self.temp_dir.name, 'windowed.txt')
+                expected = subprocess.run(['replace-block', *action_options, '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", '-o', expected_file, filename], capture_output=True, text=True)
+                windowed = subprocess.run(['replace-block', *action_options, '--windowed', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", '-o', windowed_file, filename], capture_output=True, text=True)
+                self.assertEqual(windowed.returncode, expected.returncode, windowed.stdout + windowed.stderr)
+                if expected.returncode == 0:
+                    with open(expected_file) as f1, open(windowed_file) as f2:
+                        self.assertEqual(f2.read(), f1.read())
+
+    def test_cli_in_place(self):
+        pattern_file = self.write_file('patterns.toml', self.pattern_toml)
+        text = "".join(f"line {i}\n" for i in range(3000))
+        filename = self.write_file('in.txt', text + "# begin\nX=1\n# end\n" + text)
+        p = subprocess.run(['replace-block', '-y', '--windowed', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout)
+        with open(filename) as f:
+            self.assertEqual(f.read(), text + "NEW\n" + text)
+        # nothing left to replace: an error, and the file is left alone
+        mtime = os.stat(filename).st_mtime_ns
+        p = subprocess.run(['replace-block', '-y', '--windowed', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertIn("not found", p.stdout)
+        self.assertEqual(os.stat(filename).st_mtime_ns, mtime)
+        # with -o, nothing is written when there is nothing to do, as without --windowed
+        outfile = os.path.join(self.temp_dir.name, 'out.txt')
+        p = subprocess.run(['replace-block', '--windowed', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", '-o', outfile, filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertFalse(os.path.exists(outfile))
+        self.assertEqual([name for name in os.listdir(self.temp_dir.name) if name.endswith('.tmp')], [])
+        p = subprocess.run(['replace-block', '-y', '--windowed', '-dry', '--pattern-file', pattern_file, '-pat', 'hash_block', '-r', "NEW", filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+
+class TestMultipleRules(unittest.TestCase):
+    # a bashrc block and an `ifdef SLANG block in the same file
+    test_file_str = TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file + TestSlangReplacer.test_file_str
+
+    def write_temp_file(self, contents:str)->str:
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        temp.write(contents)
+        temp.close()
+        self.addCleanup(os.unlink, temp.name)
+        return temp.name
+
+    def find(self, filename:str, pattern_name:str)->list[FileLineRange]:
+        return find_lines_to_replace(filename, patterns[pattern_name]['pat'])
+
+    def test_same_as_one_rule_at_a_time(self):
+        filename = self.write_temp_file(self.test_file_str)
+        replace_or_insert_block(filename, self.find(filename, 'bash_rc_export_path'), ActionIfBlockNotFound.REPLACE_ONLY, TestReplaceBlockBashRc.test_replacement_text)
+        replace_or_insert_block(filename, self.find(filename, 'ifdef_slang'), ActionIfBlockNotFound.REPLACE_ONLY, TestSlangReplacer.replacement_text)
+        with open(filename, 'r') as f:
+            expected_file_str = f.read()
+
+        filename = self.write_temp_file(self.test_file_str)
+        rule_matches = [
+            RuleMatch('bash_rc_export_path', self.find(filename, 'bash_rc_export_path'), TestReplaceBlockBashRc.test_replacement_text),
+            RuleMatch('ifdef_slang', self.find(filename, 'ifdef_slang'), TestSlangReplacer.replacement_text),
+        ]
+        replace_or_insert_blocks(filename, rule_matches, ActionIfBlockNotFound.REPLACE_ONLY)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), expected_file_str)
+
+    def test_append_unmatched_rules_in_order(self):
+        filename = self.write_temp_file("A\nB\n")
+        replace_or_insert_blocks(filename, [RuleMatch('one', [], "1\n"), RuleMatch('two', [], "2\n")], ActionIfBlockNotFound.REPLACE_OR_APPEND)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), "A\nB\n1\n2\n")
+        replace_or_insert_blocks(filename, [RuleMatch('one', [], "3\n"), RuleMatch('two', [FileLineRange(0, 1)], "a\n")], ActionIfBlockNotFound.REPLACE_OR_PREPEND)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), "3\na\n1\n2\n")
+
+    def test_overlapping_blocks_conflict(self):
+        filename = self.write_temp_file("0\n1\n2\n3\n4\n")
+        with self.assertRaises(RuleConflictError):
+            replace_or_insert_blocks(filename, [RuleMatch('one', [FileLineRange(0, 2)], "x\n"), RuleMatch('two', [FileLineRange(2, 3)], "y\n")], ActionIfBlockNotFound.REPLACE_ONLY)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), "0\n1\n2\n3\n4\n")
+        # adjacent blocks are fine
+        replace_or_insert_blocks(filename, [RuleMatch('one', [FileLineRange(0, 1)], "x\n"), RuleMatch('two', [FileLineRange(2, 3)], "y\n")], ActionIfBlockNotFound.REPLACE_ONLY)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.read(), "x\ny\n4\n")
+
+    def test_cli_rule_pairs(self):
+        filename = self.write_temp_file(self.test_file_str)
+        outfile = filename + ".out"
+        self.addCleanup(lambda: os.path.exists(outfile) and os.unlink(outfile))
+        p = subprocess.run(['replace-block', '-pat', 'bash_rc_export_path', '-r', 'X=1', '-pat', 'ifdef_slang', '-r', '', '-o', outfile, filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+        with open(outfile, 'r') as f:
+            output = f.read()
+        self.assertIn("X=1\n", output)
+        self.assertNotIn("github.com", output)
+        self.assertNotIn("`ifdef", output)
+
+        p = subprocess.run(['replace-block', '-pat', 'bash_rc_export_path', '-r', 'X=1', '-pat', 'ifdef_slang', '-o', outfile, filename], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertIn("exactly one -r/--replacement for each", p.stdout)
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        os.makedirs(os.path.join(self.temp_dir.name, 'hosts', 'a'))
+        os.makedirs(os.path.join(self.temp_dir.name, 'hosts', 'b'))
+        self.bashrc_a = self.write('hosts/a/.bashrc', TestMultipleRules.test_file_str)
+        self.bashrc_b = self.write('hosts/b/.bashrc', "A\nB\n")
+        self.write('path.sh', "X=1\n")
+
+    def write(self, name:str, contents:str)->str:
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def read(self, path:str)->str:
+        with open(path, 'r') as f:
+            return f.read()
+
+    def test_jobs_grouped_by_file(self):
+        manifest = self.write('jobs.toml', '''
+[[jobs]]
+files = "hosts/*/.bashrc"
+pattern = "bash_rc_export_path"
+replacement = "@path.sh"
+action = "append"
+prefix = "\\n"
+blank_lines = [1, 1]
+
+[[jobs]]
+files = ["hosts/a/.bashrc"]
+pattern = "ifdef_slang"
+replacement = "@path.sh"
+''')
+        jobs = load_manifest(manifest)
+        self.assertEqual(jobs[0].files, [self.bashrc_a, self.bashrc_b])
+        self.assertEqual(jobs[0].rule.action, ActionIfBlockNotFound.REPLACE_OR_APPEND)
+        self.assertEqual(jobs[0].rule.affix, "\n")
+        self.assertEqual(jobs[0].rule.blank_line_control, (1, 1))
+        self.assertEqual(jobs[1].rule.action, ActionIfBlockNotFound.REPLACE_ONLY)
+        # the shared replacement file is read once
+        self.assertIs(jobs[0].rule.replacement_text, jobs[1].rule.replacement_text)
+
+        rules_by_file = group_rules_by_file(jobs)
+        self.assertEqual(list(rules_by_file), [self.bashrc_a, self.bashrc_b])
+        self.assertEqual([rule.pattern_name for rule in rules_by_file[self.bashrc_a]], ['bash_rc_export_path', 'ifdef_slang'])
+        self.assertEqual([rule.pattern_name for rule in rules_by_file[self.bashrc_b]], ['bash_rc_export_path'])
+
+    def test_bad_manifests(self):
+        for body, message in [
+            ('[[jobs]]\nfiles = "hosts/a/.bashrc"\npattern = "x"\ncolour = "red"\n', "unknown key(s) colour"),
+            ('[[jobs]]\nfiles = "hosts/a/missing"\npattern = "x"\n', "file 'hosts/a/missing' not found"),
+            ('[[jobs]]\nfiles = "hosts/a/.bashrc"\npattern = "x"\naction = "delete"\n', "action must be one of"),
+            ('[[jobs]]\nfiles = "hosts/a/.bashrc"\npattern = "x"\nsuffix = "\\n"\n', "'suffix' only applies"),
+            ('[[jobs]]\nfiles = "hosts/a/.bashrc"\npattern = "x"\nreplacement = "@nope.sh"\n', "replacement file 'nope.sh' not found"),
+            ('title = "no jobs"\n', "no [[jobs]] entries"),
+        ]:
+            with self.assertRaises(ValueError) as cm:
+                load_manifest(self.write('bad.toml', body))
+            self.assertIn(message, str(cm.exception))
+        jobs = load_manifest(self.write('twice.toml', '[[jobs]]\nfiles = "hosts/*/.bashrc"\npattern = "x"\n[[jobs]]\nfiles = "hosts/a/.bashrc"\npattern = "x"\n'))
+        with self.assertRaises(ValueError):
+            group_rules_by_file(jobs)
+
+    def test_cli_manifest(self):
+        manifest = self.write('jobs.json', '''{"jobs": [
+            {"files": ["hosts/**/.bashrc"], "pattern": "bash_rc_export_path", "replacement": "@path.sh", "action": "append"},
+            {"files": "hosts/a/.bashrc", "pattern": "ifdef_slang"}
+        ]}''')
+        for jobs in ['1', '2']:
+            self.write('hosts/a/.bashrc', TestMultipleRules.test_file_str)
+            self.write('hosts/b/.bashrc', "A\nB\n")
+            p = subprocess.run(['replace-block', '-y', '-j', jobs, '--manifest', manifest], capture_output=True, text=True)
+            self.assertEqual(p.returncode, 0, p.stdout + p.stderr)
+            output = self.read(self.bashrc_a)
+            self.assertIn("X=1\n", output)
+            self.assertNotIn("github.com", output)
+            self.assertNotIn("`ifdef", output)
+            self.assertEqual(self.read(self.bashrc_b), "A\nB\nX=1\n")
+
+        p = subprocess.run(['replace-block', '-y', '--manifest', manifest, '-pat', 'ifdef_slang'], capture_output=True, text=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertIn("--manifest can't be combined", p.stdout)
+
+class TestImportTime(unittest.TestCase):
+    # modules that a plain replace-block run (no --dry-run, --backup, --jobs, --recursive or pattern
+    # files) has no use for, and so must not import
+    unneeded_modules = ['unittest', 'subprocess', 'tempfile', 'shutil', 'json', 'datetime', 'traceback', 'importlib.metadata', 'concurrent.futures', 'tomllib', 'file_transform_tools.util.backup_store', 'file_transform_tools.util.diff_render', 'file_transform_tools.util.match_cache']
+
+    # generous, so this only fails if startup gets noticeably slower, not on a slow machine
+    import_time_budget_us = 250_000
+
+    def run_with_importtime(self, python_args:list[str])->dict[str,int]:
+        """
+        Runs python with -X importtime (and -S, so only the imports made by our code are reported) from the
+        repo root and returns {module name: cumulative import time in us}.
+        """
+        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.run([sys.executable, '-S', '-X', 'importtime'] + python_args, cwd=repo_root, capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        import_times = {}
+        for line in p.stderr.splitlines():
+            if line.startswith('import time:'):
+                _, cumulative_us, name = line[len('import time:'):].split('|')
+                # skip the header line
+                if cumulative_us.strip().isdigit():
+                    import_times[name.strip()] = int(cumulative_us)
+        return import_times
+
+    def test_import_does_not_load_unneeded_modules(self):
+        import_times = self.run_with_importtime(['-c', 'import file_transform_tools.replace_block'])
+        self.assertIn('file_transform_tools.replace_block', import_times)
+        for module in self.unneeded_modules:
+            self.assertNotIn(module, import_times)
+
+    def test_cli_import_leaves_unneeded_modules_out_of_sys_modules(self):
+        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.run([sys.executable, '-S', '-c', 'import sys, file_transform_tools.util.cli, file_transform_tools.replace_block; print("\\n".join(sys.modules))'], cwd=repo_root, capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        loaded = set(p.stdout.splitlines())
+        self.assertIn('file_transform_tools.util.cli', loaded)
+        for module in ['file_transform_tools.util.backup_store', 'file_transform_tools.util.diff_render', 'file_transform_tools.util.match_cache']:
+            self.assertNotIn(module, loaded)
+
+    def test_cli_run_does_not_load_unneeded_modules(self):
+        temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        temp.write(TestReplaceBlockBashRc.test_file_str_contains_block_in_middle_of_file)
+        temp.close()
+        outfile = temp.name + ".out"
+        try:
+            import_times = self.run_with_importtime(['-c', 'import sys; from file_transform_tools.replace_block import main; sys.exit(main())', '-pat', 'bash_rc_export_path', '-r', 'X=1\n', '-o', outfile, temp.name])
+            for module in self.unneeded_modules:
+                # argparse imports shutil itself (to get the terminal width)
+                if module != 'shutil':
+                    self.assertNotIn(module, import_times)
+            with open(outfile, 'r') as f:
+                self.assertIn("X=1\n", f.read())
+        finally:
+            os.unlink(temp.name)
+            if os.path.exists(outfile):
+                os.unlink(outfile)
+
+    def test_import_time_budget(self):
+        # best of a few runs, to smooth out noise from whatever else the machine is doing
+        best_us = min(self.run_with_importtime(['-c', 'import file_transform_tools.replace_block'])['file_transform_tools'] for _ in range(3))
+        self.assertLess(best_us, self.import_time_budget_us, f"importing file_transform_tools.replace_block took {best_us}us")
+
 class TestSubprocessInvoke(unittest.TestCase):
     def test_subprocess_invoke_prepend(self):
         temp = tempfile.NamedTemporaryFile(mode='w', delete=False)
@@ -559,16 +2087,40 @@ def main():
     
     # Add all test cases from this file
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestFindLinesToReplaceBashRc))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLineOffsetIndex))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestFindLinesToReplaceMmap))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestReplaceBlockBashRc))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestVectors))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestReadOnce))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestRequiredLiterals))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBlockPattern))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSpliceLines))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSlangReplacer))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestCorrectNewlinesMatchesReference))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestParallelJobs))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestRecursiveWalk))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestAtomicWrite))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestNoOpWrite))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestMatchCache))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBackupStrategies))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBackupStore))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestDiffRender))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestEmitPatch))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestTransformText))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestAsyncTransform))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestStreamFilter))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestWindowedScan))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestMultipleRules))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestManifest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestImportTime))
 
     # these tests are currently failing...
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPrependAndAppendWithNewLineControl))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSubprocessInvoke))
 
-    # Add test cases from re_pattern_library.py
+    # Add test cases from test_patterns.py
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPatterns))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPatternRegistry))
     
     # Run the combined test suite
     runner = unittest.TextTestRunner()